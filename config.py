@@ -11,6 +11,21 @@ class Config:
         dbname=os.environ['POSTGRES_DB'],
     )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    COLUMNAR_YLT_MIN_YEARS = 10000  # Store the YLTs with at least this number of rows as compressed blobs
+    SIMULATION_YEARS = 100000  # Default number of years simulated for a loss model
+    BACKGROUND_CALLBACK_CACHE_DIR = os.environ.get('BACKGROUND_CALLBACK_CACHE_DIR', '/tmp/flaskdash-jobs')
+    PRICING_JOB_QUEUE = os.environ.get('PRICING_JOB_QUEUE', 'local')  # local: Dash background process, database: workers
+    PRICING_JOB_STALE_TIMEOUT = 3600  # Requeue the running jobs without progress for this number of seconds
+    PRICING_JOB_QUEUE_TIMEOUT = 600  # Fail the jobs queued for this number of seconds, e.g. without a worker
+    FIT_CACHE_DIR = os.environ.get('FIT_CACHE_DIR', '/tmp/flaskdash-fits')
+    FIT_CACHE_SIZE_LIMIT = 2 ** 28  # Bytes of fits kept on disk, the least recently used are evicted above
+    RESULT_QUANTILES = [.999, .998, .996, .995, .99, .98, .9667, .96, .95, .9, .8, .5]  # OEP and TVaR of the results
+    COMPARISON_CACHE_DIR = os.environ.get('COMPARISON_CACHE_DIR', '/tmp/flaskdash-comparisons')
+    COMPARISON_CACHE_SIZE_LIMIT = 2 ** 30  # Bytes of annual ceded amounts and comparisons kept on disk
+    TAIL_CACHE_DIR = os.environ.get('TAIL_CACHE_DIR', '/tmp/flaskdash-tails')
+    TAIL_CACHE_SIZE_LIMIT = 2 ** 30  # Bytes of sorted YLTs of the result layers kept on disk
+    PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR', '/tmp/flaskdash-pages')
+    PAGE_CACHE_SIZE_LIMIT = 2 ** 30  # Bytes of decoded YLTs paged in the grids kept on disk
 
 
 class SQLiteConfig:
@@ -19,3 +34,18 @@ class SQLiteConfig:
     DBNAME = 'app_db.db'
     SQLALCHEMY_DATABASE_URI = f'sqlite:///{BASE_DIR}/{DBNAME}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    COLUMNAR_YLT_MIN_YEARS = 10000  # Store the YLTs with at least this number of rows as compressed blobs
+    SIMULATION_YEARS = 100000  # Default number of years simulated for a loss model
+    BACKGROUND_CALLBACK_CACHE_DIR = os.environ.get('BACKGROUND_CALLBACK_CACHE_DIR', '/tmp/flaskdash-jobs')
+    PRICING_JOB_QUEUE = os.environ.get('PRICING_JOB_QUEUE', 'local')  # local: Dash background process, database: workers
+    PRICING_JOB_STALE_TIMEOUT = 3600  # Requeue the running jobs without progress for this number of seconds
+    PRICING_JOB_QUEUE_TIMEOUT = 600  # Fail the jobs queued for this number of seconds, e.g. without a worker
+    FIT_CACHE_DIR = os.environ.get('FIT_CACHE_DIR', '/tmp/flaskdash-fits')
+    FIT_CACHE_SIZE_LIMIT = 2 ** 28  # Bytes of fits kept on disk, the least recently used are evicted above
+    RESULT_QUANTILES = [.999, .998, .996, .995, .99, .98, .9667, .96, .95, .9, .8, .5]  # OEP and TVaR of the results
+    COMPARISON_CACHE_DIR = os.environ.get('COMPARISON_CACHE_DIR', '/tmp/flaskdash-comparisons')
+    COMPARISON_CACHE_SIZE_LIMIT = 2 ** 30  # Bytes of annual ceded amounts and comparisons kept on disk
+    TAIL_CACHE_DIR = os.environ.get('TAIL_CACHE_DIR', '/tmp/flaskdash-tails')
+    TAIL_CACHE_SIZE_LIMIT = 2 ** 30  # Bytes of sorted YLTs of the result layers kept on disk
+    PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR', '/tmp/flaskdash-pages')
+    PAGE_CACHE_SIZE_LIMIT = 2 ** 30  # Bytes of decoded YLTs paged in the grids kept on disk
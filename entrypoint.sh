@@ -8,4 +8,4 @@ while true; do
     echo Upgrade command failed, retrying in 5 secs...
     sleep 5
 done
-exec gunicorn -b :5000 --access-logfile - --error-logfile - app:app
\ No newline at end of file
+exec gunicorn -b :5000 --workers ${GUNICORN_WORKERS:-4} --access-logfile - --error-logfile - app:app
\ No newline at end of file
@@ -1,8 +1,9 @@
 from flask import Flask
 from config import Config
-from dash import Dash
+from dash import Dash, DiskcacheManager
 import dash_bootstrap_components as dbc
 from flask.helpers import get_root_path
+import diskcache
 
 
 def create_app():
@@ -11,6 +12,7 @@ def create_app():
 
     register_extensions(app)
     register_blueprints(app)
+    register_commands(app)
     register_dashapp(app)
 
     from flaskapp import models
@@ -21,15 +23,30 @@ def create_app():
 def register_extensions(app):
     from flaskapp.extensions import db
     from flaskapp.extensions import migrate
+    from flaskapp.extensions import enable_sqlite_savepoints
 
     db.init_app(app)
     migrate.init_app(app, db)
 
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            enable_sqlite_savepoints(db.engine)
+
 
 def register_blueprints(app):
     from flaskapp.views.home import home
+    from flaskapp.views.export import export
 
     app.register_blueprint(home)
+    app.register_blueprint(export)
+
+
+def register_commands(app):
+    from flaskapp.commands import pricing_worker, price, delete_ylt_blobs
+
+    app.cli.add_command(pricing_worker)
+    app.cli.add_command(price)
+    app.cli.add_command(delete_ylt_blobs)
 
 
 def register_dashapp(flask_app):
@@ -40,6 +57,12 @@ def register_dashapp(flask_app):
     meta_viewport = {
         "name": "viewport", "content": "width=device-width, initial-scale=1, shrink-to-fit=no"}
 
+    # Run the background callbacks (e.g. the pricing) in separate processes, outside the web workers
+    # The disk cache is shared by all the gunicorn workers, so that any of them can answer the progress requests
+    # https://dash.plotly.com/background-callbacks
+    cache = diskcache.Cache(flask_app.config['BACKGROUND_CALLBACK_CACHE_DIR'])
+    background_callback_manager = DiskcacheManager(cache)
+
     dashapp = Dash(
         __name__,
         server=flask_app,
@@ -48,6 +71,7 @@ def register_dashapp(flask_app):
         use_pages=True,
         pages_folder='dashapp/pages',
         meta_tags=[meta_viewport],
+        background_callback_manager=background_callback_manager,
         # external_stylesheets=[dbc.themes.SKETCHY],
         external_stylesheets=[dbc.themes.COSMO],
     )
@@ -0,0 +1,99 @@
+"""
+This module defines the Flask CLI commands of the application, registered in flaskapp.create_app.
+
+Commands:
+- flask pricing-worker: Start worker processes executing the pricing jobs queued in the job table.
+- flask price: Price a selection of analyses by batches, in parallel, without the Dash app.
+- flask delete-ylt-blobs: Delete the YLT blobs referenced by no model file.
+
+"""
+
+from datetime import datetime
+from flask.cli import with_appcontext
+import click
+import multiprocessing
+import time
+
+
+@click.command('pricing-worker')
+@click.option('--processes', '-n', default=1, show_default=True, help='Number of worker processes.')
+@click.option('--poll-interval', default=2.0, show_default=True, help='Seconds between two polls of an empty queue.')
+@click.option('--burst', is_flag=True, help='Stop the workers when the queue is empty.')
+@with_appcontext
+def pricing_worker(processes, poll_interval, burst):
+    """ Execute the pricing jobs queued by the Dash app (PRICING_JOB_QUEUE = 'database'). """
+    from flaskapp.pricing.jobs import run_worker
+
+    if processes == 1:
+        run_worker(poll_interval, burst=burst)
+        return
+
+    # Each worker process creates its own application, hence its own database connections
+    context = multiprocessing.get_context('spawn')
+    workers = [
+        context.Process(target=run_worker_process, args=(poll_interval, burst), daemon=False)
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def run_worker_process(poll_interval, burst):
+    from flaskapp import create_app
+    from flaskapp.pricing.jobs import run_worker
+
+    app = create_app()
+    with app.app_context():
+        run_worker(poll_interval, burst=burst)
+
+
+@click.command('price')
+@click.argument('analysis_ids', nargs=-1, type=int)
+@click.option('--client', help='Price only the analyses of this client.')
+@click.option('--quote-min', type=int, help='Price only the analyses with a quote greater than or equal to this one.')
+@click.option('--quote-max', type=int, help='Price only the analyses with a quote lower than or equal to this one.')
+@click.option('--name', help='Name of the result files. Defaults to "Batch" followed by the current date and time.')
+@click.option('--processes', '-n', default=1, show_default=True, help='Number of worker processes.')
+@click.option('--batch-size', default=10, show_default=True, help='Number of analyses committed together.')
+@click.option('--no-reuse', is_flag=True, help='Price all the layers again, even the unchanged ones.')
+@with_appcontext
+def price(analysis_ids, client, quote_min, quote_max, name, processes, batch_size, no_reuse):
+    """ Price the given ANALYSIS_IDS, or all the analyses matching the filters, and save their result files. """
+    from flaskapp.pricing.batch import get_analysis_ids, run_batches
+
+    analysis_ids = get_analysis_ids(analysis_ids, client=client, quote_min=quote_min, quote_max=quote_max)
+    if not analysis_ids:
+        click.echo('No analysis to price')
+        return
+
+    name = name or f'Batch {datetime.now():%Y-%m-%d %H:%M}'
+    click.echo(f'Pricing {len(analysis_ids)} analyses with {processes} process(es), name: {name}')
+
+    start = time.perf_counter()
+    priced = failed = layers = 0
+
+    for outcome in run_batches(analysis_ids, name, processes, batch_size, reuse=not no_reuse):
+        if outcome['error'] is None:
+            priced += 1
+            layers += outcome['layers']
+            click.echo(f'Analysis {outcome["analysis_id"]}: result file {outcome["resultfile_id"]}, '
+                       f'{outcome["layers"]} layers in {outcome["seconds"]:.2f}s')
+        else:
+            failed += 1
+            click.echo(f'Analysis {outcome["analysis_id"]}: failed in {outcome["seconds"]:.2f}s: {outcome["error"]}',
+                       err=True)
+
+    elapsed = time.perf_counter() - start
+    click.echo(f'Priced {priced} analyses ({layers} layers) in {elapsed:.1f}s: '
+               f'{priced / elapsed:.2f} analyses/s, {layers / elapsed:.2f} layers/s. Failed: {failed}')
+
+
+@click.command('delete-ylt-blobs')
+@with_appcontext
+def delete_ylt_blobs():
+    """ Delete the YLT blobs referenced by no model file, e.g. after deleting rows with SQL. """
+    from flaskapp.pricing.columnar import delete_unreferenced_yltblobs
+
+    click.echo(f'Deleted {delete_unreferenced_yltblobs()} YLT blobs')
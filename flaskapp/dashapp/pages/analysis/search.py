@@ -1,4 +1,5 @@
 from flaskapp.dashapp.pages.utils import *
+from flaskapp.pricing.columnar import delete_unreferenced_yltblobs
 
 dash.register_page(__name__, path='/')
 page_id = get_page_id(__name__)
@@ -105,5 +106,6 @@ def delete_analyses(n_clicks, selectedRows):
         return no_update
     else:
         session.commit()
+        delete_unreferenced_yltblobs()  # The YLTs shared with no other analysis
         return {'remove': selectedRows}
         # TODO: Add a modal to ask the user to confirm the deletion
@@ -17,6 +17,13 @@ def layout(analysis_id):
         # https://stackoverflow.com/questions/13784192/creating-an-empty-pandas-dataframe-and-then-filling-it
         df = pd.DataFrame([])
 
+    # Occurrence excess of loss layers, priced over the event loss tables of their model files, see flaskapp.pricing.xs
+    # The values are kept as numbers, occ_deduct being optional
+    rowData_xs = [
+        {column.name: getattr(xslayer, column.name) for column in LayerXS.__table__.columns}
+        for xslayer in sorted(analysis.xslayers, key=lambda xslayer: (xslayer.display_order, xslayer.id))
+    ]
+
     return html.Div([
         dcc.Store(id=page_id + 'store', data={'analysis_id': analysis_id}),
         own_title(__name__, analysis.name),
@@ -92,6 +99,50 @@ def layout(analysis_id):
                     ),
                 ], width=12)
             ]),
+            dbc.Row([
+                dbc.Col([
+                    own_button(page_id + 'btn-create-xs', 'Add XS Layer'),
+                    own_button(page_id + 'btn-save-xs', 'Save XS Layers'),
+                    own_button(page_id + 'btn-delete-xs', 'Delete XS Layers'),
+                ], width=5),
+                dbc.Col([
+                    html.Div(id=page_id + 'div-xslayers-modif'),
+                ], width=7),
+            ]),
+            dbc.Row([
+                dbc.Col([
+                    # The terms of the excess of loss layers are amounts, in the currency of the event losses
+                    dag.AgGrid(
+                        id=page_id + 'grid-xslayers',
+                        rowData=rowData_xs,
+                        columnDefs=[
+                            {'field': 'id', 'hide': True},
+                            {'field': 'analysis_id', 'hide': True},
+                            {'field': 'display_order', 'hide': True},
+                            {
+                                'field': 'name',
+                                'checkboxSelection': True, 'headerCheckboxSelection': True,
+                                'rowDrag': True,
+                            },
+                        ] + [
+                            {'field': field, 'valueFormatter': {'function': 'd3.format(",d")(params.value)'}}
+                            for field in ['premium', 'occ_limit', 'occ_deduct', 'agg_limit', 'agg_deduct']
+                        ],
+                        getRowId='params.data.id',
+                        defaultColDef={
+                            'flex': True,
+                            'editable': True,
+                        },
+                        columnSize='responsiveSizeToFit',
+                        dashGridOptions={
+                            'domLayout': 'autoHeight',
+                            'rowSelection': 'multiple',
+                            'rowDragManaged': True, 'rowDragMultiRow': True, 'animateRows': True
+                        },
+                        className='ag-theme-alpine custom mb-2',
+                    ),
+                ], width=12)
+            ]),
         ], className='div-standard')
     ])
 
@@ -233,3 +284,100 @@ def save_layers(n_clicks, virtualRowData):
             className='text-center',
         )
     return alert
+
+
+@callback(
+    Output(page_id + 'grid-xslayers', 'rowTransaction', allow_duplicate=True),
+    Output(page_id + 'div-xslayers-modif', 'children', allow_duplicate=True),
+    Input(page_id + 'btn-create-xs', 'n_clicks'),
+    State(page_id + 'store', 'data'),
+    config_prevent_initial_callbacks=True
+)
+def create_xslayer(n_clicks, data):
+    analysis_id = data['analysis_id']
+    analysis = session.get(Analysis, analysis_id)
+
+    # Set the layer default parameters values, the new layer being displayed in the last position
+    xslayer = LayerXS(name='Enter a name', premium=0, occ_limit=0, agg_limit=0, agg_deduct=0, display_order=999)
+    analysis.xslayers.append(xslayer)
+    session.commit()
+
+    newRow = {
+        'id': xslayer.id,
+        'name': xslayer.name,
+        'premium': xslayer.premium,
+        'occ_limit': xslayer.occ_limit,
+        'occ_deduct': xslayer.occ_deduct,
+        'agg_limit': xslayer.agg_limit,
+        'agg_deduct': xslayer.agg_deduct,
+        'display_order': xslayer.display_order,
+        'analysis_id': analysis_id,
+    }
+
+    alert = dbc.Alert(
+        'The XS layers have been modified. Save the changes with the Save button',
+        color='danger',
+        className='text-center',
+    )
+
+    return {'add': [newRow]}, alert
+
+
+@callback(
+    Output(page_id + 'grid-xslayers', 'rowTransaction'),
+    Output(page_id + 'div-xslayers-modif', 'children', allow_duplicate=True),
+    Input(page_id + 'btn-delete-xs', 'n_clicks'),
+    State(page_id + 'grid-xslayers', 'selectedRows'),
+    config_prevent_initial_callbacks=True
+)
+def delete_xslayers(n_clicks, selectedRows):
+    if not selectedRows:
+        raise PreventUpdate
+
+    for row in selectedRows:
+        session.delete(session.get(LayerXS, row['id']))
+    session.commit()
+
+    alert = dbc.Alert(
+        'The XS layers have been deleted',
+        duration=3000,
+        className='text-center',
+    )
+
+    return {'remove': selectedRows}, alert
+
+
+@callback(
+    Output(page_id + 'div-xslayers-modif', 'children'),
+    Input(page_id + 'btn-save-xs', 'n_clicks'),
+    State(page_id + 'grid-xslayers', 'virtualRowData'),  # Use virtualRowData instead of rowData to get the rows order
+    config_prevent_initial_callbacks=True
+)
+def save_xslayers(n_clicks, virtualRowData):
+    try:
+        for display_order, row in enumerate(virtualRowData or []):
+            xslayer = session.get(LayerXS, row['id'])
+            xslayer.name = row['name']
+            for attr in ['premium', 'occ_limit', 'occ_deduct', 'agg_limit', 'agg_deduct']:
+                if attr == 'occ_deduct' and row.get(attr) in [None, '']:
+                    xslayer.occ_deduct = None
+                    continue
+                try:
+                    setattr(xslayer, attr, int(row[attr]))
+                except (TypeError, ValueError):
+                    raise ValueError(f'The {attr} of the XS layer {row["name"]} must be an integer')
+            xslayer.display_order = display_order
+        session.commit()
+
+        alert = dbc.Alert(
+            'The changes have been saved',
+            className='text-center',
+        )
+    except ValueError as e:
+        session.rollback()
+        alert = dbc.Alert(
+            str(e),
+            color='danger',
+            className='text-center',
+        )
+    return alert
@@ -0,0 +1,180 @@
+from flaskapp.dashapp.pages.utils import *
+from flask import current_app
+from flaskapp.pricing.copula import COPULAS, simulate_correlated_modelfiles
+from flaskapp.pricing.rng import new_seed
+from flaskapp.pricing.sampling import SAMPLING_METHODS
+
+directory = get_directory(__name__)['directory']
+page = get_directory(__name__)['page']
+dash.register_page(__name__, path_template=f'/{directory}/{page}/<analysis_id>', order=33)
+page_id = get_page_id(__name__)
+
+
+def get_field(modelfile_id):
+    return f'modelfile_{modelfile_id}'
+
+
+def layout(analysis_id):
+    analysis = session.get(Analysis, analysis_id)
+
+    # The correlation matrix is edited in a grid with one row and one column by model file, the identity by default
+    rowData = [
+        {'id': row.id, 'name': row.name}
+        | {get_field(col.id): 1 if row.id == col.id else 0 for col in analysis.modelfiles}
+        for row in analysis.modelfiles
+    ]
+    columnDefs = [
+        {'field': 'id', 'hide': True},
+        {'field': 'name', 'editable': False, 'checkboxSelection': True, 'headerCheckboxSelection': True},
+    ] + [
+        {'field': get_field(modelfile.id), 'headerName': modelfile.name, 'type': 'numericColumn'}
+        for modelfile in analysis.modelfiles
+    ]
+
+    return html.Div([
+        dcc.Store(id=page_id + 'store', data={'analysis_id': analysis_id}),
+        own_title(__name__, analysis.name),
+        own_nav_middle(__name__, analysis.id),
+        own_nav_bottom(__name__, analysis.id),
+
+        html.Div([
+            dbc.Row([
+                dbc.Col([
+                    html.Div('1. Select the model files and enter their correlations:', className='h5 mb-3'),
+                    dag.AgGrid(
+                        id=page_id + 'grid-correlation',
+                        rowData=rowData,
+                        columnDefs=columnDefs,
+                        getRowId='params.data.id',
+                        defaultColDef={'editable': True},
+                        columnSize='responsiveSizeToFit',
+                        dashGridOptions={
+                            'domLayout': 'autoHeight',
+                            'rowSelection': 'multiple',
+                        },
+                        className='ag-theme-alpine custom mb-4',
+                    ),
+                ]),
+            ]),
+            dbc.Row([
+                dbc.Col([
+                    html.Div('2. Simulate the correlated model files:', className='h5 mb-3'),
+                ]),
+            ]),
+            dbc.Row([
+                dbc.Col([
+                    dmc.Select(
+                        id=page_id + 'select-copula',
+                        label='Copula',
+                        data=COPULAS,
+                        value=COPULAS[0],
+                    ),
+                ], width=2),
+                dbc.Col([
+                    dmc.NumberInput(
+                        id=page_id + 'input-df',
+                        label='Degrees of freedom (t copula)',
+                        value=4,
+                        min=1,
+                    ),
+                ], width=2),
+                dbc.Col([
+                    dmc.NumberInput(
+                        id=page_id + 'input-n-years',
+                        label='Simulated years',
+                        value=current_app.config.get('SIMULATION_YEARS'),
+                        min=1,
+                        step=10000,
+                    ),
+                ], width=2),
+                dbc.Col([
+                    dmc.NumberInput(
+                        id=page_id + 'input-seed',
+                        label='Seed (random if empty)',
+                        min=0,
+                    ),
+                ], width=2),
+                dbc.Col([
+                    dmc.Select(
+                        id=page_id + 'select-sampling',
+                        label='Sampling method',
+                        data=[{'value': key, 'label': label} for key, label in SAMPLING_METHODS.items()],
+                        value='random',
+                    ),
+                ], width=2),
+            ], className='mb-3'),
+            dbc.Row([
+                dbc.Col([
+                    own_button(page_id + 'btn-simulate', 'Simulate'),
+                    dcc.Loading(
+                        html.Div(id=page_id + 'div-info'),
+                        id=page_id + 'loading-info',
+                    ),
+                ]),
+            ]),
+        ], className='div-standard')
+    ])
+
+
+def get_correlation(rowData, selectedRows):
+    # Sub-matrix of the selected model files, in the order of the grid
+    selected_ids = {row['id'] for row in selectedRows}
+    rows = [row for row in rowData if row['id'] in selected_ids]
+    try:
+        return [row['id'] for row in rows], np.array([
+            [float(row[get_field(col['id'])]) for col in rows] for row in rows
+        ])
+    except (TypeError, ValueError):
+        raise ValueError('Enter a number in each cell of the correlation matrix')
+
+
+@callback(
+    Output(page_id + 'div-info', 'children'),
+    Input(page_id + 'btn-simulate', 'n_clicks'),
+    State(page_id + 'store', 'data'),
+    State(page_id + 'grid-correlation', 'rowData'),
+    State(page_id + 'grid-correlation', 'selectedRows'),
+    State(page_id + 'select-copula', 'value'),
+    State(page_id + 'input-df', 'value'),
+    State(page_id + 'input-n-years', 'value'),
+    State(page_id + 'input-seed', 'value'),
+    State(page_id + 'select-sampling', 'value'),
+    config_prevent_initial_callbacks=True
+)
+def simulate(n_clicks, data, rowData, selectedRows, copula, df, n_years, seed, method):
+    if not selectedRows or len(selectedRows) < 2:
+        return dbc.Alert('Select at least 2 model files', color='danger', duration=4000)
+
+    # Check the inputs before simulating, the degrees of freedom apply to the t copula only
+    try:
+        n_years = int(n_years)
+        seed = new_seed() if seed in [None, ''] else int(seed)
+        df = 4 if df in [None, ''] else float(df)
+    except (TypeError, ValueError):
+        return dbc.Alert('The number of years, the seed and the degrees of freedom must be numbers', color='danger',
+                         duration=4000)
+    if method not in SAMPLING_METHODS:
+        return dbc.Alert('Select a sampling method', color='danger', duration=4000)
+
+    analysis = session.get(Analysis, data['analysis_id'])
+    start = time.perf_counter()
+
+    try:
+        modelfile_ids, correlation = get_correlation(rowData, selectedRows)
+        modelfiles = [session.get(ModelFile, modelfile_id) for modelfile_id in modelfile_ids]
+        simulation = simulate_correlated_modelfiles(
+            analysis, modelfiles, correlation, n_years, seed, copula, df, method=method)
+    except ValueError as e:
+        session.rollback()
+        return dbc.Alert(str(e), color='danger', duration=4000)
+    session.commit()
+
+    info = f'{len(simulation["modelfiles"])} correlated model files of {n_years:,} years simulated with ' \
+           f'the seed {seed} and the {SAMPLING_METHODS[method]} sampling in {time.perf_counter() - start:.1f} s'
+    if simulation['variance_reduction'] is not None:
+        # The variance reduction is estimated on the sum of the model files, see flaskapp.pricing.copula
+        return dbc.Alert([
+            html.Div(info),
+            html.Div(get_variance_reduction_text(simulation['variance_reduction'])),
+        ], color='success')
+    return dbc.Alert(info, color='success')
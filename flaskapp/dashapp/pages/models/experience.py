@@ -1,4 +1,11 @@
 from flaskapp.dashapp.pages.utils import *
+from flask import current_app
+import plotly.graph_objects as go
+from flaskapp.pricing.fitting import get_fits, get_parameters, get_distribution
+from flaskapp.pricing.rng import get_modelfile_seed
+from flaskapp.pricing.sampling import SAMPLING_METHODS
+from flaskapp.pricing.paging import get_modelfile_page
+from flaskapp.pricing.simulation import simulate_modelfile, get_variance_reduction
 
 directory = get_directory(__name__)['directory']
 page = get_directory(__name__)['page']
@@ -147,25 +154,21 @@ def update_options_year_max(value, rowData):
     Input(page_id + 'select-start-modeling-period', 'value'),
     Input(page_id + 'select-end-modeling-period', 'value'),
     State(page_id + 'store', 'data'),
-    State(page_id + 'grid-losses', 'rowData'),
+    State(page_id + 'grid-lossfiles', 'cellClicked'),
 )
-def display_model(value_year_min, value_year_max, data, rowData):
-    df = pd.DataFrame(rowData)
-    df['loss_ratio'] = df['loss_ratio'].astype(float)
-    df['year'] = df['year'].astype(int)
-
+def display_model(value_year_min, value_year_max, data, cellClicked):
     year_min = int(value_year_min)
     year_max = int(value_year_max)
 
-    sample = df['loss_ratio'][(df['year'] >= year_min) & (df['year'] <= year_max)]
-
-    param_lognorm = get_lognorm_param(sample)
-    fit_lognorm = lognorm(s=param_lognorm['s'], scale=param_lognorm['scale'])
-
-    x = np.linspace(fit_lognorm.ppf(0.01), fit_lognorm.ppf(0.99), 10000)
+    # The fits and their curves are cached by loss file and modeling period, see flaskapp.pricing.fitting
+    try:
+        fits = get_fits(int(cellClicked['rowId']), year_min, year_max)
+    except ValueError as e:
+        return dbc.Alert(str(e), color='danger'), data
+    candidates = fits['candidates']
+    x = fits['x']
 
-    df_model = pd.DataFrame({'x': x.tolist(), 'y': fit_lognorm.pdf(x).tolist()})
-    df_sample = pd.DataFrame(sample)
+    df_sample = pd.DataFrame({'loss_ratio': fits['sample']})
 
     fig = px.histogram(
         df_sample, x='loss_ratio',
@@ -174,16 +177,49 @@ def display_model(value_year_min, value_year_max, data, rowData):
         range_x=[x[0], x[-1]],
     )
 
-    fig.add_trace(px.line(df_model, x='x', y='y', color_discrete_sequence=['red']).data[0])
+    # Add the cached curves as is, without building intermediate line figures, the best candidate first
+    # https://plotly.com/python/line-and-scatter/
+    for candidate, pdf in zip(candidates, fits['pdfs']):
+        fig.add_trace(go.Scatter(
+            x=x, y=pdf, mode='lines', name=candidate['label'],
+            line_width=3 if candidate['rank'] == 1 else 1,
+        ))
+
+    rowData = [
+        candidate | {'parameters': ', '.join(f'{key}={value:.4g}' for key, value in get_parameters(candidate).items())}
+        for candidate in candidates
+    ]
+    grid_fits = dag.AgGrid(
+        id=page_id + 'grid-fits',
+        rowData=rowData,
+        columnDefs=[
+            {'field': 'rank', 'checkboxSelection': True},
+            {'field': 'label', 'headerName': 'distribution'},
+            {'field': 'parameters'},
+            {'field': 'aic', 'headerName': 'AIC', 'valueFormatter': {'function': 'd3.format(".2f")(params.value)'}},
+            {'field': 'ks', 'headerName': 'KS', 'valueFormatter': {'function': 'd3.format(".3f")(params.value)'}},
+            {'field': 'ks_pvalue', 'headerName': 'KS p-value',
+             'valueFormatter': {'function': 'd3.format(".3f")(params.value)'}},
+            {'field': 'ad', 'headerName': 'AD', 'valueFormatter': {'function': 'd3.format(".3f")(params.value)'}},
+        ],
+        getRowId='params.data.name',
+        selectedRows=rowData[:1],
+        columnSize='responsiveSizeToFit',
+        dashGridOptions={
+            'domLayout': 'autoHeight',
+            'rowSelection': 'single',
+        },
+        className='ag-theme-alpine custom',
+    )
 
     layout = html.Div([
         dbc.Row([
             dbc.Col([
-                dbc.Label('Distribution statistics:'),
+                dbc.Label('Sample statistics:'),
             ], width=5),
             dbc.Col([
-                html.Div(f'mean: {param_lognorm["mean"]:.3f}'),
-                html.Div(f'standard deviation: {param_lognorm["std"]:.3f}'),
+                html.Div(f'mean: {np.mean(fits["sample"]):.3f}'),
+                html.Div(f'standard deviation: {np.std(fits["sample"]):.3f}'),
             ], width=5),
         ], className='mb-3'),
         dbc.Row([
@@ -191,6 +227,12 @@ def display_model(value_year_min, value_year_max, data, rowData):
                 dcc.Graph(id=page_id + 'graph-distribution', figure=fig),
             ]),
         ], className='mb-3'),
+        dbc.Row([
+            dbc.Col([
+                html.Div('Distributions ranked by AIC, select the loss model to save:', className='mb-2'),
+                grid_fits,
+            ]),
+        ], className='mb-3'),
         dbc.Row([
             dbc.Col([
                 dbc.Col([
@@ -204,11 +246,46 @@ def display_model(value_year_min, value_year_max, data, rowData):
                     id=page_id + 'input-name-modelfile',
                     placeholder='Enter the name of the loss model',
                 ),
-            ], width=5),
+            ], width=4),
+            dbc.Col([
+                dmc.NumberInput(
+                    id=page_id + 'input-n-years',
+                    value=current_app.config.get('SIMULATION_YEARS'),
+                    min=1,
+                    step=10000,
+                    description='Simulated years',
+                ),
+            ], width=3),
+            dbc.Col([
+                dmc.NumberInput(
+                    id=page_id + 'input-seed',
+                    min=0,
+                    description='Seed (random if empty)',
+                ),
+            ], width=3),
             dbc.Col([
                 own_button(page_id + 'btn-save-model', 'Save'),
             ], width=1),
         ], className='mb-3'),
+        dbc.Row([
+            dbc.Col([
+                dmc.Select(
+                    id=page_id + 'select-sampling',
+                    data=[{'value': key, 'label': label} for key, label in SAMPLING_METHODS.items()],
+                    value='random',
+                    description='Sampling method',
+                ),
+            ], width=4),
+            dbc.Col([
+                dmc.Checkbox(
+                    id=page_id + 'checkbox-common-random-numbers',
+                    # The models of different loss files stay independent, see flaskapp.pricing.rng
+                    label='Common random numbers: share the random numbers of the other models of this loss file, '
+                          'which are then perfectly dependent on this one (not on the models of other loss files)',
+                    checked=False,
+                ),
+            ], width=8),
+        ], className='mb-3'),
         dbc.Row([
             dbc.Col([
                 dbc.Alert(
@@ -231,7 +308,7 @@ def display_model(value_year_min, value_year_max, data, rowData):
         ]),
     ]),
 
-    data = data | param_lognorm  # Merge the 2 dictionaries with the '|' operator
+    data = data | {'candidates': candidates}  # Merge the 2 dictionaries with the '|' operator
 
     return layout, data
 
@@ -242,46 +319,87 @@ def display_model(value_year_min, value_year_max, data, rowData):
     Input(page_id + 'btn-save-model', 'n_clicks'),
     State(page_id + 'store', 'data'),
     State(page_id + 'input-name-modelfile', 'value'),
+    State(page_id + 'input-n-years', 'value'),
+    State(page_id + 'input-seed', 'value'),
+    State(page_id + 'checkbox-common-random-numbers', 'checked'),
+    State(page_id + 'grid-fits', 'selectedRows'),
+    State(page_id + 'select-sampling', 'value'),
+    State(page_id + 'grid-lossfiles', 'cellClicked'),
     config_prevent_initial_callbacks=True
 )
-def save_loss_model(n_clicks, data, value):
+def save_loss_model(n_clicks, data, value, n_years, seed, common_random_numbers, selectedRows, method, cellClicked):
     analysis_id = data['analysis_id']
     analysis = session.get(Analysis, analysis_id)
 
-    # Save the model file
-    modelfile = ModelFile(
-        name=value,
-    )
-    analysis.modelfiles.append(modelfile)
-
-    # Create the model file year losses
-    s = data['s']
-    scale = data['scale']
-    fit_lognorm = lognorm(s=s, scale=scale)
-
-    NBYEARS = 3  # TODO: Create a global constant giving the number of years
-    years = range(1, NBYEARS + 1)
-    loss_ratios = fit_lognorm.rvs(size=NBYEARS).tolist()
-
-    df = pd.DataFrame({'year': years, 'loss_ratio': loss_ratios})
-
-    # Save the model file year losses
-    for index, row in df.iterrows():
-        modelyearloss = ModelYearLoss(
-            year=row['year'],
-            loss_ratio=row['loss_ratio'],
+    # Check the inputs before creating the model file, the simulation runs in threads
+    try:
+        n_years = int(n_years)
+        seed = None if seed in [None, ''] else int(seed)
+    except (TypeError, ValueError):
+        return dbc.Alert('The number of years and the seed must be integers', color='danger'), False
+    if n_years < 1:
+        return dbc.Alert('The number of years must be positive', color='danger'), False
+    if method not in SAMPLING_METHODS:
+        return dbc.Alert('Select a sampling method', color='danger'), False
+
+    try:
+        seed = get_modelfile_seed(analysis, seed, common_random_numbers, model_key=int(cellClicked['rowId']))
+
+        # Save the model file
+        modelfile = ModelFile(
+            name=value,
+            type='Non cat',
         )
-        modelfile.yearlosses.append(modelyearloss)
-    session.commit()  # Commit after the loop for DB performance
-
-    grid_yearlosses = dag.AgGrid(
-        id=page_id + 'grid-yearlosses',
-        rowData=df.to_dict('records'),
+        analysis.modelfiles.append(modelfile)
+        session.flush()
+
+        # Simulate the model file year losses by chunks with the selected distribution, the best ranked by default
+        # See flaskapp.pricing.simulation
+        candidate = selectedRows[0] if selectedRows else data['candidates'][0]
+        distribution = get_distribution(candidate)
+
+        years, loss_ratios = simulate_modelfile(modelfile, distribution, n_years, seed, method=method)
+        session.commit()
+    except ValueError as e:
+        session.rollback()
+        return dbc.Alert(str(e), color='danger'), False
+
+    # Report the gain of a Latin hypercube or Sobol sampling, see flaskapp.pricing.sampling
+    variance_reduction = None
+    if method != 'random':
+        variance_reduction = get_variance_reduction_text(
+            get_variance_reduction(distribution, n_years, seed, method))
+
+    # Display all the simulated years, requested by blocks by the grid, see flaskapp.pricing.paging
+    grid_yearlosses = own_grid_infinite(
+        page_id + 'grid-yearlosses',
         columnDefs=[
-            {'field': 'year'},
-            {'field': 'loss_ratio', 'valueFormatter': {'function': 'd3.format(".1%")(params.value)'}},
+            {'field': 'year', 'filter': 'agNumberColumnFilter'},
+            {'field': 'loss_ratio', 'filter': 'agNumberColumnFilter',
+             'valueFormatter': {'function': 'd3.format(".1%")(params.value)'}},
         ],
-        columnSize='responsiveSizeToFit',
     )
 
-    return grid_yearlosses, True
+    return html.Div([
+        dcc.Store(id=page_id + 'store-modelfile', data={'modelfile_id': modelfile.id}),
+        html.Div(
+            f'{n_years:,} years simulated from the {candidate["label"]} '
+            f'distribution with the seed {seed} and the {SAMPLING_METHODS[method]} sampling',
+            className='mb-2',
+        ),
+        html.Div(variance_reduction, className='mb-2'),
+        grid_yearlosses,
+    ]), True
+
+
+@callback(
+    Output(page_id + 'grid-yearlosses', 'getRowsResponse'),
+    Input(page_id + 'grid-yearlosses', 'getRowsRequest'),
+    State(page_id + 'store-modelfile', 'data'),
+    config_prevent_initial_callbacks=True
+)
+def get_yearlosses_page(request, data):
+    if not request:
+        raise PreventUpdate
+    modelfile = session.get(ModelFile, data['modelfile_id'])
+    return get_modelfile_page(modelfile, request)
@@ -1,4 +1,6 @@
 from flaskapp.dashapp.pages.utils import *
+from flaskapp.pricing.columnar import set_modelfile_elt
+import base64
 
 directory = get_directory(__name__)['directory']
 page = get_directory(__name__)['page']
@@ -10,6 +12,53 @@ def layout(analysis_id):
     analysis = session.get(Analysis, analysis_id)
     df = df_from_sqla(analysis.modelfiles)
 
+    # Define the modal that is used to upload the event loss table (ELT) of a cat model file, priced by the
+    # occurrence excess of loss layers, see flaskapp.pricing.xs
+    modal_add_elt = html.Div([
+        dbc.Modal([
+            dbc.ModalHeader(dbc.ModalTitle('Upload Event Loss Table')),
+            dbc.ModalBody([
+                dbc.Row([
+                    dbc.Col([
+                        dbc.Label('Name', html_for=page_id + 'input-name'),
+                        dbc.Input(id=page_id + 'input-name', placeholder='Enter a value'),
+                    ]),
+                ], className='mb-2'),
+                dbc.Row([
+                    dbc.Col([
+                        # The years without any event are simulated years with no loss
+                        dbc.Label('Number of simulated years', html_for=page_id + 'input-n-years'),
+                        dbc.Input(id=page_id + 'input-n-years', type='number', min=1, step=1,
+                                  placeholder='Enter a value'),
+                    ]),
+                ], className='mb-2'),
+                dbc.Row([
+                    dbc.Col([
+                        # https://dash.plotly.com/dash-core-components/upload
+                        dcc.Upload(
+                            html.Div(['CSV file with the columns year and loss, one row per event: ',
+                                      html.A('select a file')]),
+                            id=page_id + 'upload-elt',
+                            style={'borderWidth': '1px', 'borderStyle': 'dashed', 'borderRadius': '5px',
+                                   'textAlign': 'center', 'padding': '10px'},
+                            className='mb-2',
+                        ),
+                        dbc.Button('Save', id=page_id + 'btn-save', className='mb-2 button'),
+                    ]),
+                ]),
+                dbc.Row([
+                    dbc.Col([
+                        html.Div(id=page_id + 'div-elt-modif'),
+                    ]),
+                ]),
+            ]),
+        ],
+            id=page_id + 'modal-add-elt',
+            size='md',
+            is_open=False,
+        ),
+    ])
+
     return html.Div([
         dcc.Store(id=page_id + 'store', data={'analysis_id': analysis_id}),
         own_title(__name__, analysis.name),
@@ -19,6 +68,8 @@ def layout(analysis_id):
         html.Div([
             dbc.Row([
                 dbc.Col([
+                    modal_add_elt,
+                    own_button(page_id + 'btn-add-elt', 'Upload ELT'),
                     own_button(page_id + 'btn-delete', 'Delete'),
                 ]),
             ]),
@@ -33,7 +84,9 @@ def layout(analysis_id):
                                     'field': 'name',
                                     'checkboxSelection': True, 'headerCheckboxSelection': True,
                                     'rowDrag': True,
-                                }
+                                },
+                                {'field': 'type'},
+                                {'field': 'n_years'},
                             ],
                             getRowId='params.data.id',
                             columnSize='responsiveSizeToFit',
@@ -48,3 +101,53 @@ def layout(analysis_id):
             ]),
         ], className='div-standard')
     ])
+
+
+@callback(
+    Output(page_id + 'modal-add-elt', 'is_open', allow_duplicate=True),
+    Input(page_id + 'btn-add-elt', 'n_clicks'),
+    config_prevent_initial_callbacks=True
+)
+def toggle_modal(n_clicks):
+    return True
+
+
+@callback(
+    Output(page_id + 'div-elt-modif', 'children'),
+    Output(page_id + 'grid-modelfiles', 'rowData'),
+    Output(page_id + 'modal-add-elt', 'is_open'),
+    Input(page_id + 'btn-save', 'n_clicks'),
+    State(page_id + 'store', 'data'),
+    State(page_id + 'input-name', 'value'),
+    State(page_id + 'input-n-years', 'value'),
+    State(page_id + 'upload-elt', 'contents'),
+    config_prevent_initial_callbacks=True
+)
+def save_elt(n_clicks, data, name, n_years, contents):
+    if contents is None:
+        return dbc.Alert('Select the file of the event loss table', color='danger'), no_update, no_update
+
+    analysis = session.get(Analysis, data['analysis_id'])
+
+    try:
+        # The contents of the upload are a base64 data URL: data:text/csv;base64,...
+        df = pd.read_csv(StringIO(base64.b64decode(contents.split(',', 1)[1]).decode()))
+        if not {'year', 'loss'} <= set(df.columns):
+            raise ValueError('The event loss table must have the columns year and loss')
+
+        modelfile = ModelFile(name=name, type='Cat')
+        analysis.modelfiles.append(modelfile)
+        set_modelfile_elt(
+            modelfile,
+            pd.to_numeric(df['year'], errors='raise').to_numpy(),
+            pd.to_numeric(df['loss'], errors='raise').to_numpy(),
+            n_years,
+        )
+        session.commit()
+
+    except (ValueError, UnicodeDecodeError, pd.errors.ParserError) as e:
+        session.rollback()
+        return dbc.Alert(str(e), color='danger'), no_update, no_update
+
+    rowData = df_from_sqla(analysis.modelfiles).to_dict('records')
+    return None, rowData, False
@@ -1,19 +1,20 @@
-import dash
-from dash import html, dcc, dash_table, callback, Output, Input, State
-from dash.exceptions import PreventUpdate
-import dash_bootstrap_components as dbc
 from flaskapp.dashapp.pages.utils import *
-from flaskapp.extensions import db
-from flaskapp.models import *
-import pandas as pd
-import numpy as np
-import plotly.express as px
+from flaskapp.pricing.columnar import get_modelfile_ylt, set_modelfile_ylt
+from flaskapp.pricing.scenario import get_scenario_parameters, apply_scenarios, get_ylt_statistics
+from flaskapp.pricing.statistics import get_quantiles
 
 directory = get_directory(__name__)['directory']
 page = get_directory(__name__)['page']
 dash.register_page(__name__, path_template=f'/{directory}/{page}/<analysis_id>', order=32)
 page_id = get_page_id(__name__)
 
+# Default scenarios proposed to the user, see flaskapp.pricing.scenario for the meaning of the parameters
+DEFAULT_SCENARIOS = [
+    {'name': 'Trend +10%', 'trend': 1.1},
+    {'name': 'Tail x1.5 above 1 in 20', 'tail_quantile': 0.95, 'tail_multiplier': 1.5},
+    {'name': 'Year 1 x2', 'stress_year': 1, 'stress_factor': 2},
+]
+
 
 def layout(analysis_id):
     analysis = session.get(Analysis, analysis_id)
@@ -27,8 +28,168 @@ def layout(analysis_id):
         html.Div([
             dbc.Row([
                 dbc.Col([
-
+                    dmc.Select(
+                        id=page_id + 'select-modelfile',
+                        label='Base model file',
+                        data=[{'value': modelfile.id, 'label': modelfile.name} for modelfile in analysis.modelfiles],
+                        value=analysis.modelfiles[0].id if analysis.modelfiles else None,
+                    ),
+                ], width=4),
+            ], className='mb-2'),
+            dbc.Row([
+                dbc.Col([
+                    own_button(page_id + 'btn-add', 'Add Scenario'),
+                    own_button(page_id + 'btn-delete', 'Delete Scenarios'),
+                    own_button(page_id + 'btn-compute', 'Compute'),
+                    own_button(page_id + 'btn-save', 'Save as Model Files'),
+                    html.Div(id=page_id + 'div-info'),
+                ]),
+            ]),
+            dbc.Row([
+                dbc.Col([
+                    dag.AgGrid(
+                        id=page_id + 'grid-scenarios',
+                        rowData=DEFAULT_SCENARIOS,
+                        columnDefs=[
+                            {'field': 'name', 'checkboxSelection': True, 'headerCheckboxSelection': True},
+                            {'field': 'trend', 'headerName': 'Trend factor'},
+                            {'field': 'tail_quantile', 'headerName': 'Tail quantile'},
+                            {'field': 'tail_multiplier', 'headerName': 'Tail multiplier'},
+                            {'field': 'stress_year', 'headerName': 'Stress year'},
+                            {'field': 'stress_factor', 'headerName': 'Stress factor'},
+                        ],
+                        defaultColDef={'editable': True},
+                        columnSize='responsiveSizeToFit',
+                        dashGridOptions={
+                            'domLayout': 'autoHeight',
+                            'rowSelection': 'multiple',
+                        },
+                        className='ag-theme-alpine custom mb-2',
+                    ),
+                ]),
+            ]),
+            dbc.Row([
+                dbc.Col([
+                    dcc.Loading(
+                        html.Div(id=page_id + 'div-results'),
+                        id=page_id + 'loading-results',
+                    ),
                 ]),
             ]),
         ], className='div-standard')
     ])
+
+
+def get_shocked_ylts(modelfile_id, scenarios):
+    years, loss_ratios = get_modelfile_ylt(session.get(ModelFile, modelfile_id))
+    if len(years) == 0:
+        raise ValueError('The model file has no year loss')
+    return years, loss_ratios, apply_scenarios(years, loss_ratios, get_scenario_parameters(scenarios))
+
+
+@callback(
+    Output(page_id + 'grid-scenarios', 'rowTransaction'),
+    Input(page_id + 'btn-add', 'n_clicks'),
+    config_prevent_initial_callbacks=True
+)
+def add_scenario(n_clicks):
+    return {'add': [{'name': 'Enter a name'}]}
+
+
+@callback(
+    Output(page_id + 'grid-scenarios', 'rowTransaction', allow_duplicate=True),
+    Input(page_id + 'btn-delete', 'n_clicks'),
+    State(page_id + 'grid-scenarios', 'selectedRows'),
+    config_prevent_initial_callbacks=True
+)
+def delete_scenarios(n_clicks, selectedRows):
+    if not selectedRows:
+        raise PreventUpdate
+    return {'remove': selectedRows}
+
+
+@callback(
+    Output(page_id + 'div-results', 'children'),
+    Input(page_id + 'btn-compute', 'n_clicks'),
+    State(page_id + 'select-modelfile', 'value'),
+    State(page_id + 'grid-scenarios', 'rowData'),
+    config_prevent_initial_callbacks=True
+)
+def compute_scenarios(n_clicks, modelfile_id, rowData):
+    if modelfile_id is None or not rowData:
+        raise PreventUpdate
+
+    try:
+        years, loss_ratios, shocked = get_shocked_ylts(modelfile_id, rowData)
+    except ValueError as e:
+        return dbc.Alert(str(e), color='danger', duration=4000)
+
+    # The base YLT and all the scenarios are described in one pass
+    names = ['Base'] + [scenario['name'] for scenario in rowData]
+    # The quantiles of the result statistics, see config.py
+    quantiles = get_quantiles()
+    statistics = get_ylt_statistics(np.vstack([loss_ratios, shocked]), quantiles)
+
+    df_oep = pd.DataFrame({
+        'quantile': [f'{quantile:.2%}' for quantile in quantiles],
+        'return period': [f'{1 / (1 - quantile):,.0f}' for quantile in quantiles],
+    })
+    df_summary = pd.DataFrame({'quantile': ['Mean', 'Standard deviation'], 'return period': [''] * 2})
+    for k, name in enumerate(names):
+        df_oep[name] = [f'{value:.2%}' for value in statistics['quantiles'][:, k]]
+        df_summary[name] = [f'{statistics["mean"][k]:.2%}', f'{statistics["std"][k]:.2%}']
+
+    df_curves = pd.DataFrame({
+        'return period': [1 / (1 - quantile) for name in names for quantile in quantiles],
+        'loss ratio': statistics['quantiles'].T.ravel(),
+        'scenario': [name for name in names for quantile in quantiles],
+    })
+    fig = px.line(df_curves, x='return period', y='loss ratio', color='scenario', log_x=True, markers=True)
+    fig.update_yaxes(tickformat='.0%')
+
+    return html.Div([
+        dag.AgGrid(
+            id=page_id + 'grid-oep',
+            rowData=df_oep.to_dict('records'),
+            columnDefs=[{'field': col} for col in df_oep.columns],
+            columnSize='responsiveSizeToFit',
+            dashGridOptions={
+                'domLayout': 'autoHeight',
+                'pinnedBottomRowData': df_summary.to_dict('records'),
+            },
+            className='ag-theme-alpine custom mb-2',
+        ),
+        dcc.Graph(id=page_id + 'graph-oep', figure=fig),
+    ])
+
+
+@callback(
+    Output(page_id + 'div-info', 'children'),
+    Input(page_id + 'btn-save', 'n_clicks'),
+    State(page_id + 'store', 'data'),
+    State(page_id + 'select-modelfile', 'value'),
+    State(page_id + 'grid-scenarios', 'selectedRows'),
+    config_prevent_initial_callbacks=True
+)
+def save_scenarios(n_clicks, data, modelfile_id, selectedRows):
+    if modelfile_id is None or not selectedRows:
+        raise PreventUpdate
+
+    analysis = session.get(Analysis, data['analysis_id'])
+    modelfile = session.get(ModelFile, modelfile_id)
+
+    try:
+        years, loss_ratios, shocked = get_shocked_ylts(modelfile_id, selectedRows)
+
+        # The scenarios are written only now, as new model files sharing the YLT storage of flaskapp.pricing.columnar
+        for scenario, scenario_loss_ratios in zip(selectedRows, shocked):
+            new = ModelFile(name=f'{modelfile.name} - {scenario["name"]}'[:50], type=modelfile.type)
+            analysis.modelfiles.append(new)
+            session.flush()
+            set_modelfile_ylt(new, years, scenario_loss_ratios)
+        session.commit()
+    except ValueError as e:
+        session.rollback()
+        return dbc.Alert(str(e), color='danger', duration=4000)
+
+    return dbc.Alert(f'{len(selectedRows)} model file(s) saved', color='success', duration=4000)
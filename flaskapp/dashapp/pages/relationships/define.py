@@ -1,6 +1,9 @@
 import dash_bootstrap_components
 
 from flaskapp.dashapp.pages.utils import *
+from flask import current_app
+from flaskapp.pricing.jobs import new_job_id, job_app_context, get_progress_reporter, submit_process_resultfile, \
+    cancel_jobs
 
 directory = get_directory(__name__)['directory']
 page = get_directory(__name__)['page']
@@ -17,28 +20,13 @@ def layout(analysis_id):
     for layermodelfile in analysis.modelfiles:
         available_modelfiles.append({'value': layermodelfile.id, 'label': layermodelfile.name})
 
-    # Get the last pricing relationship if existing
-    # TODO: Correct below with the new DB models and the new querying style
-    last_pricingrelationship = session.query(PricingRelationship). \
-        filter_by(analysis_id=analysis.id).order_by(PricingRelationship.id.desc()).first()
-
     # Create a select component for each layer and add it to the list component_select_modelfiles
     component_select_modelfiles = []
 
     for layer in analysis.layers:
 
-        # Get all the models files linked to the layer in the last pricing relationship
-        selected_modelfiles = []
-
-        if last_pricingrelationship:
-            # TODO: Correct below with the new DB models and the new querying style
-            layermodelfiles = session.query(LayerModelFile).filter(
-                LayerModelFile.pricingrelationship_id == last_pricingrelationship.id,
-                LayerModelFile.layer_id == layer.id
-            ).all()
-
-            for layermodelfile in layermodelfiles:
-                selected_modelfiles.append(layermodelfile.modelfile_id)
+        # Get all the models files currently linked to the layer
+        selected_modelfiles = [modelfile.id for modelfile in layer.modelfiles]
 
         # Create the select component
         select_modelfiles = dmc.MultiSelect(
@@ -53,6 +41,18 @@ def layout(analysis_id):
 
         component_select_modelfiles.append(select_modelfiles)
 
+    # The excess of loss layers are priced over the event loss tables of their model files, see flaskapp.pricing.xs
+    for xslayer in analysis.xslayers:
+        component_select_modelfiles.append(dmc.MultiSelect(
+            id={'page_id': page_id, 'type': 'select-modelfiles-xs', 'layer_id': xslayer.id},
+            label=f'XS layer {xslayer.name}',
+            placeholder='Click here to select the model files with an event loss table',
+            data=available_modelfiles,
+            value=[modelfile.id for modelfile in xslayer.modelfiles],
+            clearable=True,
+            className='mb-3',
+        ))
+
     return html.Div([
         dcc.Store(id=page_id + 'store', data={'analysis_id': analysis_id}),
         own_title(__name__, analysis.name),
@@ -75,7 +75,21 @@ def layout(analysis_id):
                         ], width=8),
                         dbc.Col([
                             own_button(page_id + 'btn-save', 'Save'),
+                            own_button(page_id + 'btn-cancel', 'Cancel'),
                         ], width=4),
+                    ], className='mb-3'),
+                    dbc.Row([
+                        dbc.Col([
+                            # Progress of the background pricing job, hidden when no job is running
+                            dbc.Progress(
+                                id=page_id + 'progress',
+                                value=0,
+                                striped=True,
+                                animated=True,
+                                style={'visibility': 'hidden'},
+                                className='mb-3',
+                            ),
+                        ]),
                     ]),
                     dbc.Row([
                         dbc.Col([
@@ -89,7 +103,7 @@ def layout(analysis_id):
                             html.Div([
                                 dag.AgGrid(
                                     id=page_id + 'grid-relationships',
-                                    rowData=df_from_sqla(analysis.pricingrelationships).to_dict('records'),
+                                    rowData=df_from_sqla(analysis.resultfiles).to_dict('records'),
                                     columnDefs=[
                                         {'field': 'id', 'hide': True},
                                         {'field': 'name', 'checkboxSelection': True, 'headerCheckboxSelection': True},
@@ -123,9 +137,10 @@ def layout(analysis_id):
 @callback(
     Output(page_id + 'div-relationships-modified', 'children', allow_duplicate=True),
     Input({'page_id': page_id, 'type': 'select-modelfiles', 'layer_id': ALL}, 'value'),
+    Input({'page_id': page_id, 'type': 'select-modelfiles-xs', 'layer_id': ALL}, 'value'),
     config_prevent_initial_callbacks=True
 )
-def inform_relationships_modified(value):
+def inform_relationships_modified(value, value_xs):
     alert = dbc.Alert(
         'Save the new relationships with the Save button',
         id=page_id + 'alert-relationships-modified',
@@ -134,137 +149,88 @@ def inform_relationships_modified(value):
     return alert
 
 
+# The pricing runs as a background callback, in a separate process, so that the web workers stay available
+# https://dash.plotly.com/background-callbacks
 @callback(
     Output(page_id + 'div-relationships-modified', 'children'),
     Input(page_id + 'btn-save', 'n_clicks'),
     State(page_id + 'store', 'data'),
     State({'page_id': page_id, 'type': 'select-modelfiles', 'layer_id': ALL}, 'id'),
     State({'page_id': page_id, 'type': 'select-modelfiles', 'layer_id': ALL}, 'value'),
+    State({'page_id': page_id, 'type': 'select-modelfiles-xs', 'layer_id': ALL}, 'id'),
+    State({'page_id': page_id, 'type': 'select-modelfiles-xs', 'layer_id': ALL}, 'value'),
     State(page_id + 'input-name-relationships', 'value'),
+    background=True,
+    running=[
+        (Output(page_id + 'btn-save', 'disabled'), True, False),
+        (Output(page_id + 'btn-cancel', 'disabled'), False, True),
+        (Output(page_id + 'progress', 'style'), {'visibility': 'visible'}, {'visibility': 'hidden'}),
+    ],
+    cancel=[Input(page_id + 'btn-cancel', 'n_clicks')],
+    progress=[Output(page_id + 'progress', 'value'), Output(page_id + 'progress', 'label')],
     config_prevent_initial_callbacks=True
 )
-def process_result(n_clicks, data, id_, value, name):
-    # TODO: Go to the view result page after processing
+def process_result(set_progress, n_clicks, data, id_, value, id_xs, value_xs, name):
     # id_ is a list of dictionaries that contains the layer id for each select component
     # e.g. [{'page_id': page_id, 'type': 'select-modelfiles', 'layer_id': 1}, {'page_id': page_id, 'type': 'select-modelfiles', 'layer_id': 2}]
     # value is a list of the lists that give the ids of the selected model files for each layer
     # e.g. [[54, 65], [54], [54]]
+    # id_xs and value_xs are the same for the excess of loss layers
     start = time.perf_counter()
+    job_id = new_job_id()
     analysis_id = data['analysis_id']
-    analysis = session.get(Analysis, analysis_id)
-    n_layers = len(id_)
-
-    # Save the layer-to-modelfiles relationships
-    for i in range(n_layers):
-        layer_id = id_[i]['layer_id']
-        layer = session.get(Layer, layer_id)
-
-        # Clear the previous layer-to-modelfiles relationships
-        layer.modelfiles.clear()
-
-        # Append the new relationships
-        for modelfile_id in value[i]:
-            modelfile = session.get(ModelFile, modelfile_id)
-            layer.modelfiles.append(modelfile)
-
-    resultfile = ResultFile(name=name)
-    analysis.resultfiles.append(resultfile)
-
-    # Iterate over the layers and linked modelfiles to get the result file's layers, model files and result year losses
-    for layer in analysis.layers:
-        resultlayer = get_resultlayer_from(layer)
-        resultfile.layers.append(resultlayer)
-
-        for modelfile in layer.modelfiles:
-            query = select(ResultModelFile).filter_by(resultfile=resultfile, id_src=modelfile.id)
-            resultmodelfile = session.execute(query).scalar_one()
-
-            # If resultmodelfile is None (= the original modelfile wasn't copied already) => copy the original modelfile
-            if not resultmodelfile:
-                resultmodelfile = get_resultmodelfile_from(modelfile)
-                resultfile.modelfiles.append(resultmodelfile)
-
-                for modelyearloss in modelfile.yearlosses:
-                    resultmodelyearloss = get_resultmodelyearloss_from(modelyearloss)
-                    resultmodelfile.yearlosses.append(resultmodelyearloss)
-
-            resultlayer.modelfiles.append(resultmodelfile)
-
-    # Create the year losses for each layer of the resultfile
-    for resultlayer in resultfile.layers:
-        for resultmodelfile in resultlayer.modelfiles:
-            for modelyearloss in resultmodelfile.yearlosses:
-                resultlayeryearloss = get_resultlayeryearloss_from(modelyearloss, resultlayer, resultmodelfile)
-                resultlayer.yearlosses.append(resultlayeryearloss)
-
-        # Work out the overall annual loss ratio and ceded ratio (for all resultmodelfiles)
-        # https://www.tutorialspoint.com/how-to-groupby-and-sum-sql-columns-using-sqlalchemy-in-python
-        query = select(
-            ResultLayerYearLoss.year, func.sum(ResultLayerYearLoss.loss_ratio).label('loss_ratio')
-        ).filter_by(layer=resultlayer).group_by(ResultLayerYearLoss.year)
-
-        loss_ratio_by_year = pd.DataFrame(session.execute(query).all())
-        loss_ratio_by_year.set_index('year', inplace=True)
-
-        loss_ratio_by_year['ceded_loss_ratio'] = loss_ratio_by_year['loss_ratio'].apply(
-            lambda loss_ratio: min(resultlayer.agg_limit / 100, max(0, loss_ratio - resultlayer.agg_deduct / 100)))
-
-        loss_ratio_by_year['ceded_ratio'] = loss_ratio_by_year['ceded_loss_ratio'] / loss_ratio_by_year['loss_ratio']
-
-        for resultlayeryearloss in resultlayer.yearlosses:
-            year = resultlayeryearloss.year
-            gross = resultlayeryearloss.gross
-            ceded = gross * loss_ratio_by_year.at[year, 'ceded_ratio']
-            resultlayeryearloss.ceded = ceded
-            resultlayeryearloss.net = gross - ceded
-
-    session.commit()
-
-    alert = dbc.Alert(
-        'The relationships have been saved and the result has been processed',
+    progress = get_progress_reporter(set_progress, job_id)
+    progress(0)
+
+    with job_app_context():
+        n_layers = len(id_)
+
+        # Save the layer-to-modelfiles relationships
+        for i in range(n_layers):
+            layer_id = id_[i]['layer_id']
+            layer = session.get(Layer, layer_id)
+
+            # Clear the previous layer-to-modelfiles relationships
+            layer.modelfiles.clear()
+
+            # Append the new relationships
+            for modelfile_id in value[i]:
+                modelfile = session.get(ModelFile, modelfile_id)
+                layer.modelfiles.append(modelfile)
+
+        for xs_id, modelfile_ids in zip(id_xs, value_xs):
+            xslayer = session.get(LayerXS, xs_id['layer_id'])
+            xslayer.modelfiles = [session.get(ModelFile, modelfile_id) for modelfile_id in modelfile_ids or []]
+
+        # Price the layers with the vectorized engine and save the result file
+        try:
+            resultfile_id = submit_process_resultfile(analysis_id, name, progress=progress)
+        except ValueError as e:
+            session.rollback()
+            return dbc.Alert(str(e), color='danger')
+        current_app.logger.info(f'Job {job_id}: result file {resultfile_id} processed in '
+                                f'{time.perf_counter() - start:.1f}s')
+
+    alert = dbc.Alert([
+        f'Job {job_id}: the relationships have been saved and the result has been processed. ',
+        dcc.Link('View results', href=f'/dashapp/results/view/{analysis_id}?resultfile_id={resultfile_id}'),
+    ],
         id=page_id + 'alert-relationships-saved',
         color='success',
-        duration=4000,
     )
 
-    print(f'Elapsed time: {time.perf_counter() - start}')  # TODO: Timer
     return alert
 
 
-def get_resultlayer_from(layer):
-    resultlayer = ResultLayer(
-        name=layer.name,
-        premium=layer.premium,
-        limit=layer.limit,
-        deductible=layer.deductible,
-    )
-    return resultlayer
-
-
-def get_resultmodelfile_from(modelfile):
-    resultmodelfile = ResultModelFile(
-        id_src=modelfile.id,
-        name=modelfile.name,
-        type=modelfile.type,
-    )
-    return resultmodelfile
-
-
-def get_resultmodelyearloss_from(modelyearloss):
-    resultmodelyearloss = ResultModelYearLoss(
-        year=modelyearloss.year,
-        loss_ratio=modelyearloss.loss_ratio,
-    )
-    return resultmodelyearloss
-
-
-def get_resultlayeryearloss_from(modelyearloss, resultlayer, resultmodelfile):
-    resultlayeryearloss = ResultLayerYearLoss(
-        model_id=resultmodelfile.id,
-        model_name=resultmodelfile.name,
-        year=modelyearloss.year,
-        type=resultmodelfile.type,
-        loss_ratio=modelyearloss.loss_ratio,
-        gross=resultlayer.premium * modelyearloss.loss_ratio,
-    )
-    return resultlayeryearloss
+# The Cancel button stops the background callback, and the pricing workers with the cancelled jobs
+@callback(
+    Output(page_id + 'div-relationships-modified', 'children', allow_duplicate=True),
+    Input(page_id + 'btn-cancel', 'n_clicks'),
+    State(page_id + 'store', 'data'),
+    prevent_initial_call=True
+)
+def cancel_result(n_clicks, data):
+    n_jobs = cancel_jobs(data['analysis_id'])
+    if not n_jobs:
+        return no_update
+    return dbc.Alert(f'{n_jobs} pricing jobs cancelled', color='warning')
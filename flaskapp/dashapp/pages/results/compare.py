@@ -1,21 +1,19 @@
-import dash
-from dash import html, dcc, dash_table, callback, Output, Input, State, ALL
-from dash.exceptions import PreventUpdate
-import dash_bootstrap_components as dbc
-import dash_mantine_components as dmc
 from flaskapp.dashapp.pages.utils import *
-from flaskapp.extensions import db
-from flaskapp.models import *
-import pandas as pd
+from flaskapp.pricing.comparison import get_comparison
+from flaskapp.pricing.statistics import get_quantiles
 
 directory = get_directory(__name__)['directory']
 page = get_directory(__name__)['page']
 dash.register_page(__name__, path_template=f'/{directory}/{page}/<analysis_id>', order=3)
 page_id = get_page_id(__name__)
 
+AMOUNT_FORMATTER = {'function': 'params.value == null ? "" : d3.format(",.0f")(params.value)'}
+PERCENT_FORMATTER = {'function': 'params.value == null ? "" : d3.format(".2%")(params.value)'}
+
 
 def layout(analysis_id):
     analysis = session.get(Analysis, analysis_id)
+    resultfiles = sorted(analysis.resultfiles, key=lambda resultfile: resultfile.id)
 
     return html.Div([
         dcc.Store(id=page_id + 'store', data={'analysis_id': analysis_id}),
@@ -26,21 +24,174 @@ def layout(analysis_id):
         html.Div([
             dbc.Row([
                 dbc.Col([
-
-                ]),
+                    html.Div('1. Select the result files to compare:', className='h5 mb-3'),
+                    dag.AgGrid(
+                        id=page_id + 'grid-resultfiles',
+                        rowData=[{'id': resultfile.id, 'name': resultfile.name} for resultfile in resultfiles],
+                        columnDefs=[
+                            {'field': 'id', 'hide': True},
+                            {'field': 'name', 'checkboxSelection': True, 'headerCheckboxSelection': True},
+                        ],
+                        getRowId='params.data.id',
+                        columnSize='responsiveSizeToFit',
+                        dashGridOptions={
+                            'domLayout': 'autoHeight',
+                            'rowSelection': 'multiple',
+                        },
+                        className='ag-theme-alpine custom mb-3',
+                    ),
+                ], width=4),
+                dbc.Col([
+                    html.Div('2. Select the base result file:', className='h5 mb-3'),
+                    dmc.Select(
+                        id=page_id + 'select-base',
+                        data=[{'value': str(resultfile.id), 'label': resultfile.name} for resultfile in resultfiles],
+                        value=str(resultfiles[0].id) if resultfiles else None,
+                    ),
+                ], width=4),
             ]),
             dbc.Row([
                 dbc.Col([
-
-                ]),
-                dbc.Col([
-
+                    dcc.Loading([
+                        html.Div(id=page_id + 'div-info'),
+                        html.Div('Deltas of the statistics of the ceded amounts', className='h6 mt-3 mb-2'),
+                        dag.AgGrid(
+                            id=page_id + 'grid-deltas',
+                            rowData=[],
+                            columnDefs=[
+                                {'field': 'layer'},
+                                {'field': 'resultfile', 'headerName': 'result file'},
+                                {'field': 'statistic'},
+                                {'field': 'base', 'valueFormatter': AMOUNT_FORMATTER},
+                                {'field': 'other', 'headerName': 'result file value',
+                                 'valueFormatter': AMOUNT_FORMATTER},
+                                {'field': 'delta', 'valueFormatter': AMOUNT_FORMATTER},
+                                {'field': 'relative_delta', 'headerName': 'relative delta',
+                                 'valueFormatter': PERCENT_FORMATTER},
+                                {'field': 'difference', 'headerName': 'paired difference',
+                                 'valueFormatter': AMOUNT_FORMATTER},
+                            ],
+                            columnSize='responsiveSizeToFit',
+                            dashGridOptions={'domLayout': 'autoHeight'},
+                            csvExportParams={'fileName': 'Comparison.csv'},
+                            className='ag-theme-alpine custom mb-2',
+                        ),
+                        html.Div('Paired year losses', className='h6 mt-3 mb-2'),
+                        dag.AgGrid(
+                            id=page_id + 'grid-pairing',
+                            rowData=[],
+                            columnDefs=[
+                                {'field': 'layer'},
+                                {'field': 'resultfile', 'headerName': 'result file'},
+                                {'field': 'n_years', 'headerName': 'common years',
+                                 'valueFormatter': {'function': 'd3.format(",d")(params.value)'}},
+                                {'field': 'paired', 'headerName': 'same years'},
+                                {'field': 'mean_difference', 'headerName': 'mean difference',
+                                 'valueFormatter': AMOUNT_FORMATTER},
+                                {'field': 'paired_standard_error', 'headerName': 'standard error (paired)',
+                                 'valueFormatter': AMOUNT_FORMATTER},
+                                {'field': 'unpaired_standard_error', 'headerName': 'standard error (independent)',
+                                 'valueFormatter': AMOUNT_FORMATTER},
+                                {'field': 'correlation',
+                                 'valueFormatter': {'function': 'params.value == null ? "" : '
+                                                                'd3.format(".3f")(params.value)'}},
+                                {'field': 'share_changed', 'headerName': 'years changed',
+                                 'valueFormatter': PERCENT_FORMATTER},
+                            ],
+                            columnSize='responsiveSizeToFit',
+                            dashGridOptions={'domLayout': 'autoHeight'},
+                            className='ag-theme-alpine custom mb-2',
+                        ),
+                    ], id=page_id + 'loading-comparison'),
                 ]),
             ]),
             dbc.Row([
                 dbc.Col([
-
+                    own_button(page_id + 'btn-export', 'Export Deltas to CSV'),
                 ]),
             ]),
         ], className='div-standard')
     ])
+
+
+def get_value(value):
+    # NaN, e.g. the relative delta of a statistic equal to 0 in the base, is not valid JSON
+    return None if value is None or np.isnan(value) else value
+
+
+def get_rowdata_comparison(resultfile, comparison):
+    rowData_deltas, rowData_pairing, errors = [], [], []
+    for layer in comparison['layers']:
+        if 'error' in layer:
+            errors.append(f'{layer["name"]}, {resultfile.name}: {layer["error"]}')
+            continue
+
+        for k, statistic in enumerate(layer['statistics']):
+            rowData_deltas.append({
+                'layer': layer['name'],
+                'resultfile': resultfile.name,
+                'statistic': get_statistic_label(statistic),
+                'base': layer['base'][k],
+                'other': layer['other'][k],
+                'delta': layer['delta'][k],
+                'relative_delta': get_value(layer['relative_delta'][k]),
+                'difference': layer['difference'][k],
+            })
+        rowData_pairing.append({
+            'layer': layer['name'],
+            'resultfile': resultfile.name,
+            'n_years': layer['n_years'],
+            'paired': layer['paired'],
+            'mean_difference': layer['difference'][0],
+            'paired_standard_error': layer['paired_standard_error'],
+            'unpaired_standard_error': layer['unpaired_standard_error'],
+            'correlation': get_value(layer['correlation']),
+            'share_changed': layer['share_changed'],
+        })
+    return rowData_deltas, rowData_pairing, errors
+
+
+@callback(
+    Output(page_id + 'grid-deltas', 'rowData'),
+    Output(page_id + 'grid-pairing', 'rowData'),
+    Output(page_id + 'div-info', 'children'),
+    Input(page_id + 'grid-resultfiles', 'selectedRows'),
+    Input(page_id + 'select-base', 'value'),
+    config_prevent_initial_callbacks=True
+)
+def compare_resultfiles(selectedRows, base_id):
+    if not selectedRows or base_id is None:
+        raise PreventUpdate
+
+    base = session.get(ResultFile, int(base_id))
+    others = [session.get(ResultFile, row['id']) for row in selectedRows if row['id'] != base.id]
+    if not others:
+        return [], [], dbc.Alert('Select at least one result file other than the base', color='info')
+
+    # Each pair is compared once and cached, see flaskapp.pricing.comparison
+    start = time.perf_counter()
+    rowData_deltas, rowData_pairing, errors, n_cached = [], [], [], 0
+    for other in others:
+        comparison = get_comparison(base, other, get_quantiles())
+        deltas, pairing, layer_errors = get_rowdata_comparison(other, comparison)
+        rowData_deltas += deltas
+        rowData_pairing += pairing
+        errors += layer_errors
+        n_cached += comparison['cached']
+
+    info = f'{len(others)} result files compared with {base.name} in {time.perf_counter() - start:.2f} s ' \
+           f'({n_cached} from the cache)'
+    return rowData_deltas, rowData_pairing, html.Div([html.Div(info)] + [
+        dbc.Alert(error, color='warning', className='mt-2') for error in errors
+    ], className='mt-2')
+
+
+@callback(
+    Output(page_id + 'grid-deltas', 'exportDataAsCsv'),
+    Input(page_id + 'btn-export', 'n_clicks'),
+    config_prevent_initial_callbacks=True
+)
+def export_data_to_csv(n_clicks):
+    if n_clicks:
+        return True
+    return False
@@ -1,4 +1,8 @@
 from flaskapp.dashapp.pages.utils import *
+from flask import current_app
+from flaskapp.pricing.jobs import new_job_id, job_app_context, get_progress_reporter, submit_process_resultfile, \
+    cancel_jobs
+from flaskapp.pricing.columnar import delete_unreferenced_yltblobs
 
 directory = get_directory(__name__)['directory']
 page = get_directory(__name__)['page']
@@ -8,11 +12,6 @@ page_id = get_page_id(__name__)
 
 def layout(analysis_id):
     analysis = session.get(Analysis, analysis_id)
-    df = df_from_sqla(analysis.resultfiles)
-    try:
-        df['results'] = df.apply(get_link_results, axis=1)
-    except ValueError as e:
-        print(e)
 
     return html.Div([
         dcc.Store(id=page_id + 'store', data={'analysis_id': analysis_id}),
@@ -24,12 +23,21 @@ def layout(analysis_id):
             dbc.Row([
                 dbc.Col([
                     own_button(page_id + 'btn-process', 'Process'),
+                    own_button(page_id + 'btn-cancel', 'Cancel'),
                     own_button(page_id + 'btn-delete', 'Delete'),
+                    dbc.Progress(
+                        id=page_id + 'progress',
+                        value=0,
+                        striped=True,
+                        animated=True,
+                        style={'visibility': 'hidden'},
+                        className='mb-2',
+                    ),
                     dcc.Loading(
                         html.Div(
                             dag.AgGrid(
                                 id=page_id + 'grid-relationships',
-                                rowData=df.to_dict('records'),
+                                rowData=get_rowdata_resultfiles(analysis),
                                 columnDefs=[
                                     {'field': 'id', 'hide': True},
                                     {'field': 'name', 'checkboxSelection': True},
@@ -60,80 +68,95 @@ def layout(analysis_id):
             ]),
             dbc.Row([
                 dbc.Col([
-
-                ]),
+                    html.Div(id=page_id + 'div-process'),
+                    html.Div(id=page_id + 'div-cancel'),
+                ], width=5),
             ]),
         ], className='div-standard')
     ])
 
 
+# The processing runs as a background callback, see relationships/define.py
 @callback(
     Output(page_id + 'grid-relationships', 'rowData'),
     Output(page_id + 'alert_save', 'is_open'),
+    Output(page_id + 'div-process', 'children'),
     Input(page_id + 'btn-process', 'n_clicks'),
     State(page_id + 'store', 'data'),
     State(page_id + 'grid-relationships', 'selectedRows'),
+    background=True,
+    running=[
+        (Output(page_id + 'btn-process', 'disabled'), True, False),
+        (Output(page_id + 'btn-cancel', 'disabled'), False, True),
+        (Output(page_id + 'progress', 'style'), {'visibility': 'visible'}, {'visibility': 'hidden'}),
+    ],
+    cancel=[Input(page_id + 'btn-cancel', 'n_clicks')],
+    progress=[Output(page_id + 'progress', 'value'), Output(page_id + 'progress', 'label')],
+    config_prevent_initial_callbacks=True
 )
-def process_result(n_clicks, data, selectedRows):
-    # TODO: Overhaul this part
-    pass
-    # if n_clicks is None or selectedRows is None:
-    #     return no_update
-    #
-    # analysis_id = data['analysis_id']
-    # analysis = session.get(Analysis, analysis_id)
-    # is_open = False
-    # start = time.perf_counter()
-    #
-    # for row in selectedRows:
-    #     # Check if the pricing relationships has already been processed
-    #     # If not, process and save the result file and the result year losses
-    #     pricingrelationship_id = row['id']
-    #     check = session.query(ResultFile). \
-    #         filter_by(analysis_id=analysis_id, pricingrelationship_id=pricingrelationship_id).first()
-    #
-    #     if not check:
-    #         # Save the result file
-    #         resultfile = ResultFile(
-    #             name=session.get(PricingRelationship, pricingrelationship_id).name,
-    #             analysis_id=analysis_id,
-    #             pricingrelationship_id=pricingrelationship_id
-    #         )
-    #         session.add(resultfile)
-    #         session.commit()
-    #
-    #         # Save the result year losses
-    #         for layermodelfile in resultfile.pricingrelationship.layermodelfiles:
-    #             layer = layermodelfile.layer
-    #             modelfile = layermodelfile.modelfile
-    #
-    #             for modelyearloss in modelfile.modelyearlosses:
-    #                 resultyearloss = ResultLayerYearLoss(
-    #                     name=modelyearloss.name,
-    #                     resultfile_id=resultfile.id,
-    #                     layermodelfile_id=layermodelfile.id,
-    #                     year=modelyearloss.year,
-    #                     # For the SL, the "amount" is the simulated loss ratio
-    #                     grossloss=layer.premium * modelyearloss.amount
-    #                 )
-    #
-    #                 # Apply the SL cover to get the recovery and net amount
-    #                 resultyearloss.recovery = get_sl_recovery(
-    #                     resultyearloss.grossloss,
-    #                     layer.premium,
-    #                     layer.limit,
-    #                     layer.deductible,
-    #                 )
-    #                 resultyearloss.netloss = resultyearloss.grossloss - resultyearloss.recovery
-    #
-    #                 session.add(resultyearloss)
-    #             session.commit()  # Commit after the loop for DB performance
-    #
-    #         is_open = True
-    #
-    # df = df_from_sqla(analysis.pricingrelationships)
-    # df['results'] = df.apply(get_link_results, axis=1)
-    # rowData = df.to_dict('records')
-    #
-    # print(f'Elapsed time: {time.perf_counter() - start}')  # TODO: Timer
-    # return rowData, is_open
+def process_result(set_progress, n_clicks, data, selectedRows):
+    # Process again the selected result files with the current layers and relationships of the analysis
+    # Each selected result file is replaced by the new one, with the same name
+    if n_clicks is None or not selectedRows:
+        return no_update, no_update, no_update
+
+    start = time.perf_counter()
+    job_id = new_job_id()
+    analysis_id = data['analysis_id']
+    report = get_progress_reporter(set_progress, job_id)
+    report(0)
+
+    with job_app_context():
+        # Each result file is committed on its own: the ones replaced before a failure stay replaced
+        replaced = []
+        alert = None
+        for i, row in enumerate(selectedRows):
+            try:
+                submit_process_resultfile(
+                    analysis_id,
+                    row['name'],
+                    progress=lambda fraction: report((i + fraction) / len(selectedRows)),
+                )
+            except ValueError as e:
+                session.rollback()
+                alert = dbc.Alert(
+                    f'{row["name"]}: {e}. '
+                    + (f'Result files replaced: {", ".join(replaced)}' if replaced else 'No result file replaced'),
+                    color='danger',
+                )
+                break
+
+            # Deleted once the new result file is committed: its unchanged layers are copied from the old one
+            resultfile = session.get(ResultFile, row['id'])
+            if resultfile is not None:
+                session.delete(resultfile)
+                session.commit()
+            replaced.append(row['name'])
+        delete_unreferenced_yltblobs()
+
+        rowData = get_rowdata_resultfiles(session.get(Analysis, analysis_id))
+        current_app.logger.info(f'Job {job_id}: {len(replaced)} of {len(selectedRows)} result files processed in '
+                                f'{time.perf_counter() - start:.1f}s')
+
+    return rowData, alert is None, alert
+
+
+# The Cancel button stops the background callback, and the pricing workers with the cancelled jobs
+@callback(
+    Output(page_id + 'div-cancel', 'children'),
+    Input(page_id + 'btn-cancel', 'n_clicks'),
+    State(page_id + 'store', 'data'),
+    prevent_initial_call=True
+)
+def cancel_result(n_clicks, data):
+    n_jobs = cancel_jobs(data['analysis_id'])
+    if not n_jobs:
+        return no_update
+    return dbc.Alert(f'{n_jobs} pricing jobs cancelled', color='warning', duration=4000)
+
+
+def get_rowdata_resultfiles(analysis):
+    df = df_from_sqla(analysis.resultfiles)
+    if not df.empty:
+        df['results'] = df.apply(get_link_results, axis=1)
+    return df.to_dict('records')
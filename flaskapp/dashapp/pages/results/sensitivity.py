@@ -0,0 +1,182 @@
+from flaskapp.dashapp.pages.utils import *
+from flaskapp.pricing.columnar import get_modelfile_ylt
+from flaskapp.pricing.sensitivity import get_sensitivity_grid, get_df_sensitivity
+from flaskapp.pricing.statistics import get_quantiles
+from flaskapp.pricing.stoploss import align_yearlosses
+
+directory = get_directory(__name__)['directory']
+page = get_directory(__name__)['page']
+dash.register_page(__name__, path_template=f'/{directory}/{page}/<analysis_id>', order=4)
+page_id = get_page_id(__name__)
+
+MAX_GRID_SIZE = 200  # Maximum number of deductibles or limits
+
+
+def get_metrics():
+    # The quantiles of the result statistics, see config.py
+    return {
+        'expected': 'Expected ceded loss ratio (%)',
+        'std': 'Standard deviation of the ceded loss ratio (%)',
+        'attachment_probability': 'Probability of attachment',
+        'exhaustion_probability': 'Probability of exhaustion',
+        **{f'q{q}': f'Ceded loss ratio at the {q:.2%} quantile (%)' for q in get_quantiles()},
+    }
+
+
+def layout(analysis_id):
+    analysis = session.get(Analysis, analysis_id)
+
+    # The sensitivity is computed on the aggregated YLT of a layer or on the YLT of a model file
+    sources = [
+        {'value': f'layer-{layer.id}', 'label': f'Layer: {layer.name}'}
+        for layer in sorted(analysis.layers, key=lambda layer: layer.display_order) if layer.modelfiles
+    ] + [
+        {'value': f'modelfile-{modelfile.id}', 'label': f'Model file: {modelfile.name}'}
+        for modelfile in analysis.modelfiles
+    ]
+
+    return html.Div([
+        dcc.Store(id=page_id + 'store', data={'analysis_id': analysis_id}),
+        dcc.Store(id=page_id + 'store-grid'),
+        dcc.Download(id=page_id + 'download'),
+        own_title(__name__, analysis.name),
+        own_nav_middle(__name__, analysis.id),
+        own_nav_bottom(__name__, analysis.id),
+
+        html.Div([
+            dbc.Row([
+                dbc.Col([
+                    dmc.Select(
+                        id=page_id + 'select-source',
+                        label='Layer or model file',
+                        data=sources,
+                        value=sources[0]['value'] if sources else None,
+                    ),
+                ], width=4),
+                dbc.Col([
+                    dmc.Select(
+                        id=page_id + 'select-metric',
+                        label='Metric',
+                        data=[{'value': key, 'label': label} for key, label in get_metrics().items()],
+                        value='expected',
+                    ),
+                ], width=4),
+            ], className='mb-2'),
+            dbc.Row([
+                dbc.Col(get_range_inputs('deduct', 'Agg deduct (%)', 50, 150, 5), width=4),
+                dbc.Col(get_range_inputs('limit', 'Agg limit (%)', 5, 100, 5), width=4),
+            ], className='mb-2'),
+            dbc.Row([
+                dbc.Col([
+                    own_button(page_id + 'btn-compute', 'Compute'),
+                    own_button(page_id + 'btn-export', 'Export to CSV'),
+                    html.Div(id=page_id + 'div-info'),
+                ]),
+            ], className='mb-2'),
+            dbc.Row([
+                dbc.Col([
+                    dcc.Loading(
+                        dcc.Graph(id=page_id + 'graph-heatmap'),
+                        id=page_id + 'loading-heatmap',
+                    ),
+                ]),
+            ]),
+        ], className='div-standard')
+    ])
+
+
+def get_range_inputs(name, label, start, stop, step):
+    return dbc.Row([
+        dbc.Label(label),
+        dbc.Col(dbc.Input(id=page_id + f'input-{name}-start', type='number', value=start), width=4),
+        dbc.Col(dbc.Input(id=page_id + f'input-{name}-stop', type='number', value=stop), width=4),
+        dbc.Col(dbc.Input(id=page_id + f'input-{name}-step', type='number', value=step, min=0), width=4),
+    ])
+
+
+def get_range(start, stop, step):
+    if None in [start, stop, step] or step <= 0 or stop < start:
+        raise ValueError('Enter a start, a stop greater than the start and a positive step')
+    values = np.arange(start, stop + step / 2, step)  # The stop is included
+    if len(values) > MAX_GRID_SIZE:
+        raise ValueError(f'The grid is limited to {MAX_GRID_SIZE} values by axis')
+    return values
+
+
+def get_source_loss_ratios(source):
+    # Annual loss ratios of the selected layer (sum of its model files, as in flaskapp.pricing.stoploss) or model file
+    kind, id_ = source.split('-')
+    if kind == 'layer':
+        modelfiles = session.get(Layer, int(id_)).modelfiles
+    else:
+        modelfiles = [session.get(ModelFile, int(id_))]
+    years, loss_ratios = align_yearlosses([get_modelfile_ylt(modelfile) for modelfile in modelfiles])
+    return loss_ratios.sum(axis=0)
+
+
+@callback(
+    Output(page_id + 'store-grid', 'data'),
+    Output(page_id + 'div-info', 'children'),
+    Input(page_id + 'btn-compute', 'n_clicks'),
+    State(page_id + 'select-source', 'value'),
+    State(page_id + 'input-deduct-start', 'value'),
+    State(page_id + 'input-deduct-stop', 'value'),
+    State(page_id + 'input-deduct-step', 'value'),
+    State(page_id + 'input-limit-start', 'value'),
+    State(page_id + 'input-limit-stop', 'value'),
+    State(page_id + 'input-limit-step', 'value'),
+    config_prevent_initial_callbacks=True
+)
+def compute_grid(n_clicks, source, deduct_start, deduct_stop, deduct_step, limit_start, limit_stop, limit_step):
+    if n_clicks is None or source is None:
+        raise PreventUpdate
+
+    try:
+        agg_deducts = get_range(deduct_start, deduct_stop, deduct_step)
+        agg_limits = get_range(limit_start, limit_stop, limit_step)
+        loss_ratios = get_source_loss_ratios(source)
+        start = time.perf_counter()
+        grid = get_sensitivity_grid(loss_ratios, agg_deducts, agg_limits, get_quantiles())
+    except ValueError as e:
+        return no_update, dbc.Alert(str(e), color='danger', duration=4000)
+
+    info = f'{len(agg_deducts)} x {len(agg_limits)} terms over {len(loss_ratios)} years ' \
+           f'computed in {1000 * (time.perf_counter() - start):.0f} ms'
+    return get_df_sensitivity(grid).to_dict('records'), html.Div(info, className='mt-2')
+
+
+@callback(
+    Output(page_id + 'graph-heatmap', 'figure'),
+    Input(page_id + 'store-grid', 'data'),
+    Input(page_id + 'select-metric', 'value'),
+    config_prevent_initial_callbacks=True
+)
+def display_heatmap(data, metric):
+    if not data:
+        raise PreventUpdate
+
+    df = pd.DataFrame(data).pivot(index='agg_deduct', columns='agg_limit', values=metric)
+    # https://plotly.com/python/heatmaps/
+    fig = px.imshow(
+        df,
+        labels={'x': 'Agg limit (%)', 'y': 'Agg deduct (%)', 'color': get_metrics()[metric]},
+        origin='lower',
+        aspect='auto',
+        color_continuous_scale='Blues',
+    )
+    return fig
+
+
+@callback(
+    Output(page_id + 'download', 'data'),
+    Input(page_id + 'btn-export', 'n_clicks'),
+    State(page_id + 'store-grid', 'data'),
+    State(page_id + 'select-source', 'value'),
+    config_prevent_initial_callbacks=True
+)
+def export_grid(n_clicks, data, source):
+    if n_clicks is None or not data:
+        raise PreventUpdate
+
+    # https://dash.plotly.com/dash-core-components/download
+    return dcc.send_data_frame(pd.DataFrame(data).to_csv, f'Sensitivity {source}.csv', index=False)
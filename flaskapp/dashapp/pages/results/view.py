@@ -1,10 +1,18 @@
 from flaskapp.dashapp.pages.utils import *
+import plotly.graph_objects as go
+from flaskapp.pricing.convergence import get_years_needed, CONFIDENCE
+from flaskapp.pricing.statistics import save_resultlayers_statistics, get_resultlayer_convergence
+from flaskapp.pricing.paging import get_resultlayer_page
+from flaskapp.pricing.tail import get_resultlayer_tail_metrics
 
 directory = get_directory(__name__)['directory']
 page = get_directory(__name__)['page']
 dash.register_page(__name__, path_template=f'/{directory}/{page}/<analysis_id>', order=2)
 page_id = get_page_id(__name__)
 
+RESULTLAYER_MODELS = {'ResultLayer': ResultLayer, 'ResultLayerXS': ResultLayerXS}
+TAIL_LEVELS = [.9, .95, .99, .995, .996, .998, .999]  # Default levels of the TVaRs and of the tail contributions
+
 
 def layout(analysis_id, resultfile_id=None):
     analysis = session.get(Analysis, analysis_id)
@@ -21,31 +29,34 @@ def layout(analysis_id, resultfile_id=None):
         # Set the title of the page
         title = resultfile.name.capitalize()
 
-        # Get the layers and model files for the pricing relationship of the result file
-        # Use the set() function to get the model files and layers without repetition
+        # Get the stop loss and excess of loss layers and the model files of the result file
         # Sort the objects by name with the sorted() function
-        layermodelfiles = resultfile.pricingrelationship.layermodelfiles
-
-        modelfiles = set([layermodelfile.modelfile for layermodelfile in layermodelfiles])
-        modelfiles = sorted(modelfiles, key=lambda modelfile: modelfile.name)
+        modelfiles = sorted(resultfile.modelfiles, key=lambda modelfile: modelfile.name)
+        layers = sorted(resultfile.layers + resultfile.xslayers, key=lambda layer: layer.name)
 
-        layers = set([layermodelfile.layer for layermodelfile in layermodelfiles])
-        layers = sorted(layers, key=lambda layer: layer.name)
+        # Save once the statistics of the layers processed before they were saved, see flaskapp.pricing.statistics
+        missing = [layer for layer in layers if not layer.stats]
+        if missing:
+            save_resultlayers_statistics(missing)
+            session.commit()
 
-        # Get the year loss table for the result file
-        resultyearlosses = resultfile.resultyearlosses
-
-        df_oep, df_summary = get_df_oep_summary(layers, modelfiles, resultyearlosses)
+        df_oep, df_summary = get_df_oep_summary(layers, modelfiles)
         resultfile_name = resultfile.name
 
+        # Get the simulation error of the statistics, see flaskapp.pricing.convergence
+        convergence = [get_resultlayer_convergence(layer) for layer in layers]
+
     else:
         # Set the title of the page with no results provided
         title = 'Process a pricing model to get the results'
         df_oep, df_summary = pd.DataFrame(), pd.DataFrame()
         resultfile_name = ''
+        convergence = []
+        layers = []
 
     return html.Div([
         dcc.Store(id=page_id + 'store', data={'analysis_id': analysis_id, 'resultfile_id': resultfile_id}),
+        dcc.Store(id=page_id + 'store-convergence', data=convergence),
         own_title(__name__, analysis.name),
         own_nav_middle(__name__, analysis.id),
         own_nav_bottom(__name__, analysis.id),
@@ -62,7 +73,11 @@ def layout(analysis_id, resultfile_id=None):
                     dag.AgGrid(
                         id=page_id + 'grid-oep',
                         rowData=df_oep.to_dict('records'),
-                        columnDefs=[{'field': col} for col in df_oep.columns if col != 'proba'],
+                        columnDefs=[{'field': 'quantile'}] + [
+                            {'field': col, 'valueFormatter': {
+                                'function': 'params.value == null ? "" : d3.format(",.0f")(params.value)'}}
+                            for col in df_oep.columns if col not in ['quantile', 'proba']
+                        ],
                         columnSize='responsiveSizeToFit',
                         dashGridOptions={
                             'domLayout': 'autoHeight',
@@ -76,16 +91,128 @@ def layout(analysis_id, resultfile_id=None):
             dbc.Row([
                 dbc.Col([
                     own_button(page_id + 'btn-export', 'Export Results to CSV'),
+                    # Complete YLT, streamed by the export blueprint, see flaskapp.views.export
+                    html.Span('Export the complete YLT:', className='ms-3 me-2') if resultfile else None,
+                ] + [
+                    html.A(label, href=f'/export/resultfiles/{resultfile.id}/ylt.{fmt}', className='me-2')
+                    for fmt, label in [('csv', 'CSV'), ('parquet', 'Parquet'), ('arrow', 'Arrow')] if resultfile
                 ]),
             ]),
             dbc.Row([
                 dbc.Col([
-
+                    html.Div('Simulation error', className='h6 mt-4 mb-3'),
+                    dmc.NumberInput(
+                        id=page_id + 'input-precision',
+                        label=f'Target precision (% of the estimate, at a {CONFIDENCE:.0%} confidence level)',
+                        value=1,
+                        min=0.01,
+                        precision=2,
+                        step=0.5,
+                        className='mb-2',
+                        style={'width': 400},
+                    ),
+                    dag.AgGrid(
+                        id=page_id + 'grid-convergence',
+                        rowData=get_rowdata_convergence(convergence, 1),
+                        columnDefs=[
+                            {'field': 'layer'},
+                            {'field': 'statistic'},
+                            {'field': 'estimate', 'valueFormatter': {'function': 'd3.format(",.0f")(params.value)'}},
+                            {'field': 'standard_error', 'headerName': 'standard error',
+                             'valueFormatter': {'function': 'd3.format(",.0f")(params.value)'}},
+                            {'field': 'lower', 'headerName': 'CI lower bound',
+                             'valueFormatter': {'function': 'd3.format(",.0f")(params.value)'}},
+                            {'field': 'upper', 'headerName': 'CI upper bound',
+                             'valueFormatter': {'function': 'd3.format(",.0f")(params.value)'}},
+                            {'field': 'relative_error', 'headerName': 'relative error',
+                             'valueFormatter': {'function': 'd3.format(".2%")(params.value)'}},
+                            {'field': 'years', 'headerName': 'simulated years',
+                             'valueFormatter': {'function': 'd3.format(",d")(params.value)'}},
+                            {'field': 'years_needed', 'headerName': 'years needed', 'valueFormatter': {
+                                'function': 'params.value == null ? "" : d3.format(",d")(params.value)'}},
+                        ],
+                        columnSize='responsiveSizeToFit',
+                        dashGridOptions={'domLayout': 'autoHeight'},
+                        className='ag-theme-alpine custom mb-2',
+                    ),
+                ]),
+            ]),
+            dbc.Row([
+                dbc.Col([
+                    html.Div('Layer details', className='h6 mt-4 mb-3'),
+                    dmc.Select(
+                        id=page_id + 'select-layer',
+                        label='Layer',
+                        data=[{'value': f'{type(layer).__name__}-{layer.id}', 'label': layer.name} for layer in layers],
+                        value=f'{type(layers[0]).__name__}-{layers[0].id}' if layers else None,
+                        className='mb-2',
+                        style={'width': 400},
+                    ),
+                    dmc.TextInput(
+                        id=page_id + 'input-levels',
+                        label='TVaR levels, separated by commas',
+                        value=', '.join(str(level) for level in TAIL_LEVELS),
+                        debounce=500,
+                        className='mb-3',
+                        style={'width': 400},
+                    ),
+                    # The tail metrics load the whole YLT of the layer, only on demand
+                    own_button(page_id + 'btn-tail', 'Show tail metrics'),
+                    dcc.Loading(html.Div(id=page_id + 'div-tail')),
+                    html.Div('Year losses', className='h6 mt-4 mb-3'),
+                    html.Div(
+                        own_grid_yearlosses(f'{type(layers[0]).__name__}-{layers[0].id}') if layers else None,
+                        id=page_id + 'div-yearlosses',
+                    ),
                 ]),
             ]),
         ], className='div-standard')
     ])
 
+
+def own_grid_yearlosses(value):
+    # The layer is part of the id: a new grid, with an empty cache, is created when another layer is selected
+    layer_type, layer_id = value.split('-')
+    return own_grid_infinite(
+        {'page_id': page_id, 'type': 'grid-yearlosses', 'layer_type': layer_type, 'layer_id': int(layer_id)},
+        columnDefs=[
+            {'field': 'model_name', 'headerName': 'model file', 'filter': 'agTextColumnFilter'},
+            {'field': 'year', 'filter': 'agNumberColumnFilter'},
+        ] + [
+            {'field': field, 'filter': 'agNumberColumnFilter',
+             'valueFormatter': {'function': 'params.value == null ? "" : d3.format(",d")(params.value)'}}
+            for field in ['gross', 'ceded', 'net']
+        ],
+    )
+
+
+def get_rowdata_convergence(convergence, precision):
+    rowData = []
+    for layer in convergence:
+        if 'error' in layer:
+            rowData.append({'layer': layer['name'], 'statistic': layer['error']})
+            continue
+
+        estimate = np.array(layer['estimate'])
+        half_width = np.array(layer['upper']) - estimate
+        years_needed = get_years_needed(estimate, layer['standard_error'], layer['n_years'], precision / 100)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            relative_error = np.where(estimate != 0, half_width / np.abs(estimate), np.nan)
+
+        for k, statistic in enumerate(layer['statistics']):
+            rowData.append({
+                'layer': layer['name'],
+                'statistic': get_statistic_label(statistic),
+                'estimate': layer['estimate'][k],
+                'standard_error': layer['standard_error'][k],
+                'lower': layer['lower'][k],
+                'upper': layer['upper'][k],
+                'relative_error': None if np.isnan(relative_error[k]) else float(relative_error[k]),
+                'years': layer['n_years'],
+                'years_needed': int(years_needed[k]) if np.isfinite(years_needed[k]) else None,
+            })
+    return rowData
+
 @callback(
     Output(page_id + 'grid-oep', 'exportDataAsCsv'),
     Input(page_id + 'btn-export', 'n_clicks'),
@@ -95,3 +222,144 @@ def export_data_to_csv(n_clicks):
     if n_clicks:
         return True
     return False
+
+
+@callback(
+    Output(page_id + 'grid-convergence', 'rowData'),
+    Input(page_id + 'input-precision', 'value'),
+    State(page_id + 'store-convergence', 'data'),
+    config_prevent_initial_callbacks=True
+)
+def update_years_needed(precision, data):
+    if not precision or precision <= 0:
+        raise PreventUpdate
+    return get_rowdata_convergence(data, precision)
+
+
+@callback(
+    Output(page_id + 'div-yearlosses', 'children'),
+    Input(page_id + 'select-layer', 'value'),
+    config_prevent_initial_callbacks=True
+)
+def display_yearlosses(value):
+    if not value:
+        raise PreventUpdate
+    return own_grid_yearlosses(value)
+
+
+@callback(
+    Output({'page_id': page_id, 'type': 'grid-yearlosses', 'layer_type': MATCH, 'layer_id': MATCH}, 'getRowsResponse'),
+    Input({'page_id': page_id, 'type': 'grid-yearlosses', 'layer_type': MATCH, 'layer_id': MATCH}, 'getRowsRequest'),
+    State({'page_id': page_id, 'type': 'grid-yearlosses', 'layer_type': MATCH, 'layer_id': MATCH}, 'id'),
+    config_prevent_initial_callbacks=True
+)
+def get_yearlosses_page(request, component_id):
+    # Only the requested block of rows is sent to the browser, see flaskapp.pricing.paging
+    if not request:
+        raise PreventUpdate
+    resultlayer = session.get(RESULTLAYER_MODELS[component_id['layer_type']], component_id['layer_id'])
+    return get_resultlayer_page(resultlayer, request)
+
+
+def get_levels(value):
+    # Levels typed by the user, the entries not in ]0, 1[ being ignored
+    levels = []
+    for entry in (value or '').split(','):
+        try:
+            level = float(entry)
+        except ValueError:
+            continue
+        if 0 < level < 1:
+            levels.append(level)
+    return sorted(set(levels))
+
+
+@callback(
+    Output(page_id + 'div-tail', 'children'),
+    Input(page_id + 'btn-tail', 'n_clicks'),
+    State(page_id + 'select-layer', 'value'),
+    State(page_id + 'input-levels', 'value'),
+    config_prevent_initial_callbacks=True
+)
+def display_tail_metrics(n_clicks, value, levels_value):
+    levels = get_levels(levels_value)
+    if not n_clicks or not value or not levels:
+        raise PreventUpdate
+
+    # The sorted YLT of the layer is cached, see flaskapp.pricing.tail
+    layer_type, layer_id = value.split('-')
+    resultlayer = session.get(RESULTLAYER_MODELS[layer_type], int(layer_id))
+    metrics = get_resultlayer_tail_metrics(resultlayer, levels)
+    if not metrics['n_years']:
+        return dbc.Alert('The layer has no year losses', color='info')
+
+    model_names = {modelfile.id: modelfile.name for modelfile in resultlayer.modelfiles}
+    amount_formatter = {'function': 'params.value == null ? "" : d3.format(",.0f")(params.value)'}
+
+    # TVaRs and tail contributions of the model files by level
+    rowData_tvar = [
+        {'level': level, 'var': metrics['var'][k], 'tvar': metrics['tvar'][k]}
+        | {f'model_{model_id}': contributions[k] for model_id, contributions
+           in zip(metrics['model_ids'], metrics['contributions'])}
+        for k, level in enumerate(metrics['levels'])
+    ]
+    columnDefs_tvar = [
+        {'field': 'level', 'valueFormatter': {'function': 'd3.format(".2%")(params.value)'}},
+        {'field': 'var', 'headerName': 'VaR', 'valueFormatter': amount_formatter},
+        {'field': 'tvar', 'headerName': 'TVaR', 'valueFormatter': amount_formatter},
+    ] + [
+        {'field': f'model_{model_id}', 'headerName': f'{model_names.get(model_id, model_id)} contribution',
+         'valueFormatter': amount_formatter}
+        for model_id in metrics['model_ids']
+    ]
+
+    # AEP and largest model file amount at the usual return periods
+    return_periods = metrics['return_periods']
+    rowData_ep = [
+        {'return_period': period, 'aep': return_periods['aep'][k], 'largest_model': return_periods['largest_model'][k],
+         'tvar': return_periods['tvar'][k]}
+        for k, period in enumerate(return_periods['return_period'])
+    ]
+
+    ep_curve = metrics['ep_curve']
+    return_period = [1 / probability for probability in ep_curve['probability']]
+    fig = go.Figure([
+        go.Scatter(x=return_period, y=ep_curve['aep'], mode='lines', name='AEP'),
+        go.Scatter(x=return_period, y=ep_curve['largest_model'], mode='lines', name='largest model file'),
+    ])
+    fig.update_xaxes(type='log', title='return period')
+    fig.update_yaxes(title='ceded')
+
+    return html.Div([
+        html.Div(f'Tail risk of {resultlayer.name} on {metrics["n_years"]:,} simulated years', className='mb-2'),
+        dag.AgGrid(
+            id=page_id + 'grid-tvar',
+            rowData=rowData_tvar,
+            columnDefs=columnDefs_tvar,
+            columnSize='responsiveSizeToFit',
+            dashGridOptions={'domLayout': 'autoHeight'},
+            className='ag-theme-alpine custom mb-3',
+        ),
+        dbc.Row([
+            dbc.Col([
+                dag.AgGrid(
+                    id=page_id + 'grid-ep',
+                    rowData=rowData_ep,
+                    columnDefs=[
+                        {'field': 'return_period', 'headerName': 'return period',
+                         'valueFormatter': {'function': 'd3.format(",d")(params.value)'}},
+                        {'field': 'aep', 'headerName': 'AEP', 'valueFormatter': amount_formatter},
+                        {'field': 'largest_model', 'headerName': 'largest model file',
+                         'valueFormatter': amount_formatter},
+                        {'field': 'tvar', 'headerName': 'TVaR', 'valueFormatter': amount_formatter},
+                    ],
+                    columnSize='responsiveSizeToFit',
+                    dashGridOptions={'domLayout': 'autoHeight'},
+                    className='ag-theme-alpine custom',
+                ),
+            ], width=5),
+            dbc.Col([
+                dcc.Graph(id=page_id + 'graph-ep', figure=fig),
+            ], width=7),
+        ]),
+    ])
@@ -21,7 +21,11 @@ Functions:
 - get_datatable_css(): Define custom CSS rules for data tables.
 - get_datatable_style_cell(): Define the style for data table cells.
 - get_button(component_id, name): Create a button component.
+- own_grid_infinite(component_id, columnDefs): Create a grid whose rows are requested by blocks from the server.
+- get_variance_reduction_text(variance_reduction): Describe the variance reduction of a sampling method.
 - get_lognorm_param(serie): Calculate log-normal distribution parameters from a data series.
+- get_statistic_label(statistic): Get the label of a statistic of the results, e.g. 'q0.99'.
+- get_df_oep_summary(layers, modelfiles): Get the OEP and the summary statistics of result layers.
 
 Dependencies:
 - dash
@@ -33,13 +37,15 @@ Dependencies:
 
 # TODO: Update the doctring
 import dash
-from dash import html, dcc, dash_table, callback, Output, Input, State, ALL, no_update
+from dash import html, dcc, dash_table, callback, Output, Input, State, ALL, MATCH, no_update
 from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 import dash_mantine_components as dmc
 import dash_ag_grid as dag
 from flaskapp.extensions import session
 from flaskapp.models import *
+from flaskapp.pricing.fitting import get_lognorm_param
+from flaskapp.pricing.statistics import get_resultlayer_statistics
 import numpy as np
 import pandas as pd
 from scipy.stats import lognorm
@@ -225,19 +231,9 @@ def df_from_sqla(query):
 
 
 def get_link_results(row):
-    # Check if the pricing relationships has already been processed,
-    # that is if a corresponding result file exists
-    # If so, create a link to the result
-    # TODO: Correct below with the new DB models and the new querying style
-    resultfile = session.query(ResultFile) \
-        .filter_by(analysis_id=row['analysis_id'], pricingrelationship_id=row['id']).first()
-
-    if resultfile:
-        # Link to the result
-        return '[View results]' \
-            + '(/dashapp/results/view/' + row['analysis_id'] + '?resultfile_id=' + str(resultfile.id) + ')'
-    else:
-        return 'Process to get results'
+    # Create a link to the view page of the result file
+    return '[View results]' \
+        + '(/dashapp/results/view/' + str(row['analysis_id']) + '?resultfile_id=' + str(row['id']) + ')'
 
 
 def own_button(component_id, name):
@@ -250,105 +246,76 @@ def own_button(component_id, name):
     )
 
 
-def get_lognorm_param(serie):
-    mean = np.mean(serie)
-    std = np.std(serie)
-
-    mu = np.log(mean / np.sqrt(1 + std ** 2 / mean ** 2))
-    scale = np.exp(mu)
-    s = np.sqrt(np.log((1 + std ** 2 / mean ** 2)))
-
-    return {
-        'mean': mean,
-        'std': std,
-        'mu': mu,
-        'scale': scale,
-        's': s
-    }
-
+def own_grid_infinite(component_id, columnDefs):
+    # The rows are requested by blocks with the getRowsRequest property, see flaskapp.pricing.paging
+    # https://dash.plotly.com/dash-ag-grid/infinite-scroll
+    # The grid has a fixed height: the autoHeight layout would render all the rows
+    return dag.AgGrid(
+        id=component_id,
+        columnDefs=columnDefs,
+        rowModelType='infinite',
+        defaultColDef={'sortable': True, 'filter': True, 'floatingFilter': True},
+        columnSize='responsiveSizeToFit',
+        dashGridOptions={
+            'cacheBlockSize': 100,
+            'maxBlocksInCache': 20,
+            'infiniteInitialRowCount': 100,
+        },
+        style={'height': 450},
+        className='ag-theme-alpine custom',
+    )
 
-def get_df_oep_summary(layers, modelfiles, resultyearlosses):
-    # Initialize the OEP table
-    QUANTILES = [.999, .998, .996, .995, .99, .98, .9667, .96, .95, .9, .8, .5]
-    df_oep = pd.DataFrame({
-        'quantile': [f'{quantile:.2%}' for quantile in QUANTILES],
-        'return period': [f'{1 / (1 - quantile):,.0f}' for quantile in QUANTILES],
-        'proba': QUANTILES,
-    })
 
-    # Initialize the summary table
-    df_summary = pd.DataFrame({
-        'quantile': ['Pure premium', 'Standard deviation'],
-        'return period': [''] * 2,
-        'proba': [''] * 2,
-    }, index=['Pure premium', 'Standard deviation'])
+def get_variance_reduction_text(variance_reduction):
+    # Variance reduction of a sampling method, see flaskapp.pricing.sampling.estimate_variance_reduction
+    labels = {'mean': 'mean', 'q0.995': '1 in 200', 'q0.999': '1 in 1000'}
+    factors = ', '.join(f'{labels.get(key, key)} x{value:,.1f}' for key, value in variance_reduction.items())
+    return f'Variance reduction compared with Monte Carlo: {factors}, ' \
+           f'i.e. the same precision with as many times fewer years'
 
-    # Add rows to df_summary relating to the model files
-    df_summary_index_ini = list(df_summary.index)
 
-    for modelfile in modelfiles:
-        df_summary.loc[len(df_summary)] = [f'PP {modelfile.name}'] + [''] * 2
+def get_statistic_label(statistic):
+    if statistic == 'mean':
+        return 'Pure premium'
+    if statistic == 'std':
+        return 'Standard deviation'
+    quantile = float(statistic[1:])
+    return f'{quantile:.2%} ({1 / (1 - quantile):,.0f} years)'
 
-    df_summary.index = df_summary_index_ini + [f'PP {modelfile.name}' for modelfile in modelfiles]
 
-    """
-    What df_summary will look like:
+def get_df_oep_summary(layers, modelfiles):
+    """ Get the OEP and the summary statistics of the ceded amounts of result layers, as raw numbers.
 
-    index               quantile            return period       proba
-    -------------------------------------------------------------------
-    Pure premium        Pure premium        ''                  ''
-    Standard deviation  Standard deviation  ''                  ''
-    Model File 1        PP Model File 1     ''                  ''
-    Model File 2        PP Model File 1     ''                  ''
-    ...                 ...                 ''                  ''
+    The statistics are read from the ResultLayerStats and ResultModelStats saved with the result file (see
+    flaskapp.pricing.statistics), without loading the YLTs. The formatting is left to the grid.
 
+    :param layers: list of ResultLayer or ResultLayerXS, one column of the tables each
+    :param modelfiles: list of ResultModelFile, one pure premium row of the summary each
+    :return: tuple (df_oep, df_summary), with a row by quantile and by summary statistic
     """
+    statistics = [get_resultlayer_statistics(layer) for layer in layers]
 
-    # Add columns to df_summary relating to the layers
-    for layer in layers:
-        df_summary[layer.name] = [''] * len(df_summary.index)
-
-    """
-    What df_summary will look like:
-
-    index               quantile            return period       proba       Layer 1     Layer2
-    ---------------------------------------------------------------------------------------------
-    Pure premium        Pure premium        ''                  ''          ''          ''
-    Standard deviation  Standard deviation  ''                  ''          ''          ''
-    Model File 1        PP Model File 1     ''                  ''          ''          ''
-    Model File 2        PP Model File 1     ''                  ''          ''          ''
-    ...                 ...                 ''                  ''          ''          ''
-
-    """
+    # The quantiles saved for the layers, usually the RESULT_QUANTILES of the processing (see config.py)
+    quantiles = np.array(sorted({
+        float(statistic[1:]) for values, _, _ in statistics for statistic in values if statistic.startswith('q')
+    }, reverse=True))
+    df_oep = pd.DataFrame({
+        'quantile': [f'{quantile:.2%}' for quantile in quantiles],
+        'return period': 1 / (1 - quantiles),
+        'proba': quantiles,
+    })
 
-    # Get the OEP, pure premium and standard deviation by layer
-    for layer in layers:
-        resultyearlosses_for_layer = [
-            resultyearloss for resultyearloss in resultyearlosses
-            if resultyearloss.layermodelfile.layer == layer
+    summary_index = ['Pure premium', 'Standard deviation'] + [f'PP {modelfile.name}' for modelfile in modelfiles]
+    df_summary = pd.DataFrame({
+        'quantile': summary_index,
+        'return period': [None] * len(summary_index),
+        'proba': [None] * len(summary_index),
+    }, index=summary_index)
+
+    for layer, (values, _, pure_premiums) in zip(layers, statistics):
+        df_oep[layer.name] = [values.get(f'q{quantile}') for quantile in quantiles]
+        df_summary[layer.name] = [values.get('mean'), values.get('std')] + [
+            pure_premiums.get(modelfile.id) for modelfile in modelfiles
         ]
 
-        if len(resultyearlosses_for_layer) > 0:
-            recoveries = df_from_sqla(resultyearlosses_for_layer)[['year', 'recovery']]
-            recoveries['recovery'] = recoveries['recovery'].astype(int)
-
-            recoveries_by_year = recoveries.groupby('year')['recovery'].sum()
-            df_oep[layer.name] = df_oep['proba'].map(lambda proba: f'{recoveries_by_year.quantile(proba):,.0f}')
-
-            df_summary.at['Pure premium', layer.name] = f'{recoveries_by_year.mean():,.0f}'
-            df_summary.at['Standard deviation', layer.name] = f'{recoveries_by_year.std():,.0f}'
-
-        # Get the expected loss by loss model
-        for modelfile in modelfiles:
-            resultyearlosses_for_layer_and_modelfile = [
-                resultyearloss for resultyearloss in resultyearlosses_for_layer
-                if resultyearloss.layermodelfile.modelfile == modelfile
-            ]
-            recoveries_modelfile = df_from_sqla(resultyearlosses_for_layer_and_modelfile)
-
-            if len(recoveries_modelfile) > 0:
-                recoveries_modelfile['recovery'] = recoveries_modelfile['recovery'].astype(int)
-                df_summary.at[f'PP {modelfile.name}', layer.name] \
-                    = f'{round(recoveries_modelfile["recovery"].mean()):,.0f}'
-
     return df_oep, df_summary
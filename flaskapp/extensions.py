@@ -1,7 +1,20 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import select
+from sqlalchemy import event, select
 from flask_migrate import Migrate
 
 db = SQLAlchemy()
 session = db.session
 migrate = Migrate()
+
+
+def enable_sqlite_savepoints(engine):
+    # pysqlite emits BEGIN only before the writes, so a SAVEPOINT opened before may start and commit its own
+    # transaction: let SQLAlchemy emit BEGIN itself, so that session.begin_nested rolls back as expected
+    # https://docs.sqlalchemy.org/en/20/dialects/sqlite.html#serializable-isolation-savepoints-transactional-ddl
+    @event.listens_for(engine, 'connect')
+    def do_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def do_begin(connection):
+        connection.exec_driver_sql('BEGIN')
@@ -11,6 +11,7 @@ This module defines a set of SQLAlchemy database models representing a modeling
 The models include:
 - Analysis: Represents a reinsurance analysis.
 - Layer: Represents a layer within an analysis.
+- LayerXS: Represents an occurrence excess of loss layer within an analysis.
 - HistoLoss: Represents individual historical loss records.
 - PremiumFile: Represents premium data files (not used for SL pricing).
 - Premium: Represents individual premium records (not used for SL pricing).
@@ -18,8 +19,14 @@ The models include:
 - RiskProfile: Represents individual risk profiles (not used for SL pricing).
 - ModelFile: Represents a loss model associated with an analysis.
 - ModelYearLoss: Represents individual year loss records.
+- YLTBlob: Represents a packed YLT shared by the model files with the same content.
 - ResultFile: Represents analysis results.
 - ResultYearLoss: Represents individual year loss records in analysis results.
+- ResultLayerXS: Represents an occurrence excess of loss layer in analysis results.
+- ResultLayerYearLossXS: Represents individual year loss records of an excess of loss layer in analysis results.
+- ResultLayerStats: Represents a statistic of the ceded amounts of a layer in analysis results.
+- ResultModelStats: Represents the pure premium of a model file in a layer in analysis results.
+- Job: Represents a pricing job queued for the pricing workers.
 
 These models are designed to work with SQLAlchemy and are used to interact with the underlying database.
 
@@ -35,12 +42,16 @@ Resources:
 """
 
 from flaskapp.extensions import db
+from datetime import datetime
 from typing import Optional
 from typing import Final
 from typing import List
 from sqlalchemy import Column
 from sqlalchemy import String
+from sqlalchemy import BigInteger
 from sqlalchemy import DateTime
+from sqlalchemy import LargeBinary
+from sqlalchemy import Text
 from sqlalchemy import ForeignKey
 from sqlalchemy import Table
 from sqlalchemy.orm import validates
@@ -115,9 +126,11 @@ class Analysis(CommonMixin, db.Model):
     name: Mapped[str] = mapped_column(String(50))
     quote: Mapped[int] = mapped_column()
     client: Mapped[str] = mapped_column(String(50))
+    seed: Mapped[Optional[int]] = mapped_column(BigInteger)  # Common random numbers, see flaskapp.pricing.rng
 
     # Define the 1-to-many relationship between Analysis and Layer, HistoLossFile, PremiumFile, RiskProfileFile, ModelFile, PricingRelationship, ResultFile
     layers: Mapped[List['Layer']] = relationship(back_populates='analysis', cascade='all, delete-orphan')
+    xslayers: Mapped[List['LayerXS']] = relationship(back_populates='analysis', cascade='all, delete-orphan')
     histolossfiles: Mapped[List['HistoLossFile']] = \
         relationship(back_populates='analysis', cascade='all, delete-orphan')
     premiumfiles: Mapped[List['PremiumFile']] = relationship(back_populates='analysis', cascade='all, delete-orphan')
@@ -125,13 +138,15 @@ class Analysis(CommonMixin, db.Model):
         relationship(back_populates='analysis', cascade='all, delete-orphan')
     modelfiles: Mapped[List['ModelFile']] = relationship(back_populates='analysis', cascade='all, delete-orphan')
     resultfiles: Mapped[List['ResultFile']] = relationship(back_populates='analysis', cascade='all, delete-orphan')
+    jobs: Mapped[List['Job']] = relationship(back_populates='analysis', cascade='all, delete-orphan')
 
     def copy(self):
         new = Analysis()
         new.name = self.name + ' - Copy'
-        for attr in ['quote', 'client']:
+        for attr in ['quote', 'client', 'seed']:
             setattr(new, attr, getattr(self, attr))
         new.layers.extend([layer.copy() for layer in self.layers])
+        new.xslayers.extend([xslayer.copy() for xslayer in self.xslayers])
         new.histolossfiles.extend([histolossfile.copy() for histolossfile in self.histolossfiles])
         new.premiumfiles.extend([premiumfile.copy() for premiumfile in self.premiumfiles])
         new.riskprofilefiles.extend([riskprofilefile.copy() for riskprofilefile in self.riskprofilefiles])
@@ -156,11 +171,38 @@ class Layer(CommonMixin, db.Model):
 
     def copy(self):
         new = Layer()
-        for attr in ['name', 'premium', 'deductible', 'limit', 'display_order']:
+        for attr in ['name', 'premium', 'agg_limit', 'agg_deduct', 'display_order']:
             setattr(new, attr, getattr(self, attr))
         return new
 
 
+class LayerXS(CommonMixin, db.Model):
+    # Occurrence excess of loss layer, priced over the event loss tables of its model files
+    # The terms are amounts, see flaskapp.pricing.xs
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String(50))
+    premium: Mapped[int] = mapped_column()
+    occ_limit: Mapped[int] = mapped_column()
+    occ_deduct: Mapped[Optional[int]] = mapped_column()
+    agg_limit: Mapped[int] = mapped_column()
+    agg_deduct: Mapped[int] = mapped_column()
+    display_order: Mapped[int] = mapped_column()
+
+    # Define the 1-to-many relationship between Analysis and LayerXS
+    analysis_id: Mapped[int] = mapped_column(ForeignKey('analysis.id'))
+    analysis: Mapped['Analysis'] = relationship(back_populates='xslayers')
+
+    # Get the modelfiles associated to the layer through the association layerxs_modelfile_table
+    modelfiles: Mapped[List['ModelFile']] = relationship(secondary=lambda: layerxs_modelfile_table)
+
+    def copy(self):
+        new = LayerXS()
+        for attr in ['name', 'premium', 'occ_limit', 'occ_deduct', 'agg_limit', 'agg_deduct', 'display_order']:
+            if getattr(self, attr) is not None:
+                setattr(new, attr, getattr(self, attr))
+        return new
+
+
 class HistoLossFile(CommonMixin, db.Model):
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(50))
@@ -272,6 +314,15 @@ class ModelFile(CommonMixin, db.Model):
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(50))
     type: Mapped[str] = mapped_column(String(50))  # Cat/Non cat
+    n_years: Mapped[Optional[int]] = mapped_column()  # Number of simulated years, see flaskapp.pricing.simulation
+    seed: Mapped[Optional[int]] = mapped_column(BigInteger)  # Seed of the simulation, see flaskapp.pricing.rng
+    sampling: Mapped[Optional[str]] = mapped_column(String(50))  # Sampling method, see flaskapp.pricing.sampling
+
+    # Columnar storage of the YLT in a blob shared by all the files with the same content, used instead of the year
+    # loss rows for large files. See flaskapp.pricing.columnar
+    ylt_hash: Mapped[Optional[str]] = mapped_column(String(64), index=True)  # See flaskapp.pricing.fingerprint
+    yltblob_id: Mapped[Optional[int]] = mapped_column(ForeignKey('yltblob.id'))
+    yltblob: Mapped[Optional['YLTBlob']] = relationship()
 
     # Define the 1-to-many relationship between Analysis and ModelFile
     analysis_id: Mapped[int] = mapped_column(ForeignKey('analysis.id'))
@@ -282,9 +333,10 @@ class ModelFile(CommonMixin, db.Model):
 
     def copy(self):
         new = ModelFile()
-        for attr in ['name']:
+        for attr in ['name', 'type', 'n_years', 'seed', 'sampling', 'ylt_hash', 'yltblob_id']:
             setattr(new, attr, getattr(self, attr))
-        new.modelyearlosses.extend([modelyearloss.copy() for modelyearloss in self.modelyearlosses])
+        # A YLT stored as a blob is shared by reference, only the YLTs stored as rows are copied
+        new.yearlosses.extend([modelyearloss.copy() for modelyearloss in self.yearlosses])
         return new
 
 
@@ -299,11 +351,20 @@ class ModelYearLoss(CommonMixin, db.Model):
 
     def copy(self):
         new = ModelYearLoss()
-        for attr in ['name', 'year', 'amount']:
+        for attr in ['year', 'loss_ratio']:
             setattr(new, attr, getattr(self, attr))
         return new
 
 
+class YLTBlob(CommonMixin, db.Model):
+    # Content-addressed storage of the packed YLTs, see flaskapp.pricing.columnar
+    # A blob is referenced by the yltblob_id of ModelFile and ResultModelFile: the blobs no longer referenced are
+    # deleted by flaskapp.pricing.columnar.delete_unreferenced_yltblobs
+    id: Mapped[int] = mapped_column(primary_key=True)
+    ylt_hash: Mapped[str] = mapped_column(String(64), unique=True)
+    data: Mapped[bytes] = mapped_column(LargeBinary, deferred=True)
+
+
 layer_modelfile_table: Final[Table] = Table(
     'layer_modelfile',
     db.metadata,
@@ -311,6 +372,13 @@ layer_modelfile_table: Final[Table] = Table(
     Column('modelfile_id', ForeignKey('modelfile.id'), primary_key=True),
 )
 
+layerxs_modelfile_table: Final[Table] = Table(
+    'layerxs_modelfile',
+    db.metadata,
+    Column('layerxs_id', ForeignKey('layerxs.id'), primary_key=True),
+    Column('modelfile_id', ForeignKey('modelfile.id'), primary_key=True),
+)
+
 
 class ResultFile(CommonMixin, db.Model):
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -322,6 +390,7 @@ class ResultFile(CommonMixin, db.Model):
 
     # Define the 1-to-many relationship between ResultFile and ResultLayer, ResultModelFile
     layers: Mapped[List['ResultLayer']] = relationship(back_populates='resultfile', cascade='all, delete-orphan')
+    xslayers: Mapped[List['ResultLayerXS']] = relationship(back_populates='resultfile', cascade='all, delete-orphan')
     modelfiles: Mapped[List['ResultModelFile']] = relationship(back_populates='resultfile',
                                                                cascade='all, delete-orphan')
 
@@ -333,6 +402,11 @@ class ResultLayer(CommonMixin, db.Model):
     agg_limit: Mapped[int] = mapped_column()
     agg_deduct: Mapped[int] = mapped_column()
 
+    # Columnar storage of the YLT as a compressed blob, used instead of the year loss rows for large files
+    # See flaskapp.pricing.columnar
+    ylt: Mapped[Optional[bytes]] = mapped_column(LargeBinary, deferred=True)
+    fingerprint: Mapped[Optional[str]] = mapped_column(String(64), index=True)  # See flaskapp.pricing.fingerprint
+
     # Define the 1-to-many relationship between ResultFile and ResultLayer
     resultfile_id: Mapped[int] = mapped_column(ForeignKey('resultfile.id'))
     resultfile: Mapped['ResultFile'] = relationship(back_populates='layers')
@@ -343,27 +417,41 @@ class ResultLayer(CommonMixin, db.Model):
     # Define the 1-to-many relationship between ResultLayer and ResultYearLoss
     yearlosses: Mapped[List['ResultLayerYearLoss']] = relationship(back_populates='layer', cascade='all, delete-orphan')
 
+    # Define the 1-to-many relationships between ResultLayer and ResultLayerStats, ResultModelStats
+    stats: Mapped[List['ResultLayerStats']] = relationship(back_populates='layer', cascade='all, delete-orphan',
+                                                           order_by='ResultLayerStats.id')
+    modelstats: Mapped[List['ResultModelStats']] = relationship(back_populates='layer', cascade='all, delete-orphan')
+
 
-# class ResultLayerXS(CommonMixin, db.Model):
-#     id: Mapped[int] = mapped_column(primary_key=True)
-#     name: Mapped[str] = mapped_column(String(50))
-#     premium: Mapped[int] = mapped_column()
-#     occ_limit: Mapped[int] = mapped_column()
-#     occ_deduct: Mapped[Optional[int]] = mapped_column()
-#     agg_limit: Mapped[int] = mapped_column()
-#     agg_deduct: Mapped[int] = mapped_column()
-#
-#     # Define the 1-to-many relationship between ResultFile and ResultLayer
-#     resultfile_id: Mapped[int] = mapped_column(ForeignKey('resultfile.id'))
-#     resultfile: Mapped['ResultFile'] = relationship(back_populates='layers')
-#
-#     # Get the modelfiles associated to the resultlayer through the association result_layer_modelfile_table
-#     modelfiles: Mapped[List['ResultModelFile']] = relationship(secondary=lambda: result_layer_modelfile_table)
-#
-#     # Define the 1-to-many relationship between ResultLayer and ResultYearLoss
-#     # TODO: Create ResultLayerYearLossXS
-#     yearlosses: Mapped[List['ResultLayerYearLossXS']] = relationship(back_populates='layer',
-#                                                                      cascade='all, delete-orphan')
+class ResultLayerXS(CommonMixin, db.Model):
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String(50))
+    premium: Mapped[int] = mapped_column()
+    occ_limit: Mapped[int] = mapped_column()
+    occ_deduct: Mapped[Optional[int]] = mapped_column()
+    agg_limit: Mapped[int] = mapped_column()
+    agg_deduct: Mapped[int] = mapped_column()
+
+    # Columnar storage of the YLT as a compressed blob, used instead of the year loss rows for large files
+    # See flaskapp.pricing.columnar
+    ylt: Mapped[Optional[bytes]] = mapped_column(LargeBinary, deferred=True)
+
+    # Define the 1-to-many relationship between ResultFile and ResultLayerXS
+    resultfile_id: Mapped[int] = mapped_column(ForeignKey('resultfile.id'))
+    resultfile: Mapped['ResultFile'] = relationship(back_populates='xslayers')
+
+    # Get the modelfiles associated to the resultlayer through the association result_layerxs_modelfile_table
+    modelfiles: Mapped[List['ResultModelFile']] = relationship(secondary=lambda: result_layerxs_modelfile_table)
+
+    # Define the 1-to-many relationship between ResultLayerXS and ResultLayerYearLossXS
+    yearlosses: Mapped[List['ResultLayerYearLossXS']] = relationship(back_populates='layer',
+                                                                     cascade='all, delete-orphan')
+
+    # Define the 1-to-many relationships between ResultLayerXS and ResultLayerStats, ResultModelStats
+    stats: Mapped[List['ResultLayerStats']] = relationship(back_populates='layerxs', cascade='all, delete-orphan',
+                                                           order_by='ResultLayerStats.id')
+    modelstats: Mapped[List['ResultModelStats']] = relationship(back_populates='layerxs',
+                                                                cascade='all, delete-orphan')
 
 
 class ResultLayerYearLoss(CommonMixin, db.Model):
@@ -381,12 +469,64 @@ class ResultLayerYearLoss(CommonMixin, db.Model):
     layer: Mapped['ResultLayer'] = relationship(back_populates='yearlosses')
 
 
+class ResultLayerYearLossXS(CommonMixin, db.Model):
+    id: Mapped[int] = mapped_column(primary_key=True)
+    model_id: Mapped[int] = mapped_column()
+    model_name: Mapped[str] = mapped_column(String(50))
+    year: Mapped[int] = mapped_column()
+    type: Mapped[str] = mapped_column(String(50))  # Cat/Non cat
+    gross: Mapped[int] = mapped_column()
+    ceded: Mapped[int] = mapped_column()
+    net: Mapped[int] = mapped_column()
+
+    # Define the 1-to-many relationship between ResultLayerXS and ResultLayerYearLossXS
+    resultlayerxs_id: Mapped[int] = mapped_column(ForeignKey('resultlayerxs.id'))
+    layer: Mapped['ResultLayerXS'] = relationship(back_populates='yearlosses')
+
+
+class ResultLayerStats(CommonMixin, db.Model):
+    # Statistic of the annual ceded amounts of a stop loss or excess of loss result layer, computed when the result
+    # file is processed. See flaskapp.pricing.statistics
+    id: Mapped[int] = mapped_column(primary_key=True)
+    statistic: Mapped[str] = mapped_column(String(50))  # e.g. n_years, mean, std, q0.99, tvar0.99
+    value: Mapped[float] = mapped_column()
+    standard_error: Mapped[Optional[float]] = mapped_column()  # Simulation error, see flaskapp.pricing.convergence
+
+    # Define the 1-to-many relationships between ResultLayer, ResultLayerXS and ResultLayerStats
+    resultlayer_id: Mapped[Optional[int]] = mapped_column(ForeignKey('resultlayer.id'), index=True)
+    layer: Mapped[Optional['ResultLayer']] = relationship(back_populates='stats')
+    resultlayerxs_id: Mapped[Optional[int]] = mapped_column(ForeignKey('resultlayerxs.id'), index=True)
+    layerxs: Mapped[Optional['ResultLayerXS']] = relationship(back_populates='stats')
+
+
+class ResultModelStats(CommonMixin, db.Model):
+    # Pure premium of a model file in a stop loss or excess of loss result layer, computed when the result file is
+    # processed. See flaskapp.pricing.statistics
+    id: Mapped[int] = mapped_column(primary_key=True)
+    pure_premium: Mapped[float] = mapped_column()
+
+    resultmodelfile_id: Mapped[int] = mapped_column(ForeignKey('resultmodelfile.id'))
+    modelfile: Mapped['ResultModelFile'] = relationship()
+
+    # Define the 1-to-many relationships between ResultLayer, ResultLayerXS and ResultModelStats
+    resultlayer_id: Mapped[Optional[int]] = mapped_column(ForeignKey('resultlayer.id'), index=True)
+    layer: Mapped[Optional['ResultLayer']] = relationship(back_populates='modelstats')
+    resultlayerxs_id: Mapped[Optional[int]] = mapped_column(ForeignKey('resultlayerxs.id'), index=True)
+    layerxs: Mapped[Optional['ResultLayerXS']] = relationship(back_populates='modelstats')
+
+
 class ResultModelFile(CommonMixin, db.Model):
     id: Mapped[int] = mapped_column(primary_key=True)
     id_src: Mapped[Optional[int]] = mapped_column()
     name: Mapped[str] = mapped_column(String(50))
     type: Mapped[str] = mapped_column(String(50))  # Cat/Non cat
 
+    # Columnar storage of the YLT in a blob shared by all the files with the same content, used instead of the year
+    # loss rows for large files. See flaskapp.pricing.columnar
+    ylt_hash: Mapped[Optional[str]] = mapped_column(String(64), index=True)  # See flaskapp.pricing.fingerprint
+    yltblob_id: Mapped[Optional[int]] = mapped_column(ForeignKey('yltblob.id'))
+    yltblob: Mapped[Optional['YLTBlob']] = relationship()
+
     # Define the 1-to-many relationship between ResultFile and ResultModelFile
     resultfile_id: Mapped[int] = mapped_column(ForeignKey('resultfile.id'))
     resultfile: Mapped['ResultFile'] = relationship(back_populates='modelfiles')
@@ -412,3 +552,31 @@ result_layer_modelfile_table: Final[Table] = Table(
     Column('resultlayer_id', ForeignKey('resultlayer.id'), primary_key=True),
     Column('modelfile_id', ForeignKey('resultmodelfile.id'), primary_key=True),
 )
+
+result_layerxs_modelfile_table: Final[Table] = Table(
+    'result_layerxs_modelfile',
+    db.metadata,
+    Column('resultlayerxs_id', ForeignKey('resultlayerxs.id'), primary_key=True),
+    Column('modelfile_id', ForeignKey('resultmodelfile.id'), primary_key=True),
+)
+
+
+class Job(CommonMixin, db.Model):
+    # Pricing job consumed by the pricing workers, see flaskapp.pricing.jobs and the flask pricing-worker command
+    id: Mapped[int] = mapped_column(primary_key=True)
+    type: Mapped[str] = mapped_column(String(50))  # e.g. process_resultfile
+    name: Mapped[str] = mapped_column(String(50))  # Name of the result file to create
+    # queued/running/done/failed/cancelled
+    status: Mapped[str] = mapped_column(String(20), default='queued', index=True)
+    progress: Mapped[float] = mapped_column(default=0)
+    error: Mapped[Optional[str]] = mapped_column(Text)
+    worker: Mapped[Optional[str]] = mapped_column(String(100))
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    resultfile_id: Mapped[Optional[int]] = mapped_column()
+
+    # Define the 1-to-many relationship between Analysis and Job
+    analysis_id: Mapped[int] = mapped_column(ForeignKey('analysis.id'))
+    analysis: Mapped['Analysis'] = relationship(back_populates='jobs')
@@ -0,0 +1,108 @@
+"""
+This module defines the batch pricing of many analyses, used by the flask price command.
+
+The analyses are split into batches of batch_size. A batch is priced by one process, in one transaction committed at
+the end of the batch: committing once per batch rather than once per analysis keeps the number of round trips to the
+database low. Each analysis is priced in a savepoint, so that an analysis that fails does not cancel the others of
+its batch. If the commit of a batch fails, or its worker process dies, the analyses of the batch are reported as
+failed and the next batches go on.
+
+With several processes, each worker process creates its own application and database connections in
+init_worker_process.
+
+Functions:
+- get_analysis_ids(analysis_ids, client, quote_min, quote_max): Get the ids of the analyses to price.
+- price_batch(analysis_ids, name, reuse=True): Price a batch of analyses and commit the result files.
+- get_failed_outcome(outcome, error): Report an analysis of a batch that could not be committed as failed.
+- init_worker_process(): Initialize a worker process of the pool.
+- run_batches(analysis_ids, name, processes, batch_size, reuse=True): Price the analyses by batches, yielding the
+  outcome of each analysis as soon as its batch is committed.
+
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from flaskapp.extensions import session, select
+from flaskapp.models import *
+from flaskapp.pricing.results import process_resultfile
+import multiprocessing
+import time
+
+
+def get_analysis_ids(analysis_ids=(), client=None, quote_min=None, quote_max=None):
+    query = select(Analysis.id).order_by(Analysis.id)
+    if analysis_ids:
+        query = query.filter(Analysis.id.in_(analysis_ids))
+    if client is not None:
+        query = query.filter(Analysis.client == client)
+    if quote_min is not None:
+        query = query.filter(Analysis.quote >= quote_min)
+    if quote_max is not None:
+        query = query.filter(Analysis.quote <= quote_max)
+    return list(session.scalars(query))
+
+
+def price_batch(analysis_ids, name, reuse=True):
+    """ Price a batch of analyses in one transaction.
+
+    :return: list of dictionaries, one per analysis, with the analysis_id, the resultfile_id (None if the pricing
+        failed), the number of layers, the duration in seconds and the error message if any
+    """
+    outcomes = []
+
+    for analysis_id in analysis_ids:
+        start = time.perf_counter()
+        outcome = {'analysis_id': analysis_id, 'resultfile_id': None, 'layers': 0, 'error': None}
+
+        try:
+            with session.begin_nested():
+                analysis = session.get(Analysis, analysis_id)
+                resultfile = process_resultfile(analysis, name, reuse=reuse)
+                session.flush()
+            outcome['resultfile_id'] = resultfile.id
+            outcome['layers'] = len(resultfile.layers) + len(resultfile.xslayers)
+        except Exception as e:
+            outcome['error'] = str(e)
+
+        outcome['seconds'] = time.perf_counter() - start
+        outcomes.append(outcome)
+
+    try:
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        return [get_failed_outcome(outcome, f'The batch could not be committed: {e}') for outcome in outcomes]
+    return outcomes
+
+
+def get_failed_outcome(outcome, error):
+    # Keep the error of an analysis that failed before, the one of the batch applies to the others
+    return outcome | {'resultfile_id': None, 'layers': 0, 'error': outcome['error'] or error}
+
+
+def init_worker_process():
+    from flaskapp import create_app
+
+    # The application context stays pushed for the life of the worker process
+    app = create_app()
+    app.app_context().push()
+
+
+def run_batches(analysis_ids, name, processes, batch_size, reuse=True):
+    batches = [analysis_ids[i:i + batch_size] for i in range(0, len(analysis_ids), batch_size)]
+
+    if processes == 1:
+        for batch in batches:
+            yield from price_batch(batch, name, reuse=reuse)
+        return
+
+    # Spawn rather than fork the workers, so that they do not inherit the connections of the parent process
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=init_worker_process) as executor:
+        futures = {executor.submit(price_batch, batch, name, reuse): batch for batch in batches}
+        for future in as_completed(futures):
+            try:
+                yield from future.result()
+            except Exception as e:
+                for analysis_id in futures[future]:
+                    yield {'analysis_id': analysis_id, 'resultfile_id': None, 'layers': 0, 'seconds': 0,
+                           'error': f'The batch failed: {e}'}
@@ -0,0 +1,134 @@
+"""
+This module defines the bulk persistence path for the year loss tables (YLTs).
+
+Going through the ORM unit of work costs one object, one set of @validates calls and one flush per row.
+The functions below validate whole columns once with NumPy, then insert them with a single statement:
+- PostgreSQL with psycopg2: COPY FROM STDIN, the ids being reserved beforehand from the table sequence
+- Other engines (e.g. SQLiteConfig): a multi-row insert() executemany with RETURNING
+
+The writes use the connection of the session, so that they belong to the same transaction as the ORM objects.
+The session is not committed.
+
+Functions:
+- validate_columns(model, columns): Validate and broadcast the columns to insert.
+- bulk_insert(model, columns): Insert the columns and return the generated ids.
+
+Dependencies:
+- numpy
+- pandas
+
+"""
+
+from flaskapp.extensions import session
+from flaskapp.models import validate_not_null
+from sqlalchemy import Float, Integer, String, insert, text
+from io import StringIO
+import numpy as np
+import pandas as pd
+
+
+def validate_columns(model, columns):
+    """ Validate whole columns against the model table, instead of running @validates on each row.
+
+    :param model: mapped class, e.g. ResultLayerYearLoss
+    :param columns: dictionary {column name: array or scalar}, the scalars being repeated on every row
+    :return: dictionary {column name: NumPy array}, all of the same length
+    """
+    table = model.__table__
+    lengths = {np.size(value) for value in columns.values() if np.ndim(value) > 0}
+    if len(lengths) > 1:
+        raise ValueError(f'The columns of {table.name} must have the same length')
+    n_rows = lengths.pop() if lengths else 1
+
+    validated = {}
+    for key, value in columns.items():
+        column_type = table.c[key].type
+
+        if isinstance(column_type, String):
+            # Same rule as validate_not_null, checked once for the whole column
+            if np.ndim(value) == 0:
+                validate_not_null(key, value)
+                array = np.full(n_rows, value, dtype=object)
+            else:
+                array = np.asarray(value, dtype=object)
+                if not all(array):
+                    raise ValueError(f'The {key} must be entered')
+
+        elif isinstance(column_type, Integer):
+            array = np.broadcast_to(np.asarray(value), (n_rows,))
+            if array.dtype.kind == 'f':
+                if not np.isfinite(array).all():
+                    raise ValueError(f'The {key} must be an integer')
+                array = np.rint(array)
+            elif array.dtype.kind not in 'iub':
+                raise ValueError(f'The {key} must be an integer')
+            array = array.astype(np.int64)
+
+        elif isinstance(column_type, Float):
+            array = np.broadcast_to(np.asarray(value), (n_rows,))
+            if array.dtype.kind not in 'iuf' or not np.isfinite(array).all():
+                raise ValueError(f'The {key} must be a number')
+            array = array.astype(np.float64)
+
+        else:
+            array = np.broadcast_to(np.asarray(value), (n_rows,))
+
+        validated[key] = array
+
+    return validated
+
+
+def is_psycopg2():
+    dialect = session.get_bind().dialect
+    return dialect.name == 'postgresql' and dialect.driver == 'psycopg2'
+
+
+def bulk_insert(model, columns):
+    """ Insert rows given by columns, in the transaction of the session.
+
+    :return: NumPy array of the generated ids, in the order of the rows
+    """
+    columns = validate_columns(model, columns)
+    n_rows = len(next(iter(columns.values()))) if columns else 0
+    if n_rows == 0:
+        return np.empty(0, dtype=np.int64)
+
+    if is_psycopg2():
+        return copy_insert(model.__table__, columns, n_rows)
+    return executemany_insert(model.__table__, columns, n_rows)
+
+
+def executemany_insert(table, columns, n_rows):
+    # https://docs.sqlalchemy.org/en/20/core/connections.html#engine-insertmanyvalues
+    keys = list(columns)
+    rows = [dict(zip(keys, values)) for values in zip(*[columns[key].tolist() for key in keys])]
+
+    query = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+    ids = session.connection().execute(query, rows).scalars().all()
+    return np.asarray(ids, dtype=np.int64)
+
+
+def copy_insert(table, columns, n_rows):
+    connection = session.connection()
+
+    # Reserve the ids from the sequence of the table, so that they are known without reading the rows back
+    query = text('SELECT nextval(pg_get_serial_sequence(:table, \'id\')) FROM generate_series(1, :n)')
+    ids = np.fromiter(
+        connection.execute(query, {'table': table.name, 'n': n_rows}).scalars(),
+        dtype=np.int64, count=n_rows,
+    )
+
+    df = pd.DataFrame({'id': ids} | columns)
+    buffer = StringIO()
+    df.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+
+    # https://www.psycopg.org/docs/cursor.html#cursor.copy_expert
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY {table.name} ({", ".join(df.columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+    finally:
+        cursor.close()
+
+    return ids
+
@@ -0,0 +1,40 @@
+"""
+This module defines the disk caches of the pricing computations: the distribution fits, the comparisons of result
+files, the tail profiles and the decoded YLTs of the paged grids.
+
+Each cache is a diskcache.Cache in a directory of the configuration (see config.py), with a least recently used
+eviction above a size limit in bytes. It is stored on the local disk, so that it is shared by all the gunicorn
+workers. The keys of the cached entries include a version of their content, e.g. a hash of the losses of a loss file
+or of the saved statistics of a layer (see flaskapp.pricing.statistics), so that an object deleted and created again
+with the same id never gets the cached entries of the old one.
+
+Functions:
+- get_disk_cache(dir_key, size_key): Get a disk cache of the process.
+
+Dependencies:
+- diskcache
+
+"""
+
+from flask import current_app
+import diskcache
+
+disk_caches = {}  # One cache by directory and process, a diskcache.Cache is thread safe
+
+
+def get_disk_cache(dir_key, size_key):
+    """ Get a disk cache of the process.
+
+    :param dir_key: configuration key of the directory of the cache, e.g. 'FIT_CACHE_DIR'
+    :param size_key: configuration key of the size limit of the cache in bytes, e.g. 'FIT_CACHE_SIZE_LIMIT'
+    :return: diskcache.Cache
+    """
+    directory = current_app.config[dir_key]
+    if directory not in disk_caches:
+        # https://grantjenks.com/docs/diskcache/tutorial.html#eviction-policies
+        disk_caches[directory] = diskcache.Cache(
+            directory,
+            size_limit=current_app.config[size_key],
+            eviction_policy='least-recently-used',
+        )
+    return disk_caches[directory]
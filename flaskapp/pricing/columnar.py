@@ -0,0 +1,380 @@
+"""
+This module defines the columnar storage of the year loss tables (YLTs).
+
+The YLT of a model file (ModelFile, ResultModelFile) is packed into a compressed blob stored once per content in
+YLTBlob, keyed by its YLT hash. The model files with the same year losses, e.g. a model file and its copies in the
+result files or in the copied analyses, point to the same blob: copying them costs no year loss write. The model
+files saved before the YLTBlob table keep their rows (ModelYearLoss, ResultModelYearLoss), which are still read.
+
+The references to a blob are the foreign keys of its model files, there is no counter to keep in sync: the blobs no
+longer referenced, e.g. after deleting an analysis or a result file, are deleted by delete_unreferenced_yltblobs.
+get_or_create_yltblob locks the blob it returns (FOR KEY SHARE on PostgreSQL) until the end of the transaction, so
+that a concurrent delete_unreferenced_yltblobs cannot delete a blob about to be referenced.
+
+The blob of a cat model file priced by occurrence (see flaskapp.pricing.xs) holds its event loss table (ELT), with
+the year and the loss amount of each event, instead of annual loss ratios. The number of simulated years, including
+the years without any event, is stored in ModelFile.n_years.
+
+The YLT of a result layer is stored either:
+- as rows, one per model file and simulated year (ResultLayerYearLoss, ResultLayerYearLossXS), which is the default
+  for small files and keeps the tables easy to query in SQL
+- as columns, packed into one compressed blob in the ylt column of ResultLayer or ResultLayerXS, when the file has
+  at least COLUMNAR_YLT_MIN_YEARS rows (see config.py)
+
+The functions below hide the storage mode: the callers always get and set NumPy arrays.
+
+Functions:
+- hash_ylt(years, loss_ratios): Hash the content of a YLT, see flaskapp.pricing.fingerprint.
+- hash_elt(years, losses): Hash the content of an ELT.
+- pack_ylt(**arrays): Pack named arrays into a compressed blob.
+- unpack_ylt(blob): Unpack a blob into a dictionary of named arrays.
+- use_columnar(n_rows): Tell if a YLT of n_rows rows should be stored as columns.
+- get_or_create_yltblob(ylt_hash, **arrays): Get the shared blob of a YLT, creating it from the arrays if needed.
+- delete_unreferenced_yltblobs(): Delete the blobs referenced by no model file.
+- get_yltblob_ylt(yltblob_id): Get the years and loss ratios stored in a blob.
+- get_modelfile_ylt(modelfile): Get the years and loss ratios of a model file.
+- set_modelfile_ylt(modelfile, years, loss_ratios): Save the years and loss ratios of a model file.
+- get_modelfile_elt(modelfile): Get the event years and losses of a model file.
+- set_modelfile_elt(modelfile, years, losses, n_years): Save the event years and losses of a model file simulated
+  over n_years years.
+- get_resultmodelfile_ylt(resultmodelfile): Get the years and loss ratios of a result model file.
+- set_resultmodelfile_ylt(resultmodelfile, years, loss_ratios): Save the YLT of a result model file.
+- copy_resultmodelfile_ylt(source, target): Copy the YLT of a result model file without loading it in Python.
+- get_resultlayer_ylt(resultlayer): Get the model ids, years, gross, ceded and net amounts of a result layer.
+  The functions on the result layers accept a ResultLayer or a ResultLayerXS.
+- set_resultlayer_ylt(resultlayer, resultmodelfiles, model_index, years, gross, ceded, net): Save the YLT of a
+  result layer.
+- copy_resultlayer_ylt(source, target, resultmodelfile_map): Copy the YLT of a result layer to another result
+  layer, replacing its result model files.
+- iter_resultlayer_ylt(resultlayer, batch_rows): Iterate over the YLT of a result layer by batches of rows, e.g. to
+  stream it.
+
+Dependencies:
+- numpy
+
+"""
+
+from flask import current_app
+from flaskapp.extensions import session, select
+from flaskapp.models import *
+from flaskapp.pricing.bulk import bulk_insert
+from sqlalchemy import case, delete, exists, insert, literal
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from io import BytesIO
+import hashlib
+import numpy as np
+
+RESULTLAYER_COLUMNS = ['model_id', 'year', 'gross', 'ceded', 'net']
+
+# Types of the arrays read from the year loss rows, as in the packed YLTs, also when the query returns no row
+COLUMN_DTYPES = {
+    'model_id': np.int64,
+    'year': np.int64,
+    'loss_ratio': np.float64,
+    'gross': np.int64,
+    'ceded': np.int64,
+    'net': np.int64,
+}
+
+
+def hash_ylt(years, loss_ratios):
+    # Sort by year and fix the byte order so that the hash only depends on the content
+    years = np.asarray(years, dtype='<i8')
+    order = np.argsort(years, kind='stable')
+
+    sha = hashlib.sha256()
+    sha.update(years[order].tobytes())
+    sha.update(np.asarray(loss_ratios, dtype='<f8')[order].tobytes())
+    return sha.hexdigest()
+
+
+def hash_elt(years, losses):
+    # The prefix keeps the hash of an ELT distinct from the hash of a YLT with the same numbers
+    sha = hashlib.sha256(b'elt')
+    sha.update(hash_ylt(years, losses).encode())
+    return sha.hexdigest()
+
+
+def pack_ylt(**arrays):
+    # https://numpy.org/doc/stable/reference/generated/numpy.savez_compressed.html
+    buffer = BytesIO()
+    np.savez_compressed(buffer, **{key: np.asarray(value) for key, value in arrays.items()})
+    return buffer.getvalue()
+
+
+def unpack_ylt(blob):
+    with np.load(BytesIO(blob), allow_pickle=False) as npz:
+        return {key: npz[key] for key in npz.files}
+
+
+def use_columnar(n_rows):
+    min_years = current_app.config.get('COLUMNAR_YLT_MIN_YEARS')
+    return min_years is not None and n_rows >= min_years
+
+
+def get_or_create_yltblob(ylt_hash, **arrays):
+    # https://www.postgresql.org/docs/current/explicit-locking.html#LOCKING-ROWS
+    # SQLite ignores FOR KEY SHARE: its transactions are serialized anyway
+    query = select(YLTBlob).filter_by(ylt_hash=ylt_hash).with_for_update(read=True, key_share=True)
+    yltblob = session.scalars(query).first()
+    if yltblob is not None:
+        return yltblob
+
+    # Another transaction may create the same blob concurrently: the unique constraint on the hash decides, with
+    # ON CONFLICT DO NOTHING rather than a savepoint
+    # https://docs.sqlalchemy.org/en/20/dialects/postgresql.html#insert-on-conflict-upsert
+    dialect_insert = postgresql.insert if session.get_bind().dialect.name == 'postgresql' else sqlite.insert
+    session.execute(
+        dialect_insert(YLTBlob)
+        .values(ylt_hash=ylt_hash, data=pack_ylt(**arrays))
+        .on_conflict_do_nothing(index_elements=['ylt_hash'])
+    )
+    return session.scalars(query).one()
+
+
+def delete_unreferenced_yltblobs():
+    """ Delete the blobs referenced by no model file or result model file, and commit.
+
+    :return: number of deleted blobs
+    """
+    query = delete(YLTBlob).where(
+        ~exists().where(ModelFile.yltblob_id == YLTBlob.id),
+        ~exists().where(ResultModelFile.yltblob_id == YLTBlob.id),
+    )
+    try:
+        deleted = session.execute(query, execution_options={'synchronize_session': False}).rowcount
+        session.commit()
+    except IntegrityError:
+        # A blob was referenced by a concurrent transaction meanwhile: the foreign keys keep it, retry later
+        session.rollback()
+        return 0
+    return deleted
+
+
+def get_yltblob_ylt(yltblob_id):
+    # Load the data of the blob only, without the other deferred columns
+    ylt = unpack_ylt(session.scalar(select(YLTBlob.data).filter_by(id=yltblob_id)))
+    if 'loss_ratio' not in ylt:
+        raise ValueError('The model file holds an event loss table, it can only be used by excess of loss layers')
+    return ylt['year'], ylt['loss_ratio']
+
+
+def get_modelfile_ylt(modelfile):
+    if modelfile.yltblob_id is not None:
+        return get_yltblob_ylt(modelfile.yltblob_id)
+
+    # Select only the two needed columns to avoid instantiating one ORM object per year
+    query = select(ModelYearLoss.year, ModelYearLoss.loss_ratio) \
+        .filter_by(modelfile_id=modelfile.id) \
+        .order_by(ModelYearLoss.year)
+    return get_arrays(query, ['year', 'loss_ratio'])
+
+
+def set_modelfile_ylt(modelfile, years, loss_ratios):
+    modelfile.ylt_hash = hash_ylt(years, loss_ratios)
+    modelfile.yltblob_id = get_or_create_yltblob(
+        modelfile.ylt_hash,
+        year=np.asarray(years, dtype=np.int64),
+        loss_ratio=np.asarray(loss_ratios, dtype=np.float64),
+    ).id
+
+
+def get_modelfile_elt(modelfile):
+    if modelfile.yltblob_id is None:
+        raise ValueError(f'The model file {modelfile.name} has no event loss table')
+    elt = unpack_ylt(session.scalar(select(YLTBlob.data).filter_by(id=modelfile.yltblob_id)))
+    if 'loss' not in elt:
+        raise ValueError(f'The model file {modelfile.name} holds a year loss table, not an event loss table')
+    if modelfile.n_years is None:
+        raise ValueError(f'The number of simulated years of the model file {modelfile.name} is unknown')
+    return elt['year'], elt['loss']
+
+
+def set_modelfile_elt(modelfile, years, losses, n_years):
+    """ Save the ELT of a model file, rejecting the values that the casts to integers would silently change.
+
+    :param years: array of the event years, integers between 1 and n_years
+    :param losses: array of the event losses, finite and non negative
+    """
+    is_number = isinstance(n_years, (int, np.integer, float)) and not isinstance(n_years, bool)
+    if not is_number or not float(n_years).is_integer() or n_years < 1:
+        raise ValueError('The number of simulated years must be a positive integer')
+    n_years = int(n_years)
+
+    years = np.asarray(years, dtype=np.float64)
+    losses = np.asarray(losses, dtype=np.float64)
+    if len(years) != len(losses):
+        raise ValueError('The event years and losses must have the same length')
+    if not np.all(np.isfinite(years)) or np.any(years != np.round(years)):
+        raise ValueError('The event years must be integers')
+    if not np.all(np.isfinite(losses)) or np.any(losses < 0):
+        raise ValueError('The event losses must be non negative numbers, without empty cells')
+    years = years.astype(np.int64)
+    if len(years) and (years.min() < 1 or years.max() > n_years):
+        raise ValueError(f'The event years must be between 1 and the number of simulated years, {n_years}')
+
+    # The events are stored sorted by year, the order expected by flaskapp.pricing.xs
+    order = np.argsort(years, kind='stable')
+    years = years[order]
+    losses = losses[order]
+
+    modelfile.n_years = n_years
+    modelfile.ylt_hash = hash_elt(years, losses)
+    modelfile.yltblob_id = get_or_create_yltblob(modelfile.ylt_hash, year=years, loss=losses).id
+
+
+def get_resultmodelfile_ylt(resultmodelfile):
+    if resultmodelfile.yltblob_id is not None:
+        return get_yltblob_ylt(resultmodelfile.yltblob_id)
+
+    query = select(ResultModelYearLoss.year, ResultModelYearLoss.loss_ratio) \
+        .filter_by(resultmodelfile_id=resultmodelfile.id) \
+        .order_by(ResultModelYearLoss.year)
+    return get_arrays(query, ['year', 'loss_ratio'])
+
+
+def set_resultmodelfile_ylt(resultmodelfile, years, loss_ratios):
+    resultmodelfile.ylt_hash = hash_ylt(years, loss_ratios)
+    resultmodelfile.yltblob_id = get_or_create_yltblob(
+        resultmodelfile.ylt_hash,
+        year=np.asarray(years, dtype=np.int64),
+        loss_ratio=np.asarray(loss_ratios, dtype=np.float64),
+    ).id
+
+
+def copy_resultmodelfile_ylt(source, target):
+    target.ylt_hash = source.ylt_hash
+
+    if source.yltblob_id is not None:
+        target.yltblob_id = source.yltblob_id  # The blob is shared, not copied
+    else:
+        # INSERT ... SELECT: the rows are copied by the database
+        session.flush()
+        query = select(
+            ResultModelYearLoss.year, ResultModelYearLoss.loss_ratio, literal(target.id)
+        ).filter_by(resultmodelfile_id=source.id)
+        session.execute(
+            insert(ResultModelYearLoss).from_select(['year', 'loss_ratio', 'resultmodelfile_id'], query)
+        )
+
+
+def get_yearloss_model(resultlayer):
+    # The year losses of the stop loss and excess of loss result layers have the same columns
+    if isinstance(resultlayer, ResultLayerXS):
+        return ResultLayerYearLossXS, 'resultlayerxs_id'
+    return ResultLayerYearLoss, 'resultlayer_id'
+
+
+def get_resultlayer_ylt(resultlayer):
+    if resultlayer.ylt is not None:
+        return unpack_ylt(resultlayer.ylt)
+
+    yearloss_model, foreign_key = get_yearloss_model(resultlayer)
+    query = select(*[getattr(yearloss_model, column) for column in RESULTLAYER_COLUMNS]) \
+        .filter_by(**{foreign_key: resultlayer.id}) \
+        .order_by(yearloss_model.model_id, yearloss_model.year)
+    return dict(zip(RESULTLAYER_COLUMNS, get_arrays(query, RESULTLAYER_COLUMNS)))
+
+
+def set_resultlayer_ylt(resultlayer, resultmodelfiles, model_index, years, gross, ceded, net):
+    """ Save the YLT of a result layer, given by model file and year.
+
+    :param resultmodelfiles: list of ResultModelFile, with their ids already flushed
+    :param model_index: array giving for each row the position of its model file in resultmodelfiles
+    """
+    model_index = np.asarray(model_index, dtype=np.int64)
+    model_ids = np.array([resultmodelfile.id for resultmodelfile in resultmodelfiles], dtype=np.int64)[model_index]
+
+    if use_columnar(len(years)):
+        resultlayer.ylt = pack_ylt(
+            model_id=model_ids,
+            year=np.asarray(years, dtype=np.int64),
+            gross=np.asarray(gross, dtype=np.int64),
+            ceded=np.asarray(ceded, dtype=np.int64),
+            net=np.asarray(net, dtype=np.int64),
+        )
+    else:
+        names = np.array([resultmodelfile.name for resultmodelfile in resultmodelfiles], dtype=object)
+        types = np.array([resultmodelfile.type for resultmodelfile in resultmodelfiles], dtype=object)
+        yearloss_model, foreign_key = get_yearloss_model(resultlayer)
+        session.flush()
+        bulk_insert(yearloss_model, {
+            'model_id': model_ids,
+            'model_name': names[model_index],
+            'year': years,
+            'type': types[model_index],
+            'gross': gross,
+            'ceded': ceded,
+            'net': net,
+            foreign_key: resultlayer.id,
+        })
+
+
+def copy_resultlayer_ylt(source, target, resultmodelfile_map):
+    """ Copy the YLT of a result layer, e.g. from a previous result file.
+
+    :param resultmodelfile_map: dictionary {source ResultModelFile id: target ResultModelFile}, the target result
+        model files having their ids already flushed
+    """
+    if source.ylt is not None:
+        ylt = unpack_ylt(source.ylt)
+        source_ids = np.array(list(resultmodelfile_map), dtype=np.int64)
+        target_ids = np.array([resultmodelfile.id for resultmodelfile in resultmodelfile_map.values()], dtype=np.int64)
+        order = np.argsort(source_ids)
+        ylt['model_id'] = target_ids[order][np.searchsorted(source_ids[order], ylt['model_id'])]
+        target.ylt = pack_ylt(**ylt)
+    else:
+        # INSERT ... SELECT, replacing the model file columns with CASE expressions
+        yearloss_model, foreign_key = get_yearloss_model(source)
+        session.flush()
+        model_id = yearloss_model.model_id
+        query = select(
+            case({key: value.id for key, value in resultmodelfile_map.items()}, value=model_id),
+            case({key: value.name for key, value in resultmodelfile_map.items()}, value=model_id),
+            yearloss_model.year,
+            case({key: value.type for key, value in resultmodelfile_map.items()}, value=model_id),
+            yearloss_model.gross,
+            yearloss_model.ceded,
+            yearloss_model.net,
+            literal(target.id),
+        ).filter_by(**{foreign_key: source.id})
+        columns = ['model_id', 'model_name', 'year', 'type', 'gross', 'ceded', 'net', foreign_key]
+        session.execute(insert(yearloss_model).from_select(columns, query))
+
+
+def iter_resultlayer_ylt(resultlayer, batch_rows):
+    """ Iterate over the YLT of a result layer by batches of at most batch_rows rows, ordered by model file and year.
+
+    The rows are fetched batch by batch with a server-side cursor (yield_per), so that the memory does not depend on
+    the size of the YLT. A YLT stored as columns is unpacked at once, then sliced.
+
+    :return: generator of dictionaries of arrays, keyed by RESULTLAYER_COLUMNS
+    """
+    # Load the blob only, without the other columns of the result layer
+    ylt = session.scalar(select(type(resultlayer).ylt).filter_by(id=resultlayer.id))
+    if ylt is not None:
+        arrays = unpack_ylt(ylt)
+        for start in range(0, len(arrays['year']), batch_rows):
+            yield {column: arrays[column][start:start + batch_rows] for column in RESULTLAYER_COLUMNS}
+        return
+
+    # https://docs.sqlalchemy.org/en/20/orm/queryguide/api.html#fetching-large-result-sets-with-yield-per
+    yearloss_model, foreign_key = get_yearloss_model(resultlayer)
+    query = select(*[getattr(yearloss_model, column) for column in RESULTLAYER_COLUMNS]) \
+        .filter_by(**{foreign_key: resultlayer.id}) \
+        .order_by(yearloss_model.model_id, yearloss_model.year) \
+        .execution_options(yield_per=batch_rows)
+    for rows in session.execute(query).partitions():
+        yield {
+            column: np.fromiter((row[k] for row in rows), dtype=COLUMN_DTYPES[column], count=len(rows))
+            for k, column in enumerate(RESULTLAYER_COLUMNS)
+        }
+
+
+def get_arrays(query, columns):
+    rows = session.execute(query).all()
+    return tuple(
+        np.fromiter((getattr(row, column) for row in rows), dtype=COLUMN_DTYPES[column], count=len(rows))
+        for column in columns
+    )
@@ -0,0 +1,148 @@
+"""
+This module defines the comparison of the result files of an analysis, layer by layer.
+
+Functions:
+- get_resultfile_version(resultfile): Get the version of a result file for the cache keys.
+- get_resultfile_annual_ceded(resultfile): Get the annual ceded amounts of the layers of a result file, from the
+  cache if possible.
+- compare_annual_ceded(base, other, quantiles): Compare aligned annual ceded amounts of several layers.
+- compare_resultfiles(base_annual, other_annual, quantiles): Compare the layers of two result files.
+- get_comparison(base, other, quantiles): Compare two result files, from the cache if possible.
+
+Dependencies:
+- numpy
+
+"""
+
+from flaskapp.pricing.caching import get_disk_cache
+from flaskapp.pricing.convergence import get_annual_ceded, get_statistics
+from flaskapp.pricing.statistics import get_resultlayer_version
+import hashlib
+import numpy as np
+
+COMPARISON_CACHE_VERSION = 1  # Increment when the content of the cached comparisons changes
+
+
+def get_resultfile_version(resultfile):
+    # Hash of the versions of the layers, see flaskapp.pricing.statistics.get_resultlayer_version
+    sha = hashlib.sha256()
+    for layer in sorted(resultfile.layers + resultfile.xslayers, key=lambda layer: (type(layer).__name__, layer.id)):
+        sha.update(get_resultlayer_version(layer).encode())
+    return sha.hexdigest()
+
+
+def get_resultfile_annual_ceded(resultfile, version=None):
+    """ Get the annual ceded amounts of the layers of a result file.
+
+    :return: dictionary {layer name: (years, annual ceded amounts)}
+    """
+    cache = get_disk_cache('COMPARISON_CACHE_DIR', 'COMPARISON_CACHE_SIZE_LIMIT')
+    key = ('annual', COMPARISON_CACHE_VERSION, resultfile.id, version or get_resultfile_version(resultfile))
+    annual_ceded = cache.get(key)
+    if annual_ceded is None:
+        annual_ceded = {layer.name: get_annual_ceded(layer) for layer in resultfile.layers + resultfile.xslayers}
+        cache.set(key, annual_ceded)
+    return annual_ceded
+
+
+def compare_annual_ceded(base, other, quantiles):
+    """ Compare the annual ceded amounts of several layers in two result files, aligned on their years.
+
+    :param base: array of shape (n_layers, n_years), annual ceded amounts of the base result file
+    :param other: array of shape (n_layers, n_years), annual ceded amounts of the other result file
+    :return: dictionary of arrays of shape (n_statistics, n_layers) for the statistics of the 'base' and 'other'
+    files, their 'delta' and 'relative_delta', and the statistics of the paired 'difference' other - base, and of
+    shape (n_layers,) for the standard errors of the mean difference, 'paired' and 'unpaired' (independent files),
+    the 'correlation' of the files and the 'share_changed' of the years with a difference
+    """
+    base = np.asarray(base, dtype=np.float64)
+    other = np.asarray(other, dtype=np.float64)
+    n_years = base.shape[1]
+
+    base_statistics = get_statistics(base, quantiles)
+    other_statistics = get_statistics(other, quantiles)
+    difference = other - base
+    difference_statistics = get_statistics(difference, quantiles)
+    delta = other_statistics - base_statistics
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative_delta = np.where(base_statistics != 0, delta / np.abs(base_statistics), np.nan)
+        covariance = np.sum((base - base_statistics[0][:, np.newaxis]) * (other - other_statistics[0][:, np.newaxis]),
+                            axis=1) / (n_years - 1)
+        correlation = covariance / (base_statistics[1] * other_statistics[1])
+
+    return {
+        'base': base_statistics,
+        'other': other_statistics,
+        'delta': delta,
+        'relative_delta': relative_delta,
+        'difference': difference_statistics,
+        'paired_standard_error': difference_statistics[1] / np.sqrt(n_years),
+        'unpaired_standard_error': np.sqrt((base_statistics[1] ** 2 + other_statistics[1] ** 2) / n_years),
+        'correlation': correlation,
+        'share_changed': np.mean(difference != 0, axis=1),
+    }
+
+
+def compare_resultfiles(base_annual, other_annual, quantiles):
+    """ Compare the layers with the same name in two result files.
+
+    :param base_annual: dictionary of get_resultfile_annual_ceded for the base result file
+    :param other_annual: dictionary of get_resultfile_annual_ceded for the other result file
+    :return: list of dictionaries by common layer, with its 'name', the number of common years 'n_years', 'paired'
+    True if the two files have the same years, the 'statistics' names and the values of compare_annual_ceded as lists
+    """
+    names = [name for name in base_annual if name in other_annual]
+    aligned = {}
+    for name in names:
+        (base_years, base_values), (other_years, other_values) = base_annual[name], other_annual[name]
+        years, base_index, other_index = np.intersect1d(base_years, other_years, assume_unique=True,
+                                                        return_indices=True)
+        paired = len(years) == len(base_years) == len(other_years)
+        aligned[name] = (base_values[base_index], other_values[other_index], paired)
+
+    comparison = {name: {'name': name, 'n_years': len(aligned[name][0]), 'paired': aligned[name][2]}
+                  for name in names}
+    statistics = ['mean', 'std'] + [f'q{quantile}' for quantile in quantiles]
+
+    # One pass by number of common years, usually the same for all the layers
+    for n_years in set(len(base_values) for base_values, _, _ in aligned.values()):
+        group = [name for name in names if len(aligned[name][0]) == n_years]
+        if n_years < 2:
+            for name in group:
+                comparison[name]['error'] = 'The result files have less than 2 common simulated years'
+            continue
+        result = compare_annual_ceded(
+            np.vstack([aligned[name][0] for name in group]),
+            np.vstack([aligned[name][1] for name in group]),
+            quantiles,
+        )
+        for column, name in enumerate(group):
+            comparison[name]['statistics'] = statistics
+            for key, values in result.items():
+                comparison[name][key] = values[..., column].tolist()
+
+    return [comparison[name] for name in names]
+
+
+def get_comparison(base, other, quantiles):
+    """ Compare a result file with a base result file, see compare_resultfiles.
+
+    :return: dictionary with the 'layers' of compare_resultfiles and 'cached', True if the comparison comes from the
+    cache
+    """
+    cache = get_disk_cache('COMPARISON_CACHE_DIR', 'COMPARISON_CACHE_SIZE_LIMIT')
+    base_version = get_resultfile_version(base)
+    other_version = get_resultfile_version(other)
+    key = ('comparison', COMPARISON_CACHE_VERSION, base.id, base_version, other.id, other_version, tuple(quantiles))
+    layers = cache.get(key)
+    if layers is not None:
+        return {'layers': layers, 'cached': True}
+
+    layers = compare_resultfiles(
+        get_resultfile_annual_ceded(base, base_version),
+        get_resultfile_annual_ceded(other, other_version),
+        quantiles,
+    )
+    cache.set(key, layers)
+    return {'layers': layers, 'cached': False}
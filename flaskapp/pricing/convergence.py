@@ -0,0 +1,145 @@
+"""
+This module defines the simulation error diagnostics of the results, estimated by batch means.
+
+Functions:
+- get_annual_ceded(resultlayer): Get the ceded amounts of a result layer by simulated year.
+- get_statistics(values, quantiles): Compute the mean, standard deviation and quantiles of YLTs.
+- get_batch_quantiles(batch_size, quantiles): Tell which quantiles can be estimated on batches of batch_size years.
+- has_independent_years(resultlayer): Tell if the simulated years of a result layer are independent.
+- get_standard_errors(values, quantiles, n_batches, confidence): Compute the statistics of YLTs with their standard
+  errors and confidence intervals.
+- get_years_needed(estimate, standard_error, n_years, precision, confidence): Estimate the number of years needed
+  for a relative precision.
+- get_resultlayers_convergence(resultlayers, quantiles, n_batches, confidence): Compute the simulation error
+  diagnostics of result layers.
+
+Dependencies:
+- numpy
+- scipy
+
+"""
+
+from flaskapp.extensions import session, select
+from flaskapp.models import *
+from flaskapp.pricing.columnar import get_resultlayer_ylt
+from scipy import stats
+import numpy as np
+
+N_BATCHES = 20
+CONFIDENCE = 0.95
+MIN_BATCH_YEARS = 10
+STRATIFIED_SAMPLING = ['lhs', 'sobol']  # Sampling methods whose years are not independent
+INDEPENDENCE_ERROR = 'The simulation error needs independent years, not a Latin hypercube or Sobol sample'
+
+
+def get_annual_ceded(resultlayer):
+    # Sum the ceded amounts of the model files of the layer by year
+    ylt = get_resultlayer_ylt(resultlayer)
+    years, inverse = np.unique(ylt['year'], return_inverse=True)
+    return years, np.bincount(inverse, weights=ylt['ceded'], minlength=len(years))
+
+
+def get_statistics(values, quantiles):
+    """ Compute the statistics of YLTs along their last axis.
+
+    :param values: array of shape (..., n_years)
+    :return: array of shape (2 + n_quantiles, ...) with the mean, the standard deviation and the quantiles
+    """
+    return np.concatenate([
+        values.mean(axis=-1)[np.newaxis],
+        values.std(axis=-1, ddof=1)[np.newaxis],  # As pandas, used by get_df_oep_summary
+        np.quantile(values, quantiles, axis=-1),
+    ])
+
+
+def get_batch_quantiles(batch_size, quantiles):
+    # At least one year above the quantile in each batch, rounded as flaskapp.pricing.statistics.get_tail_counts
+    return np.round(batch_size * (1 - np.asarray(quantiles, dtype=np.float64)), 9) >= 1
+
+
+def has_independent_years(resultlayer):
+    # The sampling method is the one of the model files the result model files were copied from
+    ids = [resultmodelfile.id_src for resultmodelfile in resultlayer.modelfiles]
+    samplings = session.scalars(select(ModelFile.sampling).where(ModelFile.id.in_(ids)))
+    return not any(sampling in STRATIFIED_SAMPLING for sampling in samplings)
+
+
+def get_standard_errors(values, quantiles, n_batches=N_BATCHES, confidence=CONFIDENCE):
+    """ Compute the statistics of several YLTs with the same number of years, with their simulation errors.
+
+    :param values: array of shape (n_ylts, n_years) of annual amounts
+    :param quantiles: list of the quantiles, usually flaskapp.pricing.statistics.get_quantiles
+    :return: dictionary with the 'statistics' names and the 'estimate', 'standard_error', 'lower' and 'upper' bounds
+    of the confidence interval, arrays of shape (n_statistics, n_ylts), NaN for the quantiles rejected by
+    get_batch_quantiles
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n_ylts, n_years = values.shape
+    batch_size = n_years // n_batches
+    if batch_size < MIN_BATCH_YEARS:
+        raise ValueError(f'The simulation error needs at least {n_batches * MIN_BATCH_YEARS} simulated years')
+
+    # Year k goes to the batch k modulo n_batches, so that the model files simulated on fewer years weigh the same in
+    # every batch. The last years, fewer than n_batches, are only used by the estimates
+    batches = values[:, :n_batches * batch_size].reshape(n_ylts, batch_size, n_batches).swapaxes(1, 2)
+    batch_statistics = get_statistics(batches, quantiles)  # (n_statistics, n_ylts, n_batches)
+
+    estimate = get_statistics(values, quantiles)
+    standard_error = batch_statistics.std(axis=-1, ddof=1) / np.sqrt(n_batches)
+    standard_error[2:][~get_batch_quantiles(batch_size, quantiles)] = np.nan
+    half_width = stats.t.ppf((1 + confidence) / 2, n_batches - 1) * standard_error
+
+    return {
+        'statistics': ['mean', 'std'] + [f'q{quantile}' for quantile in quantiles],
+        'estimate': estimate,
+        'standard_error': standard_error,
+        'lower': estimate - half_width,
+        'upper': estimate + half_width,
+    }
+
+
+def get_years_needed(estimate, standard_error, n_years, precision=0.01, confidence=CONFIDENCE):
+    """ Estimate the number of years for the half width of the confidence interval to be precision times the estimate.
+
+    :return: array of the numbers of years, infinite for the statistics equal to 0
+    """
+    z = stats.norm.ppf((1 + confidence) / 2)
+    target = precision * np.abs(np.asarray(estimate, dtype=np.float64))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        years_needed = np.ceil(n_years * (z * np.asarray(standard_error) / target) ** 2)
+    return np.where(target > 0, years_needed, np.inf)
+
+
+def get_resultlayers_convergence(resultlayers, quantiles, n_batches=N_BATCHES, confidence=CONFIDENCE):
+    """ Compute the simulation error diagnostics of the ceded amounts of result layers.
+
+    :param resultlayers: list of ResultLayer or ResultLayerXS
+    :return: list of dictionaries by result layer, with its 'name', 'n_years' and the arrays of get_standard_errors
+    by statistic with a standard error, or the 'error' if the layer has too few or no independent years
+    """
+    annual_ceded = [get_annual_ceded(resultlayer)[1] for resultlayer in resultlayers]
+    convergence = [{'name': resultlayer.name, 'n_years': len(values)} for resultlayer, values
+                   in zip(resultlayers, annual_ceded)]
+    independent = [has_independent_years(resultlayer) for resultlayer in resultlayers]
+    for k in np.flatnonzero(~np.array(independent, dtype=bool)):
+        convergence[k]['error'] = INDEPENDENCE_ERROR
+
+    # One pass by number of years, usually the same for all the layers of a result file
+    for n_years in set(len(values) for values in annual_ceded):
+        positions = [k for k, values in enumerate(annual_ceded) if len(values) == n_years and independent[k]]
+        if not positions:
+            continue
+        try:
+            errors = get_standard_errors(np.vstack([annual_ceded[k] for k in positions]), quantiles, n_batches,
+                                         confidence)
+        except ValueError as e:
+            for k in positions:
+                convergence[k]['error'] = str(e)
+            continue
+        rows = np.flatnonzero(np.isfinite(errors['standard_error'][:, 0]))  # Same batch size for all the layers
+        for column, k in enumerate(positions):
+            convergence[k]['statistics'] = [errors['statistics'][row] for row in rows]
+            for key in ['estimate', 'standard_error', 'lower', 'upper']:
+                convergence[k][key] = errors[key][rows, column]
+
+    return convergence
@@ -0,0 +1,201 @@
+"""
+This module defines the correlated simulation of the model files of an analysis with a copula.
+
+The model files of an analysis are simulated independently (see flaskapp.pricing.simulation), so that the sum of their
+loss ratios by year, priced by flaskapp.pricing.stoploss, understates the tail of the combined book. The correlated
+simulation keeps the distribution of each model file, its marginal, and only changes the way the years of the model
+files are paired:
+1. The uniform random numbers of all the model files are drawn at once, as a (years, models) matrix, with a Gaussian
+   copula (correlated normal variables, with the Cholesky factor of the correlation matrix) or a Student t copula
+   (the same normal variables divided by a common chi-square variable, which adds tail dependence).
+2. Each column is converted into loss ratios with the empirical inverse cumulative distribution function of the YLT of
+   its model file.
+
+The uniform random numbers of step 1 are drawn with plain Monte Carlo, Latin hypercube or Sobol sampling (see
+flaskapp.pricing.sampling), with one dimension by model file and one more for the chi-square variable of the t copula.
+
+The years are simulated by chunks, each with its own random stream derived from the seed (see flaskapp.pricing.rng).
+The size of the chunks is set by memory_budget, the memory of the working arrays of a chunk, so that 1M years of 20
+model files are simulated without holding the intermediate normal and uniform matrices of all the years. The loss
+ratios of each chunk are written to a temporary memory-mapped file, from which the YLTs of the model files are then
+saved one at a time: only one YLT is held in memory, not the (model files, years) matrix of the simulation.
+
+Functions:
+- get_cholesky(correlation): Check a correlation matrix and get its Cholesky factor.
+- get_chunk_size(n_models, memory_budget): Get the number of years simulated at once.
+- draw_uniforms(generator, cholesky, size, copula, df, seed, start, method): Draw correlated uniform random numbers.
+- get_marginal(modelfile): Get the sorted loss ratios of the YLT of a model file.
+- simulate_copula_chunks(marginals, correlation, n_years, seed, copula, df, memory_budget, method): Generate the
+  simulated years and correlated loss ratios by chunks.
+- get_copula_variance_reduction(marginals, correlation, n_years, seed, copula, df, method): Estimate the variance
+  reduction of a sampling method on the sum of the model files.
+- simulate_correlated_modelfiles(analysis, modelfiles, correlation, n_years, seed, copula, df, memory_budget,
+  method): Simulate and save correlated copies of the model files of an analysis.
+
+Dependencies:
+- numpy
+- scipy
+
+"""
+
+from flaskapp.extensions import session
+from flaskapp.models import *
+from flaskapp.pricing.columnar import get_modelfile_ylt, set_modelfile_ylt
+from flaskapp.pricing.rng import get_chunk_generators
+from flaskapp.pricing.sampling import get_uniforms, estimate_variance_reduction, REDUCTION_YEARS
+from scipy import special
+import numpy as np
+import tempfile
+
+COPULAS = ['Gaussian', 't']
+COPULA_MEMORY_BUDGET = 64_000_000  # Bytes of the working arrays of a chunk
+WORKING_ARRAYS = 4  # Normal, uniform, index and loss ratio matrices of a chunk
+
+
+def get_cholesky(correlation):
+    correlation = np.asarray(correlation, dtype=np.float64)
+    if correlation.ndim != 2 or correlation.shape[0] != correlation.shape[1]:
+        raise ValueError('The correlation matrix must be square')
+    if not np.allclose(np.diag(correlation), 1):
+        raise ValueError('The diagonal of the correlation matrix must be 1')
+    if not np.allclose(correlation, correlation.T):
+        raise ValueError('The correlation matrix must be symmetric')
+    if np.any(np.abs(correlation) > 1):
+        raise ValueError('The correlations must be between -1 and 1')
+
+    # https://numpy.org/doc/stable/reference/generated/numpy.linalg.cholesky.html
+    try:
+        return np.linalg.cholesky(correlation)
+    except np.linalg.LinAlgError:
+        raise ValueError('The correlation matrix must be positive definite')
+
+
+def get_chunk_size(n_models, memory_budget=COPULA_MEMORY_BUDGET):
+    return max(1, memory_budget // (WORKING_ARRAYS * 8 * n_models))
+
+
+def draw_uniforms(generator, cholesky, size, copula='Gaussian', df=4, seed=None, start=0, method='random'):
+    """ Draw correlated uniform random numbers with a copula.
+
+    :param cholesky: lower triangular Cholesky factor of the correlation matrix, see get_cholesky
+    :param df: degrees of freedom of the t copula
+    :param seed, start, method: seed of the simulation, first year of the chunk and sampling method of the independent
+    uniform random numbers, see flaskapp.pricing.sampling.get_uniforms
+    :return: array of shape (size, n_models) of uniform random numbers in [0, 1]
+    """
+    if copula not in COPULAS:
+        raise ValueError(f'The copula must be one of {", ".join(COPULAS)}')
+    n_models = cholesky.shape[0]
+
+    if method == 'random':
+        normals = generator.standard_normal((size, n_models))
+        chisquares = generator.chisquare(df, size) if copula == 't' else None
+    else:
+        # Inverse transforms of the stratified or quasi-random uniform random numbers, kept away from 0 and 1
+        # https://docs.scipy.org/doc/scipy/reference/generated/scipy.special.ndtri.html
+        uniforms = get_uniforms(seed, generator, start, size, n_models + (copula == 't'), method)
+        uniforms = np.clip(uniforms, 1e-16, 1 - 1e-16)
+        normals = special.ndtri(uniforms[:, :n_models])
+        chisquares = special.chdtri(df, 1 - uniforms[:, n_models]) if copula == 't' else None
+
+    normals = normals @ cholesky.T
+    if copula == 'Gaussian':
+        # https://docs.scipy.org/doc/scipy/reference/generated/scipy.special.ndtr.html
+        return special.ndtr(normals)
+    # https://docs.scipy.org/doc/scipy/reference/generated/scipy.special.stdtr.html
+    normals /= np.sqrt(chisquares / df)[:, np.newaxis]
+    return special.stdtr(df, normals)
+
+
+def get_marginal(modelfile):
+    years, loss_ratios = get_modelfile_ylt(modelfile)
+    if len(loss_ratios) == 0:
+        raise ValueError(f'The model file {modelfile.name} has no year loss')
+    return np.sort(loss_ratios)
+
+
+def simulate_copula_chunks(marginals, correlation, n_years, seed, copula='Gaussian', df=4,
+                           memory_budget=COPULA_MEMORY_BUDGET, method='random'):
+    """ Simulate correlated loss ratios by chunks.
+
+    :param marginals: list of n_models sorted arrays of loss ratios, see get_marginal
+    :param correlation: array of shape (n_models, n_models)
+    :return: generator of (years, loss_ratios) with loss_ratios of shape (chunk_size, n_models)
+    """
+    cholesky = get_cholesky(correlation)
+    if cholesky.shape[0] != len(marginals):
+        raise ValueError('The correlation matrix must have one row by model file')
+    if n_years < 1:
+        raise ValueError('The number of simulated years must be positive')
+    if copula == 't' and not df > 0:
+        raise ValueError('The degrees of freedom of the t copula must be positive')
+
+    chunk_size = get_chunk_size(len(marginals), memory_budget)
+    starts = range(0, n_years, chunk_size)
+    for start, generator in zip(starts, get_chunk_generators(seed, len(starts))):
+        size = min(chunk_size, n_years - start)
+        uniforms = draw_uniforms(generator, cholesky, size, copula, df, seed, start, method)
+
+        # Empirical inverse cumulative distribution function of each model file
+        loss_ratios = np.empty((size, len(marginals)), dtype=np.float64)
+        for k, marginal in enumerate(marginals):
+            index = np.minimum((uniforms[:, k] * len(marginal)).astype(np.int64), len(marginal) - 1)
+            loss_ratios[:, k] = marginal[index]
+
+        yield np.arange(start + 1, start + size + 1), loss_ratios
+
+
+def get_copula_variance_reduction(marginals, correlation, n_years, seed, copula='Gaussian', df=4, method='random'):
+    # The statistics are those of the sum of the model files, as priced by a layer, on replications shorter than the
+    # simulation for large numbers of years
+    n_replication_years = min(n_years, REDUCTION_YEARS)
+
+    def simulate(replication_seed, sampling):
+        return np.concatenate([
+            loss_ratios.sum(axis=1) for years, loss_ratios in simulate_copula_chunks(
+                marginals, correlation, n_replication_years, replication_seed, copula, df, method=sampling)
+        ])
+
+    return estimate_variance_reduction(simulate, method, seed)
+
+
+def simulate_correlated_modelfiles(analysis, modelfiles, correlation, n_years, seed, copula='Gaussian', df=4,
+                                   memory_budget=COPULA_MEMORY_BUDGET, method='random'):
+    """ Simulate the model files of an analysis with a copula and save the results as new model files.
+
+    The source model files are unchanged: resimulating them in place would resample their own empirical marginals
+    at each run.
+
+    :return: dictionary with the list of the new 'modelfiles', in the order of modelfiles, and the estimated
+    'variance_reduction' of the sampling method (None for plain Monte Carlo)
+    """
+    if n_years < 1:
+        raise ValueError('The number of simulated years must be positive')
+    marginals = [get_marginal(modelfile) for modelfile in modelfiles]
+
+    variance_reduction = None
+    if method != 'random':
+        variance_reduction = get_copula_variance_reduction(marginals, correlation, n_years, seed, copula, df, method)
+
+    years = np.arange(1, n_years + 1)
+    news = []
+    # https://numpy.org/doc/stable/reference/generated/numpy.memmap.html
+    with tempfile.TemporaryFile() as buffer:
+        # One row by model file, so that each YLT is read back as a contiguous array
+        loss_ratios = np.memmap(buffer, dtype=np.float64, mode='w+', shape=(len(modelfiles), n_years))
+        for chunk_years, chunk_loss_ratios in simulate_copula_chunks(
+                marginals, correlation, n_years, seed, copula, df, memory_budget, method):
+            loss_ratios[:, chunk_years[0] - 1:chunk_years[-1]] = chunk_loss_ratios.T
+        del marginals
+
+        for modelfile, modelfile_loss_ratios in zip(modelfiles, loss_ratios):
+            new = ModelFile(name=f'{modelfile.name} - {copula} copula'[:50], type=modelfile.type)
+            analysis.modelfiles.append(new)
+            session.flush()
+            new.n_years = n_years
+            new.seed = seed
+            new.sampling = method
+            set_modelfile_ylt(new, years, np.array(modelfile_loss_ratios))
+            news.append(new)
+        del loss_ratios
+    return {'modelfiles': news, 'variance_reduction': variance_reduction}
@@ -0,0 +1,42 @@
+"""
+This module defines the content fingerprints used to reprocess only the layers whose inputs changed.
+
+- The YLT hash of a model file identifies the content of its year loss table, whatever its name or storage mode.
+  It is stored in ModelFile.ylt_hash when the YLT is saved as a blob, which is never modified afterwards. The YLTs
+  stored as rows can be modified without the ORM (e.g. bulk updates, imports), so their hash is computed again each
+  time it is needed.
+- The fingerprint of a layer combines its terms with the YLT hashes of its linked model files. Two result layers
+  with the same fingerprint have the same year losses, so the stored result of one can be reused for the other.
+
+The engine version is part of the fingerprint: increase ENGINE_VERSION when a change of flaskapp.pricing.stoploss
+changes the priced amounts, so that the results processed before are not reused.
+
+Functions:
+- get_modelfile_ylt_hash(modelfile): Get the YLT hash of a model file, computing and storing it if it may be stale.
+- get_layer_fingerprint(layer, ylt_hashes): Get the fingerprint of a layer from its terms and model YLT hashes.
+
+"""
+
+from flaskapp.pricing.columnar import get_modelfile_ylt, hash_ylt
+import hashlib
+import json
+
+ENGINE_VERSION = 1
+
+
+def get_modelfile_ylt_hash(modelfile):
+    if modelfile.ylt_hash is None or modelfile.yltblob_id is None:
+        modelfile.ylt_hash = hash_ylt(*get_modelfile_ylt(modelfile))
+    return modelfile.ylt_hash
+
+
+def get_layer_fingerprint(layer, ylt_hashes):
+    # The order in which the model files are linked does not change the result
+    content = {
+        'engine': ENGINE_VERSION,
+        'premium': layer.premium,
+        'agg_limit': layer.agg_limit,
+        'agg_deduct': layer.agg_deduct,
+        'ylts': sorted(ylt_hashes),
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
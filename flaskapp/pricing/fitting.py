@@ -0,0 +1,197 @@
+"""
+This module defines the fitting of the loss models on the experience, with a cache of the fitted distributions.
+
+Several candidate distributions are fitted on the loss ratios of a modeling period:
+- log-normal, gamma, Weibull, Pareto and generalized Pareto (for the tails) by maximum likelihood, with a location
+  fixed at 0 since the loss ratios are positive
+- log-normal by the method of moments, the historical loss model of the application
+
+The candidates are fitted in parallel in a thread pool and ranked by AIC, with their Kolmogorov-Smirnov and
+Anderson-Darling statistics. The densities of all the candidates are evaluated on one shared grid, as one
+(n_candidates, CURVE_POINTS) array, to be displayed on the experience page.
+
+A fit depends only on the losses of a loss file (HistoLossFile), the modeling period and the candidates. The fits are
+cached with their curve data, so that going back to a modeling period already selected neither refits the
+distributions nor evaluates their densities.
+
+The cache is the FIT_CACHE_DIR disk cache (see flaskapp.pricing.caching). The key of a fit includes the version of
+the loss file, a hash of its losses.
+
+Functions:
+- get_lognorm_param(serie): Calculate log-normal distribution parameters from a data series.
+- fit_lognorm_moments(sample): Fit a log-normal distribution with the method of moments.
+- get_distribution(candidate): Get the frozen scipy distribution of a fitted candidate.
+- get_parameters(candidate): Get the named parameters of a fitted candidate.
+- get_anderson_darling(sample, distribution): Compute the Anderson-Darling statistic of a fit.
+- fit_candidate(name, sample): Fit a candidate distribution and compute its goodness of fit.
+- fit_candidates(sample, names): Fit and rank several candidate distributions, with their densities on a shared grid.
+- get_histolossfile_losses(histolossfile_id): Get the years and loss ratios of a loss file.
+- get_fits(histolossfile_id, year_min, year_max, names): Get the ranked fits of a loss file on a modeling period,
+  from the cache if possible.
+
+Dependencies:
+- numpy
+- scipy
+
+"""
+
+from flaskapp.extensions import session, select
+from flaskapp.models import *
+from flaskapp.pricing.caching import get_disk_cache
+from flaskapp.pricing.columnar import get_arrays, hash_ylt
+from concurrent.futures import ThreadPoolExecutor
+from scipy import stats
+import numpy as np
+
+FIT_CACHE_VERSION = 2  # Increment when the content of the cached fits changes
+CURVE_POINTS = 10000  # Number of points of the shared density grid
+FIT_WORKERS = 4  # Number of threads fitting the candidates
+
+# Candidate distributions: scipy family and fitting method, maximum likelihood ('mle') or moments
+CANDIDATES = {
+    'lognorm': {'label': 'Log-normal', 'family': 'lognorm', 'method': 'mle'},
+    'gamma': {'label': 'Gamma', 'family': 'gamma', 'method': 'mle'},
+    'weibull': {'label': 'Weibull', 'family': 'weibull_min', 'method': 'mle'},
+    'pareto': {'label': 'Pareto', 'family': 'pareto', 'method': 'mle'},
+    'genpareto': {'label': 'Generalized Pareto', 'family': 'genpareto', 'method': 'mle'},
+    'lognorm_moments': {'label': 'Log-normal (moments)', 'family': 'lognorm', 'method': 'moments'},
+}
+
+
+def get_lognorm_param(serie):
+    mean = np.mean(serie)
+    std = np.std(serie)
+
+    mu = np.log(mean / np.sqrt(1 + std ** 2 / mean ** 2))
+    scale = np.exp(mu)
+    s = np.sqrt(np.log((1 + std ** 2 / mean ** 2)))
+
+    return {
+        'mean': mean,
+        'std': std,
+        'mu': mu,
+        'scale': scale,
+        's': s
+    }
+
+
+def fit_lognorm_moments(sample):
+    params = get_lognorm_param(sample)
+    return params['s'], 0, params['scale']
+
+
+def get_distribution(candidate):
+    # The arguments are the shapes, the location and the scale, in the order of scipy
+    return getattr(stats, candidate['family'])(*candidate['args'])
+
+
+def get_parameters(candidate):
+    # Names of the arguments, e.g. {'s': 0.3, 'loc': 0, 'scale': 0.7} for a log-normal distribution
+    family = getattr(stats, candidate['family'])
+    names = (family.shapes.split(', ') if family.shapes else []) + ['loc', 'scale']
+    return dict(zip(names, candidate['args']))
+
+
+def get_anderson_darling(sample, distribution):
+    # https://en.wikipedia.org/wiki/Anderson%E2%80%93Darling_test
+    n = len(sample)
+    cdf = np.clip(distribution.cdf(np.sort(sample)), 1e-12, 1 - 1e-12)
+    weights = 2 * np.arange(1, n + 1) - 1
+    return float(-n - np.sum(weights * (np.log(cdf) + np.log1p(-cdf[::-1]))) / n)
+
+
+def fit_candidate(name, sample):
+    """ Fit a candidate distribution on a sample of loss ratios.
+
+    :return: dictionary with the scipy 'family', its 'args', the log-likelihood, AIC, KS and AD statistics, or None
+    if the fit failed
+    """
+    candidate = CANDIDATES[name]
+    try:
+        with np.errstate(all='ignore'):
+            if candidate['method'] == 'mle':
+                # https://docs.scipy.org/doc/scipy/reference/generated/scipy.stats.rv_continuous.fit.html
+                args = getattr(stats, candidate['family']).fit(sample, floc=0)
+            else:
+                args = fit_lognorm_moments(sample)
+    except (ValueError, RuntimeError):
+        return None
+
+    fit = {
+        'name': name,
+        'label': candidate['label'],
+        'family': candidate['family'],
+        'args': [float(arg) for arg in args],
+    }
+    distribution = get_distribution(fit)
+    n_params = len(args) - 1  # The location is fixed
+
+    loglik = float(np.sum(distribution.logpdf(sample)))
+    ks = stats.kstest(sample, distribution.cdf)
+    return fit | {
+        'loglik': loglik,
+        'aic': 2 * n_params - 2 * loglik,
+        'ks': float(ks.statistic),
+        'ks_pvalue': float(ks.pvalue),
+        'ad': get_anderson_darling(sample, distribution),
+    }
+
+
+def fit_candidates(sample, names=tuple(CANDIDATES)):
+    """ Fit and rank several candidate distributions on a sample of loss ratios.
+
+    :return: dictionary with the 'candidates' ranked by AIC (see fit_candidate), the shared grid 'x' of shape
+    (CURVE_POINTS,) and the densities 'pdfs' of shape (n_candidates, CURVE_POINTS)
+    """
+    sample = np.asarray(sample, dtype=np.float64)
+    if len(np.unique(sample)) < 2:
+        raise ValueError('The modeling period must have at least 2 different loss ratios')
+    if np.any(sample <= 0):
+        raise ValueError('The loss ratios must be positive to fit a distribution')
+
+    with ThreadPoolExecutor(max_workers=min(FIT_WORKERS, len(names))) as executor:
+        fits = [fit for fit in executor.map(lambda name: fit_candidate(name, sample), names) if fit is not None]
+    if not fits:
+        raise ValueError('No distribution could be fitted on the modeling period')
+
+    # Rank the candidates, the failed likelihoods (e.g. a sample outside the support) last
+    fits.sort(key=lambda fit: fit['aic'] if np.isfinite(fit['aic']) else np.inf)
+    for rank, fit in enumerate(fits, start=1):
+        fit['rank'] = rank
+
+    # The grid covers the sample and its tail, the same for all the candidates
+    x = np.linspace(0, 1.5 * sample.max(), CURVE_POINTS)
+    pdfs = np.empty((len(fits), CURVE_POINTS), dtype=np.float64)
+    for k, fit in enumerate(fits):
+        pdfs[k] = get_distribution(fit).pdf(x)
+
+    return {'candidates': fits, 'x': x, 'pdfs': pdfs}
+
+
+def get_histolossfile_losses(histolossfile_id):
+    query = select(HistoLoss.year, HistoLoss.loss_ratio) \
+        .filter_by(lossfile_id=histolossfile_id) \
+        .order_by(HistoLoss.year)
+    return get_arrays(query, ['year', 'loss_ratio'])
+
+
+def get_fits(histolossfile_id, year_min, year_max, names=tuple(CANDIDATES)):
+    """ Get the ranked fits of candidate distributions on the losses of a loss file over a modeling period.
+
+    :return: dictionary of fit_candidates, with the 'sample' of loss ratios of the period and 'cached', True if the
+    fits come from the cache
+    """
+    years, loss_ratios = get_histolossfile_losses(histolossfile_id)
+    sample = loss_ratios[(years >= year_min) & (years <= year_max)]
+    if len(sample) == 0:
+        raise ValueError('The modeling period has no loss')
+
+    cache = get_disk_cache('FIT_CACHE_DIR', 'FIT_CACHE_SIZE_LIMIT')
+    key = ('fit', FIT_CACHE_VERSION, histolossfile_id, hash_ylt(years, loss_ratios), year_min, year_max, tuple(names))
+    fits = cache.get(key)
+    if fits is not None:
+        return fits | {'sample': sample, 'cached': True}
+
+    fits = fit_candidates(sample, names)
+    cache.set(key, fits)
+    return fits | {'sample': sample, 'cached': False}
@@ -0,0 +1,275 @@
+"""
+This module defines the execution of the pricing as background jobs.
+
+Two execution modes are available, chosen with the PRICING_JOB_QUEUE setting (see config.py):
+- 'local': the Dash background callback prices the analysis itself, in the separate process started by the
+  DiskcacheManager registered in flaskapp.register_dashapp.
+- 'database': the Dash background callback only enqueues a Job row and follows its progress. The pricing is done by
+  the worker processes started with the flask pricing-worker command, which may run on other machines. The workers
+  claim the jobs with SELECT ... FOR UPDATE SKIP LOCKED, so that each job is executed once.
+
+A queued job that no worker claims within PRICING_JOB_QUEUE_TIMEOUT seconds fails, e.g. when no worker is running.
+A running job whose progress was not updated for PRICING_JOB_STALE_TIMEOUT seconds is put back in the queue, its
+worker being considered stopped. SQLite allows only one writer at a time, so the workers cannot update the progress
+while they price: the running jobs are never requeued on SQLite.
+
+The Cancel buttons of the Dash pages stop the background callback and mark the jobs of the analysis cancelled. A
+worker stops a cancelled job at its next progress update, and never commits its result file.
+
+The Dash job process has no request context: job_app_context pushes an application context and gives the job its
+own database connections.
+
+Functions:
+- new_job_id(): Generate a short id to identify a job in the UI.
+- job_app_context(): Context manager giving a background job access to the database.
+- get_progress_reporter(set_progress, job_id): Wrap the Dash set_progress function for process_resultfile.
+- run_process_resultfile(analysis_id, name, progress=None): Process and commit a result file, return its id.
+- submit_process_resultfile(analysis_id, name, progress=None): Process a result file in the configured mode.
+- enqueue_process_resultfile(analysis_id, name): Add a job to the queue.
+- wait_for_job(job_id, progress=None, poll_interval=1): Follow a queued job until it is finished, return the result
+  file id.
+- cancel_jobs(analysis_id): Cancel the queued and running jobs of an analysis.
+- claim_job(worker): Take the oldest queued job, or return None if the queue is empty.
+- execute_job(job): Execute a claimed job and record its outcome.
+- requeue_stale_jobs(timeout): Put back in the queue the running jobs of the workers that stopped responding.
+- run_worker(poll_interval, burst=False): Loop claiming and executing jobs.
+
+"""
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import current_app
+from flaskapp.extensions import db, session, select
+from flaskapp.models import *
+from flaskapp.pricing.results import process_resultfile
+from sqlalchemy import update
+import dash
+import os
+import socket
+import time
+import uuid
+
+PROGRESS_INTERVAL = 1  # Minimum number of seconds between two progress updates of a queued job
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def new_job_id():
+    return uuid.uuid4().hex[:8]
+
+
+@contextmanager
+def job_app_context():
+    flask_app = dash.get_app().server
+
+    with flask_app.app_context():
+        # The job process is forked from a web worker: do not reuse the connections of the parent's pool
+        # https://docs.sqlalchemy.org/en/20/core/pooling.html#using-connection-pools-with-multiprocessing-or-os-fork
+        db.engine.dispose(close=False)
+        try:
+            yield
+        finally:
+            session.remove()
+
+
+def get_progress_reporter(set_progress, job_id):
+    def report(fraction):
+        percent = round(100 * fraction)
+        set_progress((percent, f'Job {job_id}: {percent}%'))
+
+    return report
+
+
+def run_process_resultfile(analysis_id, name, progress=None):
+    analysis = session.get(Analysis, analysis_id)
+    resultfile = process_resultfile(analysis, name, progress=progress)
+    session.commit()
+    return resultfile.id
+
+
+def submit_process_resultfile(analysis_id, name, progress=None):
+    if current_app.config.get('PRICING_JOB_QUEUE') == 'database':
+        job_id = enqueue_process_resultfile(analysis_id, name)
+        return wait_for_job(job_id, progress=progress)
+    return run_process_resultfile(analysis_id, name, progress=progress)
+
+
+def enqueue_process_resultfile(analysis_id, name):
+    # The commit also makes the pending changes of the session (e.g. the layer relationships) visible to the workers
+    job = Job(type='process_resultfile', name=name, analysis_id=analysis_id)
+    session.add(job)
+    session.commit()
+    return job.id
+
+
+def wait_for_job(job_id, progress=None, poll_interval=1):
+    queue_timeout = current_app.config.get('PRICING_JOB_QUEUE_TIMEOUT')
+
+    while True:
+        # Read the job row with a fresh query, not from the identity map of the session
+        session.expire_all()
+        job = session.get(Job, job_id)
+
+        if progress is not None:
+            progress(job.progress)
+
+        match job.status:
+            case 'done':
+                return job.resultfile_id
+            case 'failed':
+                raise ValueError(job.error)
+            case 'cancelled':
+                raise ValueError(f'The job {job_id} was cancelled')
+            case 'queued' if queue_timeout and datetime.utcnow() - job.created_at > timedelta(seconds=queue_timeout):
+                # Failed only if still queued, a worker may claim it meanwhile
+                error = f'No pricing worker took the job within {queue_timeout} seconds, start one with ' \
+                        f'flask pricing-worker'
+                failed = session.execute(
+                    update(Job)
+                    .where(Job.id == job_id, Job.status == 'queued')
+                    .values(status='failed', error=error, finished_at=datetime.utcnow())
+                ).rowcount
+                session.commit()
+                if failed:
+                    raise ValueError(error)
+                continue
+
+        session.rollback()  # End the read transaction so that the next poll sees the commits of the worker
+        time.sleep(poll_interval)
+
+
+def cancel_jobs(analysis_id):
+    # The running jobs are stopped by their worker, see get_job_progress_writer and execute_job
+    cancelled = session.execute(
+        update(Job)
+        .where(Job.analysis_id == analysis_id, Job.status.in_(['queued', 'running']))
+        .values(status='cancelled', finished_at=datetime.utcnow())
+    ).rowcount
+    session.commit()
+    return cancelled
+
+
+def claim_job(worker):
+    # https://www.postgresql.org/docs/current/sql-select.html#SQL-FOR-UPDATE-SHARE
+    # SKIP LOCKED lets concurrent workers take different jobs without waiting for each other
+    # SQLite ignores FOR UPDATE: the conditional UPDATE below still guarantees that a job is claimed once
+    query = select(Job.id) \
+        .filter_by(status='queued') \
+        .order_by(Job.id) \
+        .limit(1) \
+        .with_for_update(skip_locked=True)
+    job_id = session.execute(query).scalar()
+
+    if job_id is None:
+        session.rollback()
+        return None
+
+    now = datetime.utcnow()
+    claimed = session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == 'queued')
+        .values(status='running', worker=worker, started_at=now, updated_at=now)
+    ).rowcount
+    session.commit()
+
+    return session.get(Job, job_id) if claimed else None
+
+
+def get_job_progress_writer(job_id):
+    # Write the progress with its own connection and transaction, independently from the pricing transaction
+    # SQLite allows only one writer at a time: the progress is not reported on the SQLite stand-in
+    # The update is also the heartbeat of the job, and tells the worker that the job was cancelled
+    last_update = 0
+
+    def write(fraction):
+        nonlocal last_update
+        if db.engine.dialect.name == 'sqlite':
+            return
+        if time.monotonic() - last_update < PROGRESS_INTERVAL and fraction < 1:
+            return
+        last_update = time.monotonic()
+        with db.engine.begin() as connection:
+            running = connection.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == 'running')
+                .values(progress=fraction, updated_at=datetime.utcnow())
+            ).rowcount
+        if not running:
+            raise JobCancelled(f'The job {job_id} was cancelled')
+
+    return write
+
+
+def execute_job(job):
+    job_id = job.id
+
+    try:
+        match job.type:
+            case 'process_resultfile':
+                analysis = session.get(Analysis, job.analysis_id)
+                resultfile = process_resultfile(analysis, job.name, progress=get_job_progress_writer(job_id))
+                session.flush()
+                job.resultfile_id = resultfile.id
+            case _:
+                raise ValueError(f'The job type {job.type} is unknown')
+
+        # The result file and the job status are committed together, unless the job was cancelled meanwhile
+        done = session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == 'running')
+            .values(status='done', progress=1, resultfile_id=job.resultfile_id, finished_at=datetime.utcnow())
+        ).rowcount
+        if not done:
+            raise JobCancelled(f'The job {job_id} was cancelled')
+        session.commit()
+
+    except JobCancelled:
+        session.rollback()
+
+    except Exception as e:
+        session.rollback()
+        session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == 'running')
+            .values(status='failed', error=str(e), finished_at=datetime.utcnow())
+        )
+        session.commit()
+
+    session.expire_all()
+    return session.get(Job, job_id)
+
+
+def requeue_stale_jobs(timeout):
+    # The workers do not update the progress on SQLite, see get_job_progress_writer
+    if db.engine.dialect.name == 'sqlite':
+        return
+    limit = datetime.utcnow() - timedelta(seconds=timeout)
+    session.execute(
+        update(Job)
+        .where(Job.status == 'running', Job.updated_at < limit)
+        .values(status='queued', worker=None, progress=0)
+    )
+    session.commit()
+
+
+def run_worker(poll_interval, burst=False):
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    stale_timeout = current_app.config.get('PRICING_JOB_STALE_TIMEOUT')
+
+    while True:
+        if stale_timeout:
+            requeue_stale_jobs(stale_timeout)
+
+        job = claim_job(worker)
+
+        if job is None:
+            if burst:
+                return
+            time.sleep(poll_interval)
+            continue
+
+        start = time.perf_counter()
+        job = execute_job(job)
+        current_app.logger.info(f'{worker}: job {job.id} {job.status} in {time.perf_counter() - start:.1f}s')
@@ -0,0 +1,238 @@
+"""
+This module defines the server-side paging of the year loss tables (YLTs) shown in the AG Grids.
+
+Functions:
+- get_filters(columns, filter_model, filters): Get the conditions of the filter model of a grid.
+- get_sql_page(query, request, key): Get a block of the rows of a query.
+- get_df_page(df, request): Get a block of the rows of a DataFrame.
+- get_modelfile_df(modelfile): Get the YLT of a model file stored as columns, as a DataFrame.
+- get_resultlayer_df(resultlayer): Get the YLT of a result layer stored as columns, as a DataFrame.
+- get_modelfile_page(modelfile, request): Get a block of the YLT of a model file.
+- get_resultlayer_page(resultlayer, request): Get a block of the YLT of a result layer.
+
+Dependencies:
+- numpy
+- pandas
+
+"""
+
+from flaskapp.extensions import session, select
+from flaskapp.models import *
+from flaskapp.pricing.caching import get_disk_cache
+from flaskapp.pricing.columnar import get_modelfile_ylt, get_yearloss_model, get_resultlayer_ylt
+from flaskapp.pricing.statistics import get_resultlayer_version
+from sqlalchemy import func
+from functools import reduce
+import numpy as np
+import operator
+import pandas as pd
+
+PAGE_CACHE_VERSION = 1  # Increment when the content of the cached DataFrames changes
+
+# Conditions of the number filters, the same operators apply to the SQL columns and to the pandas series
+# https://www.ag-grid.com/archive/30.0.6/react-data-grid/filter-number/
+NUMBER_FILTERS = {
+    'equals': lambda column, value, value_to: column == value,
+    'notEqual': lambda column, value, value_to: column != value,
+    'lessThan': lambda column, value, value_to: column < value,
+    'lessThanOrEqual': lambda column, value, value_to: column <= value,
+    'greaterThan': lambda column, value, value_to: column > value,
+    'greaterThanOrEqual': lambda column, value, value_to: column >= value,
+    'inRange': lambda column, value, value_to: (column > value) & (column < value_to),  # Bounds excluded by default
+}
+
+# Conditions of the text filters, case-insensitive as in the grid
+# https://www.ag-grid.com/archive/30.0.6/react-data-grid/filter-text/
+SQL_FILTERS = {
+    'number': NUMBER_FILTERS | {
+        'blank': lambda column, value, value_to: column.is_(None),
+        'notBlank': lambda column, value, value_to: column.is_not(None),
+    },
+    'text': {
+        'contains': lambda column, value, value_to: column.icontains(value, autoescape=True),
+        'notContains': lambda column, value, value_to: ~column.icontains(value, autoescape=True),
+        'equals': lambda column, value, value_to: func.lower(column) == value.lower(),
+        'notEqual': lambda column, value, value_to: func.lower(column) != value.lower(),
+        'startsWith': lambda column, value, value_to: column.istartswith(value, autoescape=True),
+        'endsWith': lambda column, value, value_to: column.iendswith(value, autoescape=True),
+        'blank': lambda column, value, value_to: column.is_(None) | (column == ''),
+        'notBlank': lambda column, value, value_to: column.is_not(None) & (column != ''),
+    },
+}
+
+DF_FILTERS = {
+    'number': NUMBER_FILTERS | {
+        'blank': lambda serie, value, value_to: serie.isna(),
+        'notBlank': lambda serie, value, value_to: serie.notna(),
+    },
+    'text': {
+        'contains': lambda serie, value, value_to: serie.str.lower().str.contains(value.lower(), regex=False),
+        'notContains': lambda serie, value, value_to: ~serie.str.lower().str.contains(value.lower(), regex=False),
+        'equals': lambda serie, value, value_to: serie.str.lower() == value.lower(),
+        'notEqual': lambda serie, value, value_to: serie.str.lower() != value.lower(),
+        'startsWith': lambda serie, value, value_to: serie.str.lower().str.startswith(value.lower()),
+        'endsWith': lambda serie, value, value_to: serie.str.lower().str.endswith(value.lower()),
+        'blank': lambda serie, value, value_to: serie.isna() | (serie == ''),
+        'notBlank': lambda serie, value, value_to: serie.notna() & (serie != ''),
+    },
+}
+
+
+def get_condition(column, condition, filter_type, filters):
+    # One condition of a column filter, e.g. {'filterType': 'number', 'type': 'greaterThan', 'filter': 0}
+    function = filters.get(condition.get('filterType', filter_type), {}).get(condition.get('type'))
+    if function is None or (condition.get('filter') is None and condition['type'] not in ['blank', 'notBlank']):
+        return None
+    return function(column, condition.get('filter'), condition.get('filterTo'))
+
+
+def get_filters(columns, filter_model, filters):
+    """ Get the conditions of the filter model of a grid, the filters of the unknown columns being ignored.
+
+    :param columns: dictionary-like of the SQL columns or DataFrame of the rows, by column name
+    :param filter_model: filter model of the getRowsRequest of the grid, by column name
+    :param filters: SQL_FILTERS or DF_FILTERS
+    :return: list of the conditions of the columns, to be combined with AND
+    """
+    conditions = []
+    for name, column_filter in (filter_model or {}).items():
+        if name not in columns:
+            continue
+        column = columns[name]
+
+        # A column filter has either one condition, or several combined with an operator
+        # The grid sends the conditions in a list, and the first two ones as condition1 and condition2 (deprecated)
+        if 'operator' in column_filter:
+            parts = column_filter.get('conditions') \
+                or [column_filter[key] for key in ['condition1', 'condition2'] if column_filter.get(key)]
+        else:
+            parts = [column_filter]
+        parts = [get_condition(column, part, column_filter.get('filterType'), filters) for part in parts]
+        parts = [part for part in parts if part is not None]
+        if parts:
+            combine = operator.or_ if column_filter.get('operator') == 'OR' else operator.and_
+            conditions.append(reduce(combine, parts))
+    return conditions
+
+
+def get_sql_page(query, request, key='id'):
+    """ Get a block of the rows of a query, sorted and filtered as requested by the grid.
+
+    :param query: select() of the columns of the grid
+    :param request: getRowsRequest of the grid, with startRow, endRow, sortModel and filterModel
+    :param key: unique column of the query, which sorts the rows with the same sorted values
+    :return: getRowsResponse of the grid, with the rowData of the block and the rowCount if known
+    """
+    subquery = query.subquery()
+    columns = subquery.c
+    conditions = get_filters(columns, request.get('filterModel'), SQL_FILTERS)
+    order_by = [
+        columns[sort['colId']].desc() if sort['sort'] == 'desc' else columns[sort['colId']].asc()
+        for sort in request.get('sortModel') or [] if sort['colId'] in columns
+    ]
+
+    start, end = request['startRow'], request['endRow']
+    page = select(subquery).where(*conditions).order_by(*order_by, columns[key]).offset(start).limit(end - start)
+    rowData = [dict(row._mapping) for row in session.execute(page)]
+
+    response = {'rowData': rowData}
+    if len(rowData) < end - start:
+        response['rowCount'] = start + len(rowData)  # Last block
+    elif start == 0:
+        response['rowCount'] = session.scalar(select(func.count()).select_from(subquery).where(*conditions))
+    return response
+
+
+def get_df_page(df, request):
+    """ Get a block of the rows of a DataFrame, sorted and filtered as requested by the grid.
+
+    :param df: DataFrame of the columns of the grid
+    :param request: getRowsRequest of the grid, with startRow, endRow, sortModel and filterModel
+    :return: getRowsResponse of the grid, with the rowData of the block and the rowCount
+    """
+    conditions = get_filters(df, request.get('filterModel'), DF_FILTERS)
+    if conditions:
+        df = df[reduce(operator.and_, conditions)]
+
+    sort_model = [sort for sort in request.get('sortModel') or [] if sort['colId'] in df]
+    if sort_model:
+        # A stable sort keeps the stored order of the rows with the same sorted values
+        df = df.sort_values(
+            [sort['colId'] for sort in sort_model],
+            ascending=[sort['sort'] != 'desc' for sort in sort_model],
+            kind='stable',
+        )
+
+    start, end = request['startRow'], request['endRow']
+    return {'rowData': df.iloc[start:end].to_dict('records'), 'rowCount': len(df)}
+
+
+def get_modelfile_df(modelfile):
+    # The blob is content addressed: the model files sharing it share the cached DataFrame
+    cache = get_disk_cache('PAGE_CACHE_DIR', 'PAGE_CACHE_SIZE_LIMIT')
+    key = ('modelfile', PAGE_CACHE_VERSION, modelfile.ylt_hash)
+    df = cache.get(key)
+    if df is None:
+        years, loss_ratios = get_modelfile_ylt(modelfile)
+        df = pd.DataFrame({'id': np.arange(len(years)), 'year': years, 'loss_ratio': loss_ratios})
+        cache.set(key, df)
+    return df
+
+
+def get_resultlayer_df(resultlayer):
+    cache = get_disk_cache('PAGE_CACHE_DIR', 'PAGE_CACHE_SIZE_LIMIT')
+    key = ('resultlayer', PAGE_CACHE_VERSION, type(resultlayer).__name__, resultlayer.id,
+           get_resultlayer_version(resultlayer))
+    df = cache.get(key)
+    if df is None:
+        ylt = get_resultlayer_ylt(resultlayer)
+
+        # Code of the name of the model file of each row, -1 (missing) for a model file not linked to the layer
+        # The names are sorted, so that the categorical column sorts as the names
+        model_ids = np.array(sorted(modelfile.id for modelfile in resultlayer.modelfiles), dtype=np.int64)
+        names = {modelfile.id: modelfile.name for modelfile in resultlayer.modelfiles}
+        categories = sorted(set(names.values()))
+        id_codes = np.array([categories.index(names[model_id]) for model_id in model_ids], dtype=np.int64)
+        positions = np.clip(np.searchsorted(model_ids, ylt['model_id']), 0, max(len(model_ids) - 1, 0))
+        codes = np.where(model_ids[positions] == ylt['model_id'], id_codes[positions], -1) \
+            if len(model_ids) else np.full(len(ylt['model_id']), -1)
+
+        df = pd.DataFrame({
+            'id': np.arange(len(ylt['year'])),
+            'model_name': pd.Categorical.from_codes(codes, categories=categories),
+            'year': ylt['year'],
+            'gross': ylt['gross'],
+            'ceded': ylt['ceded'],
+            'net': ylt['net'],
+        })
+        cache.set(key, df)
+    return df
+
+
+def get_modelfile_page(modelfile, request):
+    """ Get a block of the YLT of a model file, with the columns year and loss_ratio.
+
+    :return: getRowsResponse of the grid
+    """
+    if modelfile.yltblob_id is None:
+        query = select(ModelYearLoss.id, ModelYearLoss.year, ModelYearLoss.loss_ratio) \
+            .filter_by(modelfile_id=modelfile.id)
+        return get_sql_page(query, request)
+    return get_df_page(get_modelfile_df(modelfile), request)
+
+
+def get_resultlayer_page(resultlayer, request):
+    """ Get a block of the YLT of a result layer, with the columns model_name, year, gross, ceded and net.
+
+    :param resultlayer: ResultLayer or ResultLayerXS
+    :return: getRowsResponse of the grid
+    """
+    # Query the storage mode rather than loading the deferred ylt column at every block
+    resultlayer_model = type(resultlayer)
+    if session.scalar(select(resultlayer_model.ylt.is_not(None)).where(resultlayer_model.id == resultlayer.id)):
+        return get_df_page(get_resultlayer_df(resultlayer), request)
+
+    yearloss_model, foreign_key = get_yearloss_model(resultlayer)
+    columns = ['id', 'model_name', 'year', 'gross', 'ceded', 'net']
+    query = select(*[getattr(yearloss_model, column) for column in columns]).filter_by(**{foreign_key: resultlayer.id})
+    return get_sql_page(query, request)
@@ -0,0 +1,293 @@
+"""
+This module defines the processing of an analysis into a result file.
+
+The processing loads the inputs from the database, prices them with the vectorized engine of
+flaskapp.pricing.stoploss and persists the output. It does not commit the session: the caller decides when the
+transaction ends.
+
+The stop loss layers (Layer) are priced with flaskapp.pricing.stoploss over the YLTs of their model files, the
+occurrence excess of loss layers (LayerXS) with flaskapp.pricing.xs over the event loss tables (ELTs) of theirs.
+
+The processing of the stop loss layers is incremental: a layer whose fingerprint (terms and linked model YLTs, see
+flaskapp.pricing.fingerprint) matches a layer of a previous result file of the analysis is not priced again, its
+stored year losses are copied. The result model files point to the shared YLT blob of their model file (see
+flaskapp.pricing.columnar), so that no model year loss is written. Only the YLTs needed by the layers to price are
+loaded.
+
+The statistics of the result layers (OEP, TVaR, pure premiums, see flaskapp.pricing.statistics) are saved with their
+year losses: computed from the priced arrays, or copied with the year losses of the unchanged layers.
+
+Functions:
+- process_resultfile(analysis, name, progress=None, reuse=True): Price the layers of an analysis and save the
+  result as a ResultFile.
+- get_previous_resultlayers(analysis, fingerprints): Get the latest result layer of the analysis by fingerprint.
+- get_previous_resultmodelfiles(analysis, ylt_hashes): Get the latest result model file of the analysis by YLT hash.
+- process_resultlayersxs(xslayers, resultlayersxs, xs_links, modelfiles, resultmodelfiles): Price the excess of loss
+  layers and save their year losses.
+
+"""
+
+from flaskapp.extensions import session, select
+from flaskapp.models import *
+from flaskapp.pricing.columnar import get_modelfile_ylt, get_modelfile_elt, set_resultmodelfile_ylt, \
+    set_resultlayer_ylt, copy_resultmodelfile_ylt, copy_resultlayer_ylt
+from flaskapp.pricing.fingerprint import get_modelfile_ylt_hash, get_layer_fingerprint
+from flaskapp.pricing.statistics import set_resultlayer_statistics, save_resultlayers_statistics, \
+    copy_resultlayer_statistics
+from flaskapp.pricing.stoploss import align_yearlosses, price_stoploss
+from flaskapp.pricing.xs import price_xs
+import numpy as np
+
+
+def process_resultfile(analysis, name, progress=None, reuse=True):
+    """ Price the layers of an analysis with their linked model files and save the result file.
+
+    :param progress: optional function called with the completed fraction of the processing, between 0 and 1
+    :param reuse: reuse the stored results of the unchanged layers and model files, see the module docstring
+    """
+    if progress is None:
+        progress = lambda fraction: None
+
+    resultfile = ResultFile(name=name)
+    analysis.resultfiles.append(resultfile)
+
+    layers = list(analysis.layers)
+    xslayers = list(analysis.xslayers)
+    n_layers = len(layers) + len(xslayers)
+
+    # Get the model files linked to at least one layer, without repetition and in a stable order
+    modelfiles = list({
+        modelfile.id: modelfile for layer in layers + xslayers for modelfile in layer.modelfiles
+    }.values())
+    model_position = {modelfile.id: i for i, modelfile in enumerate(modelfiles)}
+
+    links = get_links(layers, model_position)
+    xs_links = get_links(xslayers, model_position)
+
+    # Find the layers and model files whose stored results can be reused
+    ylt_hashes = [get_modelfile_ylt_hash(modelfile) for modelfile in modelfiles]
+    fingerprints = [
+        get_layer_fingerprint(layer, [ylt_hashes[j] for j in np.flatnonzero(links[i])])
+        for i, layer in enumerate(layers)
+    ]
+    previous_resultlayers = get_previous_resultlayers(analysis, fingerprints) if reuse else {}
+    previous_resultmodelfiles = get_previous_resultmodelfiles(analysis, ylt_hashes) if reuse else {}
+
+    dirty = np.array([fingerprint not in previous_resultlayers for fingerprint in fingerprints], dtype=bool)
+    # The YLTs of the model files saved as rows, before the shared blobs, are also needed to save the result file
+    saved = np.array([
+        modelfile.yltblob_id is not None or ylt_hash in previous_resultmodelfiles
+        for modelfile, ylt_hash in zip(modelfiles, ylt_hashes)
+    ], dtype=bool)
+    needed = links[dirty].any(axis=0) | ~saved
+    needed_positions = np.flatnonzero(needed)
+    progress(0.1)
+
+    # Load only the needed YLTs
+    ylts = {}
+    for j in needed_positions:
+        ylts[j] = get_modelfile_ylt(modelfiles[j])
+        progress(0.1 + 0.3 * len(ylts) / len(needed_positions))
+
+    # Price all the dirty layers and years at once
+    dirty_positions = np.flatnonzero(dirty)
+    years, loss_ratios = align_yearlosses([ylts[j] for j in needed_positions])
+
+    result = price_stoploss(
+        premium=np.array([layers[i].premium for i in dirty_positions]),
+        agg_limit=np.array([layers[i].agg_limit for i in dirty_positions]),
+        agg_deduct=np.array([layers[i].agg_deduct for i in dirty_positions]),
+        links=links[np.ix_(dirty_positions, needed_positions)],
+        loss_ratios=loss_ratios,
+    )
+    progress(0.5)
+
+    # Copy the model files into the result file
+    resultmodelfiles = [get_resultmodelfile_from(modelfile) for modelfile in modelfiles]
+    resultfile.modelfiles.extend(resultmodelfiles)
+
+    resultlayers = [get_resultlayer_from(layer) for layer in layers]
+    resultfile.layers.extend(resultlayers)
+    resultlayersxs = [get_resultlayerxs_from(xslayer) for xslayer in xslayers]
+    resultfile.xslayers.extend(resultlayersxs)
+
+    for i, j in zip(*np.nonzero(links)):
+        resultlayers[i].modelfiles.append(resultmodelfiles[j])
+    for i, j in zip(*np.nonzero(xs_links)):
+        resultlayersxs[i].modelfiles.append(resultmodelfiles[j])
+    for resultlayer, fingerprint in zip(resultlayers, fingerprints):
+        resultlayer.fingerprint = fingerprint
+
+    session.flush()  # Get the ids of the result layers and model files, referenced by the year losses
+
+    # Point the result model files to the YLT blobs, see flaskapp.pricing.columnar
+    for j, resultmodelfile in enumerate(resultmodelfiles):
+        if resultmodelfile.yltblob_id is not None:
+            continue  # Shares the blob of its model file, see get_resultmodelfile_from
+        elif ylt_hashes[j] in previous_resultmodelfiles:
+            copy_resultmodelfile_ylt(previous_resultmodelfiles[ylt_hashes[j]], resultmodelfile)
+        else:
+            set_resultmodelfile_ylt(resultmodelfile, *ylts[j])
+    progress(0.6)
+
+    # Save the result layer year losses of the priced layers, only for the years simulated in the model file
+    gross = np.rint(result['gross'])
+    ceded = np.rint(result['ceded'])
+    simulated = np.stack([np.isin(years, ylts[j][0]) for j in needed_positions]) \
+        if len(needed_positions) else np.empty((0, len(years)), dtype=bool)
+
+    for k, i in enumerate(dirty_positions):
+        pairs = np.flatnonzero(result['layer_index'] == k)
+        model_index = result['model_index'][pairs]  # Position in needed_positions
+        set_priced_resultlayer_ylt(
+            resultlayers[i], resultmodelfiles, needed_positions[model_index],
+            years, simulated[model_index], gross[pairs], ceded[pairs],
+        )
+        progress(0.6 + 0.4 * (k + 1) / n_layers)
+
+    # Copy the year losses of the unchanged layers
+    missing_statistics = []
+    for k, i in enumerate(np.flatnonzero(~dirty)):
+        previous_resultlayer = previous_resultlayers[fingerprints[i]]
+        resultmodelfile_map = get_resultmodelfile_map(
+            previous_resultlayer.modelfiles,
+            [resultmodelfiles[j] for j in np.flatnonzero(links[i])],
+        )
+        if resultmodelfile_map:
+            copy_resultlayer_ylt(previous_resultlayer, resultlayers[i], resultmodelfile_map)
+        if not copy_resultlayer_statistics(previous_resultlayer, resultlayers[i], resultmodelfile_map):
+            missing_statistics.append(resultlayers[i])  # Previous layer saved before its statistics
+        progress(0.6 + 0.4 * (len(dirty_positions) + k + 1) / n_layers)
+    if missing_statistics:
+        session.flush()
+        save_resultlayers_statistics(missing_statistics)
+
+    if xslayers:
+        process_resultlayersxs(xslayers, resultlayersxs, xs_links, modelfiles, resultmodelfiles)
+        progress(1)
+
+    return resultfile
+
+
+def process_resultlayersxs(xslayers, resultlayersxs, xs_links, modelfiles, resultmodelfiles):
+    # Load the ELTs of the model files linked to at least one excess of loss layer
+    xs_positions = np.flatnonzero(xs_links.any(axis=0))
+    elts = [get_modelfile_elt(modelfiles[j]) for j in xs_positions]
+    n_years = [modelfiles[j].n_years for j in xs_positions]
+
+    result = price_xs(
+        occ_limit=np.array([xslayer.occ_limit for xslayer in xslayers]),
+        occ_deduct=np.array([xslayer.occ_deduct or 0 for xslayer in xslayers]),
+        agg_limit=np.array([xslayer.agg_limit for xslayer in xslayers]),
+        agg_deduct=np.array([xslayer.agg_deduct for xslayer in xslayers]),
+        links=xs_links[:, xs_positions],
+        elts=elts,
+        n_years=n_years,
+    )
+
+    # Save the year losses for all the years simulated by the model file, with or without events
+    gross = np.rint(result['gross'])
+    ceded = np.rint(result['ceded'])
+    simulated = result['years'] <= np.array(n_years, dtype=np.int64)[:, np.newaxis]
+
+    for i, resultlayerxs in enumerate(resultlayersxs):
+        pairs = np.flatnonzero(result['layer_index'] == i)
+        model_index = result['model_index'][pairs]  # Position in xs_positions
+        set_priced_resultlayer_ylt(
+            resultlayerxs, resultmodelfiles, xs_positions[model_index],
+            result['years'], simulated[model_index], gross[pairs], ceded[pairs],
+        )
+
+
+def set_priced_resultlayer_ylt(resultlayer, resultmodelfiles, model_positions, years, simulated, gross, ceded):
+    """ Save the priced year losses of a result layer and their statistics, keeping only the years simulated by each
+    model file.
+
+    :param model_positions: array of shape (n_pairs,), position in resultmodelfiles of each model file of the layer
+    :param simulated: boolean array of shape (n_pairs, n_years)
+    :param gross: array of shape (n_pairs, n_years), rounded
+    :param ceded: array of shape (n_pairs, n_years), rounded
+    """
+    model_index = np.repeat(model_positions, simulated.sum(axis=1))
+    years = np.broadcast_to(years, simulated.shape)[simulated]
+    set_resultlayer_ylt(
+        resultlayer,
+        resultmodelfiles,
+        model_index=model_index,
+        years=years,
+        gross=gross[simulated],
+        ceded=ceded[simulated],
+        net=(gross - ceded)[simulated],
+    )
+
+    model_ids = np.array([resultmodelfile.id for resultmodelfile in resultmodelfiles], dtype=np.int64)[model_index]
+    set_resultlayer_statistics(resultlayer, model_ids, years, ceded[simulated])
+
+
+def get_links(layers, model_position):
+    links = np.zeros((len(layers), len(model_position)), dtype=bool)
+    for i, layer in enumerate(layers):
+        for modelfile in layer.modelfiles:
+            links[i, model_position[modelfile.id]] = True
+    return links
+
+
+def get_previous_resultlayers(analysis, fingerprints):
+    query = select(ResultLayer) \
+        .join(ResultFile) \
+        .filter(ResultFile.analysis_id == analysis.id, ResultLayer.fingerprint.in_(set(fingerprints))) \
+        .order_by(ResultLayer.id)
+    # The latest result layer wins
+    return {resultlayer.fingerprint: resultlayer for resultlayer in session.scalars(query)}
+
+
+def get_previous_resultmodelfiles(analysis, ylt_hashes):
+    query = select(ResultModelFile) \
+        .join(ResultFile) \
+        .filter(ResultFile.analysis_id == analysis.id, ResultModelFile.ylt_hash.in_(set(ylt_hashes))) \
+        .order_by(ResultModelFile.id)
+    return {resultmodelfile.ylt_hash: resultmodelfile for resultmodelfile in session.scalars(query)}
+
+
+def get_resultmodelfile_map(sources, targets):
+    # Match the result model files of a previous result layer with the new ones by YLT hash
+    # Model files with the same YLT hash have the same year losses, so any pairing between them is valid
+    targets_by_hash = {}
+    for target in targets:
+        targets_by_hash.setdefault(target.ylt_hash, []).append(target)
+
+    return {source.id: targets_by_hash[source.ylt_hash].pop(0) for source in sources}
+
+
+def get_resultlayer_from(layer):
+    resultlayer = ResultLayer(
+        name=layer.name,
+        premium=layer.premium,
+        agg_limit=layer.agg_limit,
+        agg_deduct=layer.agg_deduct,
+    )
+    return resultlayer
+
+
+def get_resultlayerxs_from(xslayer):
+    resultlayerxs = ResultLayerXS(
+        name=xslayer.name,
+        premium=xslayer.premium,
+        occ_limit=xslayer.occ_limit,
+        agg_limit=xslayer.agg_limit,
+        agg_deduct=xslayer.agg_deduct,
+    )
+    if xslayer.occ_deduct is not None:
+        resultlayerxs.occ_deduct = xslayer.occ_deduct
+    return resultlayerxs
+
+
+def get_resultmodelfile_from(modelfile):
+    resultmodelfile = ResultModelFile(
+        id_src=modelfile.id,
+        name=modelfile.name,
+        type=modelfile.type,
+        ylt_hash=modelfile.ylt_hash,
+        yltblob_id=modelfile.yltblob_id,
+    )
+    return resultmodelfile
@@ -0,0 +1,75 @@
+"""
+This module defines the random number streams of the simulations.
+
+The simulations never use the global state of NumPy: every simulated model file gets a seed, stored in
+ModelFile.seed, from which its YLT can be simulated again exactly.
+
+The years of a model file are simulated by chunks (see flaskapp.pricing.simulation). Each chunk gets its own
+generator, derived from the seed of the model file with SeedSequence.spawn: the streams of the chunks are
+statistically independent, and the chunks can be simulated in any order or in parallel with the same result.
+
+Common random numbers: the versions of a model, e.g. the distributions fitted on the same loss file, can be simulated
+with the same uniform random numbers year by year, so that the differences between the versions, and between the
+layers priced on them, only come from the models and converge with far fewer years. Their seed is derived from the
+seed of the analysis (Analysis.seed) and a key of the model, the id of its loss file: the versions of a model share
+their stream, and the different models of the analysis keep independent streams. A shared stream would make them
+comonotonic and overstate the tail of the layers they share. Once the seed of the analysis is set, a different seed
+entered for a model file simulated with common random numbers is rejected rather than silently ignored.
+
+Functions:
+- new_seed(): Draw a new seed from the entropy of the operating system.
+- get_chunk_generators(seed, n_chunks): Get the independent generators of the chunks of a simulation.
+- spawn_seeds(seed, n_seeds): Derive independent seeds from a seed.
+- get_common_seed(seed, model_key): Derive the seed shared by the versions of a model from the seed of the analysis.
+- get_modelfile_seed(analysis, seed=None, common_random_numbers=False, model_key=None): Get the seed of a new
+  simulated model file.
+
+Dependencies:
+- numpy
+
+"""
+
+import numpy as np
+
+SEED_BITS = 63  # The seeds are stored in signed 64-bit integer columns
+
+
+def new_seed():
+    # https://numpy.org/doc/stable/reference/random/parallel.html#seedsequence-spawning
+    return int(np.random.SeedSequence().entropy % 2 ** SEED_BITS)
+
+
+def get_chunk_generators(seed, n_chunks):
+    return [np.random.default_rng(child) for child in np.random.SeedSequence(seed).spawn(n_chunks)]
+
+
+def spawn_seeds(seed, n_seeds):
+    # Independent seeds derived from a seed, e.g. for the replications of a simulation
+    children = np.random.SeedSequence(seed).spawn(n_seeds)
+    return [int(child.generate_state(1, np.uint64)[0] % 2 ** SEED_BITS) for child in children]
+
+
+def get_common_seed(seed, model_key):
+    # https://numpy.org/doc/stable/reference/random/bit_generators/generated/numpy.random.SeedSequence.html
+    child = np.random.SeedSequence(seed, spawn_key=(int(model_key),))
+    return int(child.generate_state(1, np.uint64)[0] % 2 ** SEED_BITS)
+
+
+def get_modelfile_seed(analysis, seed=None, common_random_numbers=False, model_key=None):
+    """ Get the seed of a new simulated model file.
+
+    :param seed: seed entered by the user, None for a random seed
+    :param model_key: key of the model under the common random numbers, e.g. the id of its loss file
+    :return: the seed, derived from the seed of the analysis and the model key under the common random numbers
+    """
+    if common_random_numbers:
+        if model_key is None:
+            raise ValueError('The common random numbers need the loss file of the model')
+        # The seed of the analysis is set once, by the first model file simulated with common random numbers
+        if analysis.seed is None:
+            analysis.seed = new_seed() if seed is None else seed
+        elif seed is not None and seed != analysis.seed:
+            raise ValueError(f'The common random numbers use the seed of the analysis, {analysis.seed}: clear the '
+                             f'seed or simulate without common random numbers')
+        return get_common_seed(analysis.seed, model_key)
+    return new_seed() if seed is None else seed
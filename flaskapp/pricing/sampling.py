@@ -0,0 +1,82 @@
+"""
+This module defines the sampling methods of the uniform random numbers of the simulations.
+
+The simulations convert uniform random numbers into loss ratios through inverse cumulative distribution functions
+(see flaskapp.pricing.simulation and flaskapp.pricing.copula). The uniform random numbers can be drawn with:
+- 'random': plain Monte Carlo, from the generator of each chunk (see flaskapp.pricing.rng)
+- 'lhs': Latin hypercube sampling, each chunk having exactly one year in each of its equiprobable strata
+- 'sobol': a scrambled Sobol sequence, a quasi-Monte Carlo method. The scrambling only depends on the seed and each
+  chunk starts where the previous one ends, so that the chunks are the consecutive parts of one sequence
+
+Latin hypercube and Sobol samples fill the unit interval more evenly than random numbers, so that the mean and the
+quantiles of the simulated YLT converge faster: the same precision needs fewer years, i.e. fewer rows to store and
+price. The variance reduction is estimated by replications: the simulation is run several times with plain Monte Carlo
+and with the selected method, and the variances of the statistics of the replications are compared.
+
+Functions:
+- get_uniforms(seed, generator, start, size, dimension, method): Draw the uniform random numbers of a chunk.
+- get_statistics(loss_ratios, quantiles): Get the mean and quantiles of the loss ratios of a replication.
+- estimate_variance_reduction(simulate, method, seed, replications, quantiles): Estimate the variance reduction of a
+  sampling method compared with plain Monte Carlo.
+
+Dependencies:
+- numpy
+- scipy
+
+"""
+
+from flaskapp.pricing.rng import spawn_seeds
+from scipy.stats import qmc
+import numpy as np
+import warnings
+
+SAMPLING_METHODS = {'random': 'Monte Carlo', 'lhs': 'Latin hypercube', 'sobol': 'Sobol'}
+REDUCTION_QUANTILES = [.995, .999]  # 1 in 200 and 1 in 1000 years
+REDUCTION_REPLICATIONS = 10  # Number of replications by method to estimate the variance reduction
+REDUCTION_YEARS = 20000  # Maximum number of years of the replications
+
+
+def get_uniforms(seed, generator, start, size, dimension=1, method='random'):
+    """ Draw the uniform random numbers of the chunk of a simulation.
+
+    :param seed: seed of the simulation, which sets the scrambling of the Sobol sequence
+    :param generator: generator of the chunk, see flaskapp.pricing.rng.get_chunk_generators
+    :param start: index of the first year of the chunk in the simulation
+    :return: array of shape (size, dimension) of uniform random numbers in [0, 1)
+    """
+    if method == 'random':
+        return generator.random((size, dimension))
+    if method == 'lhs':
+        # https://docs.scipy.org/doc/scipy/reference/generated/scipy.stats.qmc.LatinHypercube.html
+        return qmc.LatinHypercube(d=dimension, seed=generator).random(size)
+    if method == 'sobol':
+        # https://docs.scipy.org/doc/scipy/reference/generated/scipy.stats.qmc.Sobol.html
+        engine = qmc.Sobol(d=dimension, scramble=True, seed=np.random.default_rng(seed))
+        if start > 0:
+            engine.fast_forward(start)
+        with warnings.catch_warnings():
+            # The number of years is rarely a power of 2, which only weakens the balance of the last points
+            warnings.simplefilter('ignore', UserWarning)
+            return engine.random(size)
+    raise ValueError(f'The sampling method must be one of {", ".join(SAMPLING_METHODS)}')
+
+
+def get_statistics(loss_ratios, quantiles=REDUCTION_QUANTILES):
+    return np.concatenate([[np.mean(loss_ratios)], np.quantile(loss_ratios, quantiles)])
+
+
+def estimate_variance_reduction(simulate, method, seed, replications=REDUCTION_REPLICATIONS,
+                                quantiles=REDUCTION_QUANTILES):
+    """ Estimate the variance reduction of a sampling method compared with plain Monte Carlo.
+
+    :param simulate: function of (seed, method) returning an array of simulated loss ratios
+    :return: dictionary of the ratios of the Monte Carlo variance to the variance of the method, by statistic ('mean'
+    and the quantiles), i.e. the factor by which the method divides the number of years for the same precision
+    """
+    seeds = spawn_seeds(seed, replications)
+    variances = {
+        sampling: np.var([get_statistics(simulate(seed, sampling), quantiles) for seed in seeds], axis=0, ddof=1)
+        for sampling in ['random', method]
+    }
+    ratios = variances['random'] / np.maximum(variances[method], np.finfo(np.float64).tiny)
+    return dict(zip(['mean'] + [f'q{quantile}' for quantile in quantiles], ratios.tolist()))
@@ -0,0 +1,82 @@
+"""
+This module defines the scenario engine: parametric shocks applied to the YLT of a model file.
+
+A scenario is a set of shock parameters, not a copy of the year losses: the shocked YLTs are computed on demand from
+the YLT of the base model file, and a scenario is only written to the database when it is saved as a new model file
+(see flaskapp.pricing.columnar.set_modelfile_ylt).
+
+The shocks are applied in this order:
+1. Trend: all the loss ratios are multiplied by trend.
+2. Tail: the part of the loss ratios above the tail_quantile of the base YLT is multiplied by tail_multiplier, so that
+   the shocked loss ratio stays continuous at the threshold.
+3. Stress: the loss ratio of the year stress_year is multiplied by stress_factor.
+
+All the scenarios are evaluated at once, as (n_scenarios, n_years) arrays.
+
+Functions:
+- get_scenario_parameters(scenarios): Convert a list of scenario dictionaries into parameter arrays.
+- apply_scenarios(years, loss_ratios, parameters): Apply the shocks of several scenarios to a YLT.
+- get_ylt_statistics(loss_ratios, quantiles): Compute the OEP quantiles, mean and standard deviation of several YLTs.
+
+Dependencies:
+- numpy
+
+"""
+
+import numpy as np
+
+DEFAULT_PARAMETERS = {
+    'trend': 1.0,
+    'tail_quantile': 1.0,
+    'tail_multiplier': 1.0,
+    'stress_year': -1,  # No year
+    'stress_factor': 1.0,
+}
+
+
+def get_scenario_parameters(scenarios):
+    # Missing or empty parameters leave the YLT unchanged
+    return {
+        key: np.array([
+            default if scenario.get(key) in [None, ''] else float(scenario[key]) for scenario in scenarios
+        ], dtype=np.float64)
+        for key, default in DEFAULT_PARAMETERS.items()
+    }
+
+
+def apply_scenarios(years, loss_ratios, parameters):
+    """ Apply the shocks of several scenarios to the YLT of a model file.
+
+    :param years: array of shape (n_years,)
+    :param loss_ratios: array of shape (n_years,)
+    :param parameters: dictionary of (n_scenarios,) arrays, see get_scenario_parameters
+    :return: array of shape (n_scenarios, n_years) of shocked loss ratios
+    """
+    years = np.asarray(years, dtype=np.int64)
+    loss_ratios = np.asarray(loss_ratios, dtype=np.float64)
+    column = {key: np.asarray(value, dtype=np.float64)[:, np.newaxis] for key, value in parameters.items()}
+
+    shocked = loss_ratios[np.newaxis, :] * column['trend']
+
+    # The thresholds are quantiles of the base YLT, trended, so that a scenario is independent of the others
+    threshold = np.quantile(loss_ratios, np.clip(parameters['tail_quantile'], 0, 1))[:, np.newaxis] * column['trend']
+    excess = np.maximum(0, shocked - threshold)
+    shocked += excess * (column['tail_multiplier'] - 1)
+
+    shocked *= np.where(years[np.newaxis, :] == column['stress_year'], column['stress_factor'], 1)
+
+    return shocked
+
+
+def get_ylt_statistics(loss_ratios, quantiles):
+    """ Compute the statistics of several YLTs with the same years.
+
+    :param loss_ratios: array of shape (n_ylts, n_years)
+    :return: dictionary with 'quantiles' of shape (n_quantiles, n_ylts), 'mean' and 'std' of shape (n_ylts,)
+    """
+    loss_ratios = np.asarray(loss_ratios, dtype=np.float64)
+    return {
+        'quantiles': np.quantile(loss_ratios, quantiles, axis=1),
+        'mean': loss_ratios.mean(axis=1),
+        'std': loss_ratios.std(axis=1, ddof=1),  # As pandas, used by get_df_oep_summary
+    }
@@ -0,0 +1,107 @@
+"""
+This module defines the sensitivity of a stop loss layer to its terms: the statistics of the ceded loss ratio are
+computed for every combination of a range of deductibles and a range of limits.
+
+The ceded loss ratio min(limit, max(0, loss ratio - deductible)) is a non-decreasing function of the annual loss
+ratio. The loss ratios are sorted once, then every statistic of the grid comes from the sorted values and their
+cumulative sums, broadcast over (n_deducts, n_limits) arrays:
+- E[max(0, X - t)] = (sum of the x > t - t * number of x > t) / n_years, for t = deductible and deductible + limit
+- the second moment is obtained in the same way from the cumulative sums of x and x ** 2
+- the quantiles of the ceded loss ratio are the ceded loss ratios of the quantiles of X
+The cost of the grid therefore does not depend on the number of years once the loss ratios are sorted: a grid of
+100 x 100 terms over 100k years is computed in milliseconds, without allocating (n_deducts, n_limits, n_years)
+arrays.
+
+Conventions:
+- The deductibles and limits are expressed in % of the subject premium, as the layer terms.
+- The returned statistics are ceded loss ratios in % of the subject premium.
+
+Functions:
+- get_sensitivity_grid(loss_ratios, agg_deducts, agg_limits, quantiles): Compute the statistics of the ceded loss
+  ratio for every combination of terms.
+- get_df_sensitivity(grid): Convert a sensitivity grid into a long DataFrame, one row per combination of terms.
+
+Dependencies:
+- numpy
+- pandas
+
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def get_sensitivity_grid(loss_ratios, agg_deducts, agg_limits, quantiles):
+    """ Compute the statistics of the ceded loss ratio for every combination of deductible and limit.
+
+    :param loss_ratios: array of shape (n_years,), annual loss ratios of the layer (as fractions)
+    :param agg_deducts: array of shape (n_deducts,), in %
+    :param agg_limits: array of shape (n_limits,), in %
+    :param quantiles: list of the probabilities of the quantiles to compute, usually
+        flaskapp.pricing.statistics.get_quantiles
+    :return: dictionary with the agg_deducts and agg_limits, and (n_deducts, n_limits) arrays for the
+        'expected', 'std', 'attachment_probability', 'exhaustion_probability' and each quantile ('q0.99', ...)
+    """
+    x = np.sort(np.asarray(loss_ratios, dtype=np.float64))
+    n_years = len(x)
+    if n_years == 0:
+        raise ValueError('The YLT is empty')
+
+    agg_deducts = np.asarray(agg_deducts, dtype=np.float64)
+    agg_limits = np.asarray(agg_limits, dtype=np.float64)
+    deduct = agg_deducts[:, np.newaxis] / 100  # (n_deducts, 1)
+    limit = agg_limits[np.newaxis, :] / 100  # (1, n_limits)
+    exhaust = deduct + limit  # (n_deducts, n_limits)
+
+    # Sums of x and x ** 2 over the years with x > t, from the cumulative sums
+    sum1 = np.r_[0, np.cumsum(x)]
+    sum2 = np.r_[0, np.cumsum(x ** 2)]
+
+    def tail(t):
+        below = np.searchsorted(x, t, side='right')
+        return n_years - below, sum1[-1] - sum1[below], sum2[-1] - sum2[below]
+
+    n_d, s1_d, s2_d = tail(deduct)
+    n_e, s1_e, s2_e = tail(exhaust)
+
+    # Ceded = x - d for d < x <= d + l, and l for x > d + l
+    n_layer = n_d - n_e
+    s1_layer = s1_d - s1_e
+    s2_layer = s2_d - s2_e
+    expected = (s1_layer - deduct * n_layer + limit * n_e) / n_years
+    second_moment = (s2_layer - 2 * deduct * s1_layer + deduct ** 2 * n_layer + limit ** 2 * n_e) / n_years
+    # Sample standard deviation (ddof=1), as the statistics of the result layers, see flaskapp.pricing.statistics
+    variance = np.maximum(0, second_moment - expected ** 2)
+    if n_years > 1:
+        variance *= n_years / (n_years - 1)
+    std = np.sqrt(variance)
+
+    grid = {
+        'agg_deducts': agg_deducts,
+        'agg_limits': agg_limits,
+        'expected': 100 * expected,
+        'std': 100 * std,
+        'attachment_probability': np.broadcast_to(n_d / n_years, exhaust.shape),
+        'exhaustion_probability': n_e / n_years,
+    }
+
+    # Linear interpolation between the order statistics, as np.quantile, applied to the ceded loss ratios
+    for q in quantiles:
+        position = q * (n_years - 1)
+        lower = int(np.floor(position))
+        upper = min(lower + 1, n_years - 1)
+        weight = position - lower
+        ceded_lower = np.minimum(limit, np.maximum(0, x[lower] - deduct))
+        ceded_upper = np.minimum(limit, np.maximum(0, x[upper] - deduct))
+        grid[f'q{q}'] = 100 * ((1 - weight) * ceded_lower + weight * ceded_upper)
+
+    return grid
+
+
+def get_df_sensitivity(grid):
+    agg_deduct, agg_limit = np.meshgrid(grid['agg_deducts'], grid['agg_limits'], indexing='ij')
+    df = pd.DataFrame({'agg_deduct': agg_deduct.ravel(), 'agg_limit': agg_limit.ravel()})
+    for key, value in grid.items():
+        if key not in ['agg_deducts', 'agg_limits']:
+            df[key] = np.asarray(value).ravel()
+    return df
@@ -0,0 +1,84 @@
+"""
+This module defines the simulation of the YLT of a loss model fitted on the experience.
+
+The years are simulated by chunks of chunk_size through the inverse cumulative distribution function (ppf) of the
+fitted scipy distribution. Each chunk draws its uniform random numbers from its own generator, derived from the seed
+of the model file (see flaskapp.pricing.rng), so that a YLT can be simulated again exactly and the chunks can be
+simulated in parallel threads. The uniform random numbers are drawn with the sampling method of the model file: plain
+Monte Carlo, Latin hypercube or Sobol (see flaskapp.pricing.sampling).
+
+The chunks are written into one preallocated array of loss ratios, then saved once in the shared YLT storage of
+flaskapp.pricing.columnar: the memory used is 8 bytes by simulated year, without intermediate DataFrame or ORM objects,
+so that 100k to 1M years can be simulated by the web workers.
+
+Functions:
+- simulate_chunks(distribution, n_years, seed, chunk_size, workers, method): Generate the simulated years and loss
+  ratios by chunks.
+- simulate_modelfile(modelfile, distribution, n_years, seed, chunk_size, workers, method): Simulate and save the YLT
+  of a model file.
+- get_variance_reduction(distribution, n_years, seed, method): Estimate the variance reduction of a sampling method.
+
+Dependencies:
+- numpy
+- scipy
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from flaskapp.pricing.columnar import set_modelfile_ylt
+from flaskapp.pricing.rng import get_chunk_generators
+from flaskapp.pricing.sampling import get_uniforms, estimate_variance_reduction, REDUCTION_YEARS
+import numpy as np
+
+SIMULATION_CHUNK_SIZE = 100_000  # Number of years simulated at once
+
+
+def simulate_chunks(distribution, n_years, seed, chunk_size=SIMULATION_CHUNK_SIZE, workers=1, method='random'):
+    # The generators depend on the number of chunks only, not on the number of workers
+    starts = range(0, n_years, chunk_size)
+    generators = get_chunk_generators(seed, len(starts))
+
+    def simulate(start, generator):
+        size = min(chunk_size, n_years - start)
+        uniforms = get_uniforms(seed, generator, start, size, method=method)[:, 0]
+        return np.arange(start + 1, start + size + 1), distribution.ppf(uniforms)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(simulate, starts, generators)
+
+
+def simulate_modelfile(modelfile, distribution, n_years, seed, chunk_size=SIMULATION_CHUNK_SIZE, workers=1,
+                       method='random'):
+    """ Simulate the YLT of a model file and save it, the model file being already added to the session.
+
+    :param distribution: frozen scipy distribution of the annual loss ratio, e.g. lognorm(s=s, scale=scale)
+    :param seed: seed of the simulation, stored in the model file, see flaskapp.pricing.rng
+    :param method: sampling method, stored in the model file, see flaskapp.pricing.sampling
+    :return: (years, loss_ratios) arrays of shape (n_years,)
+    """
+    if n_years < 1:
+        raise ValueError('The number of simulated years must be positive')
+
+    years = np.arange(1, n_years + 1)
+    loss_ratios = np.empty(n_years, dtype=np.float64)
+    for chunk_years, chunk_loss_ratios in simulate_chunks(distribution, n_years, seed, chunk_size, workers, method):
+        loss_ratios[chunk_years - 1] = chunk_loss_ratios
+
+    modelfile.n_years = n_years
+    modelfile.seed = seed
+    modelfile.sampling = method
+    set_modelfile_ylt(modelfile, years, loss_ratios)
+    return years, loss_ratios
+
+
+def get_variance_reduction(distribution, n_years, seed, method):
+    # The replications are shorter than the simulation for large numbers of years
+    n_replication_years = min(n_years, REDUCTION_YEARS)
+
+    def simulate(replication_seed, sampling):
+        return np.concatenate([
+            loss_ratios for years, loss_ratios
+            in simulate_chunks(distribution, n_replication_years, replication_seed, method=sampling)
+        ])
+
+    return estimate_variance_reduction(simulate, method, seed)
@@ -0,0 +1,402 @@
+"""
+This module defines the result statistics materialized when a result file is processed.
+
+Functions:
+- get_quantiles(): Get the configured quantiles of the result statistics.
+- get_tail_counts(n_years, quantiles): Get the numbers of worst years averaged by the tail values at risk.
+- get_tvar(values, quantiles): Compute the tail values at risk of a YLT.
+- pack_statistics(quantiles, n_years, mean, std, quantile_values, tvars, standard_errors, model_ids, pure_premiums):
+  Gather the statistics of a result layer.
+- get_statistics(model_ids, years, ceded, quantiles, independent): Compute the statistics of the ceded amounts of a
+  result layer.
+- set_statistics(resultlayer, statistics): Save the statistics of a result layer.
+- set_resultlayer_statistics(resultlayer, model_ids, years, ceded): Compute and save the statistics of a result layer.
+- use_sql_aggregation(): Tell if the statistics of the stored YLTs can be aggregated in the database.
+- get_layer_kinds(resultlayers): Group result layers by class.
+- get_sql_yearlosses(resultlayers, *columns, group_by): Aggregate the year losses of result layers in the database.
+- get_sql_statistics(resultlayers, quantiles): Compute the statistics of result layers in PostgreSQL.
+- save_resultlayer_statistics(resultlayer): Compute and save the statistics of a result layer from its stored YLT, in
+  Python.
+- save_resultlayers_statistics(resultlayers): Compute and save the statistics of result layers from their stored YLTs.
+- copy_resultlayer_statistics(source, target, resultmodelfile_map): Copy the statistics of a result layer.
+- get_resultlayer_statistics(resultlayer): Get the saved statistics of a result layer.
+- get_resultlayer_version(resultlayer): Get the version of a result layer for the cache keys.
+- get_resultlayer_convergence(resultlayer, confidence): Get the simulation error diagnostics of a result layer from its
+  saved statistics.
+
+Dependencies:
+- numpy
+- scipy
+
+"""
+
+from flask import current_app
+from flaskapp.extensions import session, select
+from flaskapp.models import *
+from flaskapp.pricing.columnar import get_resultlayer_ylt, get_yearloss_model
+from flaskapp.pricing.convergence import get_standard_errors, get_batch_quantiles, has_independent_years, N_BATCHES, \
+    CONFIDENCE, MIN_BATCH_YEARS, INDEPENDENCE_ERROR
+from scipy import stats
+from sqlalchemy import Float, Numeric, case, cast, func, literal, tuple_, union_all
+from sqlalchemy.dialects import postgresql
+import hashlib
+import numpy as np
+
+QUANTILES = [.999, .998, .996, .995, .99, .98, .9667, .96, .95, .9, .8, .5]  # Default of RESULT_QUANTILES
+
+
+def get_quantiles():
+    return current_app.config.get('RESULT_QUANTILES', QUANTILES)
+
+
+def get_tail_counts(n_years, quantiles):
+    # ceil(n_years * (1 - quantile)) worst years, at least one
+    # Round before ceil so that e.g. 1000 * (1 - 0.999) counts 1 year, not 2
+    return np.clip(np.ceil(np.round(n_years * (1 - np.asarray(quantiles)), 9)), 1, n_years).astype(np.int64)
+
+
+def get_tvar(values, quantiles):
+    """ Compute the tail values at risk of a YLT, the means of its worst years.
+
+    :return: array of shape (n_quantiles,), the mean of the get_tail_counts largest values
+    """
+    tail_sums = np.cumsum(np.sort(values)[::-1])
+    counts = get_tail_counts(len(values), quantiles)
+    return tail_sums[counts - 1] / counts
+
+
+def pack_statistics(quantiles, n_years, mean, std, quantile_values, tvars, standard_errors, model_ids, pure_premiums):
+    """ Gather the statistics of a result layer in the format saved by set_statistics.
+
+    :param standard_errors: standard errors of the mean, the standard deviation and the quantiles, or None if unknown
+    :return: dictionary with the 'statistics' names and their 'values' and 'standard_errors' (None if unknown), and
+    the 'model_ids' with their 'pure_premiums'
+    """
+    if n_years == 0:
+        # Saved anyway, so that the layer is not taken for a layer saved before its statistics
+        return {'statistics': ['n_years'], 'values': [0], 'standard_errors': [None],
+                'model_ids': [], 'pure_premiums': []}
+
+    if standard_errors is None:
+        standard_errors = [None] * (2 + len(quantiles))
+    return {
+        'statistics': ['n_years', 'mean', 'std'] + [f'q{quantile}' for quantile in quantiles]
+                      + [f'tvar{quantile}' for quantile in quantiles],
+        'values': [float(n_years), float(mean), float(std)] + [float(value) for value in quantile_values]
+                  + [float(value) for value in tvars],
+        'standard_errors': [None] + list(standard_errors) + [None] * len(quantiles),
+        'model_ids': [int(model_id) for model_id in model_ids],
+        'pure_premiums': [float(pure_premium) for pure_premium in pure_premiums],
+    }
+
+
+def get_statistics(model_ids, years, ceded, quantiles, independent=True):
+    """ Compute the statistics of the ceded amounts of a result layer, given by model file and year.
+
+    :param independent: False if the simulated years are not independent, see
+        flaskapp.pricing.convergence.has_independent_years, in which case there is no standard error
+    :return: dictionary of pack_statistics
+    """
+    ceded = np.asarray(ceded, dtype=np.float64)
+    if len(ceded) == 0:
+        return pack_statistics(quantiles, 0, 0, 0, [], [], None, [], [])
+
+    # Sum the ceded amounts of the model files by year, then average them by model file over its simulated years
+    unique_years, year_index = np.unique(years, return_inverse=True)
+    annual_ceded = np.bincount(year_index, weights=ceded, minlength=len(unique_years))
+    unique_model_ids, model_index = np.unique(model_ids, return_inverse=True)
+    pure_premiums = np.bincount(model_index, weights=ceded) / np.bincount(model_index)
+
+    standard_errors = None
+    if independent:
+        try:
+            errors = get_standard_errors(annual_ceded[np.newaxis], quantiles, N_BATCHES)
+            # None for the quantiles with too small batches
+            standard_errors = [None if np.isnan(value) else value for value in errors['standard_error'][:, 0].tolist()]
+        except ValueError:
+            pass  # Too few years, see get_standard_errors
+
+    return pack_statistics(
+        quantiles,
+        n_years=len(annual_ceded),
+        mean=annual_ceded.mean(),
+        std=annual_ceded.std(ddof=1) if len(annual_ceded) > 1 else 0,
+        quantile_values=np.quantile(annual_ceded, quantiles),
+        tvars=get_tvar(annual_ceded, quantiles),
+        standard_errors=standard_errors,
+        model_ids=unique_model_ids,
+        pure_premiums=pure_premiums,
+    )
+
+
+def set_statistics(resultlayer, statistics):
+    # Replace the saved statistics of a result layer with a dictionary of pack_statistics
+    resultlayer.stats = [
+        ResultLayerStats(statistic=statistic, value=value, standard_error=standard_error)
+        for statistic, value, standard_error
+        in zip(statistics['statistics'], statistics['values'], statistics['standard_errors'])
+    ]
+    resultlayer.modelstats = [
+        ResultModelStats(resultmodelfile_id=model_id, pure_premium=pure_premium)
+        for model_id, pure_premium in zip(statistics['model_ids'], statistics['pure_premiums'])
+    ]
+
+
+def set_resultlayer_statistics(resultlayer, model_ids, years, ceded):
+    """ Save the statistics of a result layer, replacing the previous ones.
+
+    :param model_ids: array of the ResultModelFile ids of the rows of the YLT
+    """
+    set_statistics(resultlayer, get_statistics(model_ids, years, ceded, get_quantiles(),
+                                               independent=has_independent_years(resultlayer)))
+
+
+def use_sql_aggregation():
+    # percentile_cont and stddev_samp are not available in SQLite
+    return session.get_bind().dialect.name == 'postgresql'
+
+
+def get_layer_kinds(resultlayers):
+    # Stop loss and excess of loss result layers, which have their own year loss tables
+    kinds = {}
+    for resultlayer in resultlayers:
+        kinds.setdefault(type(resultlayer), []).append(resultlayer)
+    return kinds
+
+
+def get_sql_yearlosses(resultlayers, *columns, group_by):
+    """ Union of the aggregated year losses of stop loss and excess of loss result layers.
+
+    :param columns: functions of the year loss model returning the labelled columns to select
+    :param group_by: functions of the year loss model returning the columns to group by, after the layer id
+    """
+    queries = []
+    for resultlayer_model, layers in get_layer_kinds(resultlayers).items():
+        yearloss_model, foreign_key = get_yearloss_model(layers[0])
+        layer_id = getattr(yearloss_model, foreign_key)
+        queries.append(
+            select(
+                literal(resultlayer_model.__name__).label('kind'),
+                layer_id.label('layer_id'),
+                *[column(yearloss_model) for column in columns],
+            )
+            .where(layer_id.in_([layer.id for layer in layers]))
+            .group_by(layer_id, *[column(yearloss_model) for column in group_by])
+        )
+    return union_all(*queries).subquery() if len(queries) > 1 else queries[0].subquery()
+
+
+def get_sql_statistics(resultlayers, quantiles):
+    """ Compute the statistics of result layers stored as rows in PostgreSQL, aggregating the year losses in the
+    database so that only the statistics are sent to Python.
+
+    The statistics of all the layers are computed in one query, the batches of the standard errors (see
+    flaskapp.pricing.convergence) and the pure premiums of the model files in one query each. Only the layers with
+    independent years get standard errors.
+
+    :return: dictionary {(class name, result layer id): dictionary of pack_statistics}
+    """
+    # Annual ceded amounts, with the rank of each year in the tail and its position by year for the batches
+    annual = get_sql_yearlosses(
+        resultlayers,
+        lambda model: model.year.label('year'),
+        lambda model: func.sum(model.ceded).label('ceded'),
+        group_by=[lambda model: model.year],
+    )
+    layer = (annual.c.kind, annual.c.layer_id)
+    ranked = select(
+        *layer,
+        cast(annual.c.ceded, Float).label('ceded'),
+        func.row_number().over(partition_by=layer, order_by=annual.c.ceded.desc()).label('tail_rank'),
+        (func.row_number().over(partition_by=layer, order_by=annual.c.year) - 1).label('position'),
+        func.count().over(partition_by=layer).label('n_years'),
+    ).subquery()
+    layer = (ranked.c.kind, ranked.c.layer_id)
+
+    # https://www.postgresql.org/docs/current/functions-aggregate.html#FUNCTIONS-ORDEREDSET-TABLE
+    # percentile_cont interpolates linearly between the closest years, as np.quantile
+    quantile_array = cast(postgresql.array([float(quantile) for quantile in quantiles]), postgresql.ARRAY(Float))
+    # Cast to float, so that the TVaR divides a float by a float rather than relying on the implicit cast of numeric
+    tail_counts = [
+        cast(func.greatest(func.ceil(func.round(cast(ranked.c.n_years * (1 - quantile), Numeric), 9)), 1), Float)
+        for quantile in quantiles
+    ]  # As get_tail_counts
+    query = select(
+        *layer,
+        func.count().label('n_years'),
+        func.avg(ranked.c.ceded).label('mean'),
+        func.coalesce(func.stddev_samp(ranked.c.ceded), 0).label('std'),
+        func.percentile_cont(quantile_array).within_group(ranked.c.ceded).label('quantiles'),
+        *[
+            (func.sum(case((ranked.c.tail_rank <= tail_count, ranked.c.ceded), else_=0)) / func.max(tail_count))
+            .label(f'tvar_{k}')
+            for k, tail_count in enumerate(tail_counts)
+        ],
+    ).group_by(*layer)
+
+    # Statistics of the batches of interleaved years, the last years fewer than N_BATCHES left out, as
+    # get_standard_errors
+    independent = [(type(resultlayer).__name__, resultlayer.id) for resultlayer in resultlayers
+                   if has_independent_years(resultlayer)]
+    batch = (ranked.c.position % N_BATCHES).label('batch')
+    batch_query = select(
+        *layer,
+        batch,
+        func.avg(ranked.c.ceded).label('mean'),
+        func.stddev_samp(ranked.c.ceded).label('std'),
+        func.percentile_cont(quantile_array).within_group(ranked.c.ceded).label('quantiles'),
+    ).where(
+        ranked.c.n_years >= N_BATCHES * MIN_BATCH_YEARS,
+        ranked.c.position < N_BATCHES * (ranked.c.n_years // N_BATCHES),
+        tuple_(*layer).in_(independent),
+    ).group_by(*layer, batch)
+
+    pure_premiums = get_sql_yearlosses(
+        resultlayers,
+        lambda model: model.model_id.label('model_id'),
+        lambda model: func.avg(model.ceded).label('pure_premium'),
+        group_by=[lambda model: model.model_id],
+    )
+    pure_premium_query = select(pure_premiums).order_by(pure_premiums.c.kind, pure_premiums.c.layer_id,
+                                                         pure_premiums.c.model_id)
+
+    batches = {}
+    for row in session.execute(batch_query) if independent else []:
+        batches.setdefault((row.kind, row.layer_id), []).append([row.mean, row.std] + list(row.quantiles))
+    models = {}
+    for row in session.execute(pure_premium_query):
+        models.setdefault((row.kind, row.layer_id), []).append((row.model_id, row.pure_premium))
+
+    statistics = {}
+    for row in session.execute(query):
+        key = (row.kind, row.layer_id)
+        standard_errors = None
+        if key in batches:
+            standard_errors = np.std(np.array(batches[key], dtype=np.float64), axis=0, ddof=1) / np.sqrt(N_BATCHES)
+            standard_errors[2:][~get_batch_quantiles(row.n_years // N_BATCHES, quantiles)] = np.nan
+            standard_errors = [None if np.isnan(value) else value for value in standard_errors.tolist()]
+        statistics[key] = pack_statistics(
+            quantiles,
+            n_years=row.n_years,
+            mean=row.mean,
+            std=row.std,
+            quantile_values=row.quantiles,
+            tvars=[getattr(row, f'tvar_{k}') for k in range(len(quantiles))],
+            standard_errors=standard_errors,
+            model_ids=[model_id for model_id, _ in models.get(key, [])],
+            pure_premiums=[pure_premium for _, pure_premium in models.get(key, [])],
+        )
+    return statistics
+
+
+def save_resultlayer_statistics(resultlayer):
+    # Loads the whole YLT of the result layer, see save_resultlayers_statistics
+    ylt = get_resultlayer_ylt(resultlayer)
+    set_resultlayer_statistics(resultlayer, ylt['model_id'], ylt['year'], ylt['ceded'])
+
+
+def save_resultlayers_statistics(resultlayers):
+    """ Compute and save the statistics of result layers from their stored YLTs, e.g. for the result layers saved
+    before their statistics.
+
+    In PostgreSQL, the statistics of the layers stored as rows are aggregated in the database, see get_sql_statistics.
+    The YLTs of the other layers are loaded in Python.
+    """
+    sql_statistics = {}
+    if use_sql_aggregation():
+        # Query the storage mode rather than loading the deferred ylt column of each layer
+        row_layers = []
+        for resultlayer_model, layers in get_layer_kinds(resultlayers).items():
+            ids = set(session.scalars(
+                select(resultlayer_model.id)
+                .where(resultlayer_model.id.in_([layer.id for layer in layers]), resultlayer_model.ylt.is_(None))
+            ))
+            row_layers += [layer for layer in layers if layer.id in ids]
+        if row_layers:
+            sql_statistics = get_sql_statistics(row_layers, get_quantiles())
+        empty = pack_statistics(get_quantiles(), 0, 0, 0, [], [], None, [], [])
+        sql_statistics |= {(type(layer).__name__, layer.id): sql_statistics.get((type(layer).__name__, layer.id), empty)
+                           for layer in row_layers}  # The layers without year loss have no row in the result
+
+    for resultlayer in resultlayers:
+        key = (type(resultlayer).__name__, resultlayer.id)
+        if key in sql_statistics:
+            set_statistics(resultlayer, sql_statistics[key])
+        else:
+            save_resultlayer_statistics(resultlayer)
+
+
+def copy_resultlayer_statistics(source, target, resultmodelfile_map):
+    """ Copy the statistics of a result layer, e.g. reused from a previous result file.
+
+    :param resultmodelfile_map: dictionary {source ResultModelFile id: target ResultModelFile}, see
+        flaskapp.pricing.columnar.copy_resultlayer_ylt
+    :return: False if the source has no saved statistics
+    """
+    if not source.stats:
+        return False
+    target.stats = [
+        ResultLayerStats(statistic=stat.statistic, value=stat.value, standard_error=stat.standard_error)
+        for stat in source.stats
+    ]
+    target.modelstats = [
+        ResultModelStats(resultmodelfile_id=resultmodelfile_map[modelstat.resultmodelfile_id].id,
+                         pure_premium=modelstat.pure_premium)
+        for modelstat in source.modelstats
+    ]
+    return True
+
+
+def get_resultlayer_statistics(resultlayer):
+    """ Get the saved statistics of a result layer.
+
+    :return: tuple of dictionaries ({statistic: value}, {statistic: standard error}, {ResultModelFile id: pure
+    premium})
+    """
+    return (
+        {stat.statistic: stat.value for stat in resultlayer.stats},
+        {stat.statistic: stat.standard_error for stat in resultlayer.stats},
+        {modelstat.resultmodelfile_id: modelstat.pure_premium for modelstat in resultlayer.modelstats},
+    )
+
+
+def get_resultlayer_version(resultlayer):
+    # Hash of the layer and of its saved statistics, which change with its year losses
+    sha = hashlib.sha256()
+    sha.update(f'{type(resultlayer).__name__} {resultlayer.id} {resultlayer.name}'.encode())
+    for stat in resultlayer.stats:
+        sha.update(f'{stat.statistic} {stat.value!r}'.encode())
+    return sha.hexdigest()
+
+
+def get_resultlayer_convergence(resultlayer, confidence=CONFIDENCE):
+    """ Get the simulation error diagnostics of a result layer from its saved statistics.
+
+    :return: dictionary as in flaskapp.pricing.convergence.get_resultlayers_convergence, with lists instead of arrays
+    """
+    values, standard_errors, _ = get_resultlayer_statistics(resultlayer)
+    n_years = int(values.get('n_years', 0))
+    # Also checked here for the statistics saved before the sampling methods and batch sizes were taken into account
+    if not has_independent_years(resultlayer):
+        return {'name': resultlayer.name, 'n_years': n_years, 'error': INDEPENDENCE_ERROR}
+
+    # The quantiles with too small batches have no standard error, see flaskapp.pricing.convergence
+    statistics = [statistic for statistic in values if statistic in ['mean', 'std'] or statistic.startswith('q')]
+    if standard_errors.get('mean') is None:
+        return {'name': resultlayer.name, 'n_years': n_years,
+                'error': f'The simulation error needs at least {N_BATCHES * MIN_BATCH_YEARS} simulated years'}
+    statistics = [statistic for statistic in statistics if standard_errors[statistic] is not None and (
+        not statistic.startswith('q') or get_batch_quantiles(n_years // N_BATCHES, float(statistic[1:])))]
+
+    estimate = np.array([values[statistic] for statistic in statistics])
+    standard_error = np.array([standard_errors[statistic] for statistic in statistics])
+    half_width = stats.t.ppf((1 + confidence) / 2, N_BATCHES - 1) * standard_error
+    return {
+        'name': resultlayer.name,
+        'n_years': n_years,
+        'statistics': statistics,
+        'estimate': estimate.tolist(),
+        'standard_error': standard_error.tolist(),
+        'lower': (estimate - half_width).tolist(),
+        'upper': (estimate + half_width).tolist(),
+    }
@@ -0,0 +1,96 @@
+"""
+This module defines the vectorized stop loss pricing engine.
+
+The engine works on plain NumPy arrays and has no knowledge of the ORM: the callers load the model year loss
+tables (YLTs) and the layer terms, call the engine, and persist the returned arrays.
+
+Conventions:
+- The layer premium is the subject premium, the loss ratios are expressed as fractions of it.
+- The layer agg_limit and agg_deduct are expressed in % of the subject premium, as entered in the layers page.
+- The ceded amount of a year is allocated to the model files of the layer pro rata to their gross loss.
+
+Functions:
+- align_yearlosses(ylts): Put the YLTs of several model files on a common year axis.
+- get_ceded_loss_ratio(loss_ratio, agg_limit, agg_deduct): Apply the aggregate terms to annual loss ratios.
+- price_stoploss(premium, agg_limit, agg_deduct, links, loss_ratios): Price all the layers and years at once.
+
+Dependencies:
+- numpy
+
+"""
+
+import numpy as np
+
+
+def align_yearlosses(ylts):
+    """ Align the YLTs of several model files on the union of their simulated years.
+
+    :param ylts: list of (years, loss_ratios) pairs, one per model file
+    :return: (years, loss_ratios) where years has shape (n_years,) and loss_ratios has shape (n_models, n_years),
+        with a zero loss ratio for the years missing from a model file
+    """
+    if not ylts:
+        return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float64)
+
+    years = np.unique(np.concatenate([np.asarray(ylt[0], dtype=np.int64) for ylt in ylts]))
+    loss_ratios = np.zeros((len(ylts), len(years)), dtype=np.float64)
+
+    for i, (model_years, model_loss_ratios) in enumerate(ylts):
+        index = np.searchsorted(years, np.asarray(model_years, dtype=np.int64))
+        # Use np.add.at rather than a fancy assignment so that repeated years are summed, not overwritten
+        np.add.at(loss_ratios[i], index, np.asarray(model_loss_ratios, dtype=np.float64))
+
+    return years, loss_ratios
+
+
+def get_ceded_loss_ratio(loss_ratio, agg_limit, agg_deduct):
+    # Stop loss recovery: min(limit, max(0, loss ratio - deductible)), with the terms entered in %
+    agg_limit = np.asarray(agg_limit, dtype=np.float64) / 100
+    agg_deduct = np.asarray(agg_deduct, dtype=np.float64) / 100
+    return np.minimum(agg_limit, np.maximum(0, loss_ratio - agg_deduct))
+
+
+def price_stoploss(premium, agg_limit, agg_deduct, links, loss_ratios):
+    """ Price a set of stop loss layers over aligned model YLTs.
+
+    :param premium: array of shape (n_layers,)
+    :param agg_limit: array of shape (n_layers,), in % of the premium
+    :param agg_deduct: array of shape (n_layers,), in % of the premium
+    :param links: boolean array of shape (n_layers, n_models), True when the model file is linked to the layer
+    :param loss_ratios: array of shape (n_models, n_years), as returned by align_yearlosses
+    :return: dictionary with
+        - 'loss_ratio', 'ceded_loss_ratio', 'ceded_ratio': (n_layers, n_years) arrays for the layers as a whole
+        - 'layer_index', 'model_index': (n_pairs,) arrays giving the linked layer-model file pairs
+        - 'gross', 'ceded', 'net': (n_pairs, n_years) arrays of amounts by linked pair and year
+    """
+    premium = np.asarray(premium, dtype=np.float64)
+    links = np.asarray(links, dtype=bool)
+    loss_ratios = np.asarray(loss_ratios, dtype=np.float64)
+
+    # Annual loss ratio of each layer = sum of the loss ratios of its model files
+    loss_ratio = links.astype(np.float64) @ loss_ratios
+    ceded_loss_ratio = get_ceded_loss_ratio(
+        loss_ratio,
+        np.asarray(agg_limit)[:, np.newaxis],
+        np.asarray(agg_deduct)[:, np.newaxis],
+    )
+
+    ceded_ratio = np.zeros_like(loss_ratio)
+    np.divide(ceded_loss_ratio, loss_ratio, out=ceded_ratio, where=loss_ratio != 0)
+
+    # Only the linked layer-model file pairs are computed, to avoid allocating n_layers x n_models x n_years arrays
+    layer_index, model_index = np.nonzero(links)
+    gross = premium[layer_index, np.newaxis] * loss_ratios[model_index]
+    ceded = gross * ceded_ratio[layer_index]
+    net = gross - ceded
+
+    return {
+        'loss_ratio': loss_ratio,
+        'ceded_loss_ratio': ceded_loss_ratio,
+        'ceded_ratio': ceded_ratio,
+        'layer_index': layer_index,
+        'model_index': model_index,
+        'gross': gross,
+        'ceded': ceded,
+        'net': net,
+    }
@@ -0,0 +1,178 @@
+"""
+This module defines the tail risk metrics of the result layers, computed from the sorted YLT of a layer.
+
+Functions:
+- get_tail_profile(model_ids, years, ceded, levels): Sort the YLT of a result layer into its tail profile.
+- get_resultlayer_tail_profile(resultlayer, levels): Get the tail profile of a result layer, from the cache if
+  possible.
+- get_return_levels(values, probabilities): Get the amounts exceeded with probabilities.
+- get_tail_values(tail_sums, levels): Get the tail values at risk at levels.
+- get_tail_contributions(profile, levels): Get the tail contributions of the model files at levels.
+- get_ep_curve(values, n_points): Get an exceedance probability curve, for a chart.
+- get_resultlayer_tail_metrics(resultlayer, levels, return_periods): Get the tail risk metrics of a result layer.
+
+Dependencies:
+- numpy
+
+"""
+
+from flaskapp.pricing.caching import get_disk_cache
+from flaskapp.pricing.columnar import get_resultlayer_ylt
+from flaskapp.pricing.statistics import get_tail_counts, get_resultlayer_version
+import numpy as np
+
+TAIL_CACHE_VERSION = 3  # Increment when the content of the cached tail profiles changes
+
+RETURN_PERIODS = [2, 5, 10, 20, 25, 50, 100, 200, 250, 500, 1000, 2000, 5000, 10000]
+EP_CURVE_POINTS = 200  # Points of the EP curves drawn in the results view
+
+
+def get_tail_profile(model_ids, years, ceded, levels):
+    """ Sort the YLT of a result layer, given by model file and year, into its tail profile.
+
+    :param levels: levels of the tail contributions, e.g. 0.99
+    :return: dictionary with the 'annual' ceded amounts in decreasing order and their cumulative sums 'tail_sums', the
+    'largest_model' amounts of the years in decreasing order, the 'tail_counts' of the levels in increasing order,
+    and the 'model_ids' with the sums 'model_tail_sums' of their ceded amounts over the worst years at each tail
+    count, array of shape (n_models, n_tail_counts)
+    """
+    ceded = np.asarray(ceded, dtype=np.float64)
+    unique_years, year_index = np.unique(years, return_inverse=True)
+    unique_model_ids, model_index = np.unique(model_ids, return_inverse=True)
+    annual = np.bincount(year_index, weights=ceded, minlength=len(unique_years))
+
+    # The largest ceded amount of a model file in each year, 0 for the years not simulated by any model file
+    largest_model = np.zeros(len(unique_years), dtype=np.float64)
+    np.maximum.at(largest_model, year_index, ceded)
+
+    # The one sort of the profile, stable so that the years with the same amount keep their order
+    order = np.argsort(-annual, kind='stable')
+    year_rank = np.empty_like(order)
+    year_rank[order] = np.arange(len(order))
+
+    # Sums of each model file over the worst years: the rows are sorted by model file and rank of their year, the sum
+    # over the count worst years is the cumulative sum of the rows of the model file ranked before count
+    tail_counts = np.unique(get_tail_counts(len(unique_years), levels)) if len(unique_years) \
+        else np.zeros(0, dtype=np.int64)
+    row_order = np.lexsort((year_rank[year_index], model_index))
+    row_rank = year_rank[year_index][row_order]
+    row_sums = np.r_[0, np.cumsum(ceded[row_order])]
+    bounds = np.searchsorted(model_index[row_order], np.arange(len(unique_model_ids) + 1))
+    model_tail_sums = np.zeros((len(unique_model_ids), len(tail_counts)), dtype=np.float64)
+    for m, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+        positions = start + np.searchsorted(row_rank[start:stop], tail_counts)
+        model_tail_sums[m] = row_sums[positions] - row_sums[start]
+
+    return {
+        'annual': annual[order],
+        'tail_sums': np.cumsum(annual[order]),
+        'largest_model': -np.sort(-largest_model),
+        'tail_counts': tail_counts,
+        'model_ids': unique_model_ids,
+        'model_tail_sums': model_tail_sums,
+    }
+
+
+def get_resultlayer_tail_profile(resultlayer, levels):
+    """ Get the tail profile of a result layer with the tail counts of levels, see get_tail_profile.
+
+    :param resultlayer: ResultLayer or ResultLayerXS
+    """
+    cache = get_disk_cache('TAIL_CACHE_DIR', 'TAIL_CACHE_SIZE_LIMIT')
+    key = ('profile', TAIL_CACHE_VERSION, type(resultlayer).__name__, resultlayer.id,
+           get_resultlayer_version(resultlayer))
+    profile = cache.get(key)
+    if profile is not None:
+        counts = get_tail_counts(len(profile['annual']), levels) if len(profile['annual']) else []
+        if np.isin(counts, profile['tail_counts']).all():
+            return profile
+        # Keep the tail counts of the previous levels with the new ones
+        levels = np.r_[levels, 1 - profile['tail_counts'] / len(profile['annual'])]
+
+    ylt = get_resultlayer_ylt(resultlayer)
+    profile = get_tail_profile(ylt['model_id'], ylt['year'], ylt['ceded'], levels)
+    cache.set(key, profile)
+    return profile
+
+
+def get_return_levels(values, probabilities):
+    """ Get the amounts exceeded with probabilities, the quantiles at 1 - probability interpolated as np.quantile.
+
+    :param values: annual amounts in decreasing order
+    :return: array of the amounts by probability
+    """
+    ascending = values[::-1]
+    positions = (1 - np.asarray(probabilities, dtype=np.float64)) * (len(values) - 1)
+    lower = np.clip(np.floor(positions).astype(np.int64), 0, len(values) - 1)
+    upper = np.minimum(lower + 1, len(values) - 1)
+    return ascending[lower] + (ascending[upper] - ascending[lower]) * (positions - lower)
+
+
+def get_tail_values(tail_sums, levels):
+    """ Get the tail values at risk at levels, the means of the worst years as get_tvar.
+
+    :param tail_sums: cumulative sums of the annual amounts in decreasing order
+    :return: array of the TVaRs by level
+    """
+    counts = get_tail_counts(len(tail_sums), levels)
+    return tail_sums[counts - 1] / counts
+
+
+def get_tail_contributions(profile, levels):
+    """ Get the tail contributions of the model files at levels, their mean ceded amounts over the worst years.
+
+    :param profile: tail profile of get_tail_profile, with the tail counts of the levels
+    :return: array of shape (n_models, n_levels), adding up to the TVaRs of the layer by level
+    """
+    counts = get_tail_counts(len(profile['annual']), levels)
+    return profile['model_tail_sums'][:, np.searchsorted(profile['tail_counts'], counts)] / counts
+
+
+def get_ep_curve(values, n_points=EP_CURVE_POINTS):
+    """ Get an exceedance probability curve at log-spaced probabilities, from one year to all the years.
+
+    :param values: annual amounts in decreasing order
+    :return: tuple of arrays (probabilities, amounts)
+    """
+    probabilities = np.unique(np.geomspace(1 / len(values), 1, n_points))
+    return probabilities, get_return_levels(values, probabilities)
+
+
+def get_resultlayer_tail_metrics(resultlayer, levels, return_periods=RETURN_PERIODS):
+    """ Get the tail risk metrics of a result layer.
+
+    :param levels: levels of the TVaRs and of the tail contributions, e.g. 0.99
+    :param return_periods: return periods of the EP curves, only the ones up to the number of years are kept
+    :return: dictionary with the 'n_years', the 'levels' with their 'var' (quantile) and 'tvar', the 'model_ids' with
+    their 'contributions' by level, the 'return_periods' with the 'aep' and 'largest_model' amounts and the 'tvar'
+    at 1 - 1 / return period, and the 'ep_curve' probabilities with the 'aep' and 'largest_model' amounts. Empty if
+    the layer has no year losses
+    """
+    profile = get_resultlayer_tail_profile(resultlayer, levels)
+    n_years = len(profile['annual'])
+    if n_years == 0:
+        return {'n_years': 0}
+
+    levels = np.asarray(levels, dtype=np.float64)
+    return_periods = np.array([period for period in return_periods if period <= n_years], dtype=np.float64)
+    probabilities, aep_curve = get_ep_curve(profile['annual'])
+
+    return {
+        'n_years': n_years,
+        'levels': levels.tolist(),
+        'var': get_return_levels(profile['annual'], 1 - levels).tolist(),
+        'tvar': get_tail_values(profile['tail_sums'], levels).tolist(),
+        'model_ids': profile['model_ids'].tolist(),
+        'contributions': get_tail_contributions(profile, levels).tolist(),
+        'return_periods': {
+            'return_period': return_periods.tolist(),
+            'aep': get_return_levels(profile['annual'], 1 / return_periods).tolist(),
+            'largest_model': get_return_levels(profile['largest_model'], 1 / return_periods).tolist(),
+            'tvar': get_tail_values(profile['tail_sums'], 1 - 1 / return_periods).tolist(),
+        },
+        'ep_curve': {
+            'probability': probabilities.tolist(),
+            'aep': aep_curve.tolist(),
+            'largest_model': get_return_levels(profile['largest_model'], probabilities).tolist(),
+        },
+    }
@@ -0,0 +1,158 @@
+"""
+This module defines the vectorized occurrence excess of loss pricing engine.
+
+Like flaskapp.pricing.stoploss, the engine works on plain NumPy arrays and has no knowledge of the ORM. Its inputs
+are the event loss tables (ELTs) of the model files: one row per simulated event, with the year of the event and its
+loss amount, and the number of years simulated by each model file. The years without any event are simulated years
+with no loss: the year axis of the layers is every simulated year, so that the statistics of the results are not
+computed over the years with an event only.
+
+The pricing of a layer is done in three steps:
+1. The occurrence terms are applied to each event: min(occ_limit, max(0, loss - occ_deduct)).
+2. The event recoveries are summed by year. The events are sorted by year, so that the events of a year are
+   contiguous and the sums are segmented reductions (np.add.reduceat) rather than Python loops.
+3. The aggregate terms are applied to the annual recoveries: min(agg_limit, max(0, recovery - agg_deduct)).
+
+The events are processed in chunks of chunk_size, so that the temporary (n_layers, chunk_size) arrays stay bounded
+whatever the number of events of a model file.
+
+Conventions:
+- The layer terms are amounts, in the currency of the event losses.
+- The ceded amount of a year is allocated to the model files of the layer pro rata to their occurrence recoveries.
+
+Functions:
+- get_year_axis(n_years): Get the simulated years of several ELTs.
+- aggregate_occurrence_losses(event_years, event_losses, years, occ_limit, occ_deduct, chunk_size): Apply the
+  occurrence terms of several layers to an ELT and sum the gross losses and recoveries by year.
+- get_ceded_amount(recovery, agg_limit, agg_deduct): Apply the aggregate terms to annual recoveries.
+- price_xs(occ_limit, occ_deduct, agg_limit, agg_deduct, links, elts, n_years, chunk_size): Price all the layers
+  and years at once.
+
+Dependencies:
+- numpy
+
+"""
+
+import numpy as np
+
+EVENT_CHUNK_SIZE = 1_000_000  # Maximum number of events processed at once
+
+
+def get_year_axis(n_years):
+    # The years of a simulation are numbered from 1, see flaskapp.pricing.simulation
+    return np.arange(1, max(n_years, default=0) + 1, dtype=np.int64)
+
+
+def aggregate_occurrence_losses(event_years, event_losses, years, occ_limit, occ_deduct, chunk_size=EVENT_CHUNK_SIZE):
+    """ Apply the occurrence terms of several layers to the events of one model file and sum them by year.
+
+    :param event_years: array of shape (n_events,)
+    :param event_losses: array of shape (n_events,)
+    :param years: sorted array of shape (n_years,) containing all the event years, see get_year_axis
+    :param occ_limit: array of shape (n_layers,)
+    :param occ_deduct: array of shape (n_layers,)
+    :return: (gross, recovery) where gross has shape (n_years,) and recovery has shape (n_layers, n_years)
+    """
+    event_years = np.asarray(event_years, dtype=np.int64)
+    event_losses = np.asarray(event_losses, dtype=np.float64)
+    occ_limit = np.asarray(occ_limit, dtype=np.float64)[:, np.newaxis]
+    occ_deduct = np.asarray(occ_deduct, dtype=np.float64)[:, np.newaxis]
+
+    # The segmented reductions need the events of a year to be contiguous
+    if np.any(np.diff(event_years) < 0):
+        order = np.argsort(event_years, kind='stable')
+        event_years = event_years[order]
+        event_losses = event_losses[order]
+
+    year_index = np.searchsorted(years, event_years)
+    gross = np.zeros(len(years), dtype=np.float64)
+    recovery = np.zeros((len(occ_limit), len(years)), dtype=np.float64)
+
+    for start in range(0, len(event_years), chunk_size):
+        index = year_index[start:start + chunk_size]
+        losses = event_losses[start:start + chunk_size]
+
+        # Position of the first event of each year in the chunk
+        # A year split between two chunks is summed in two parts, hence the += below
+        # https://numpy.org/doc/stable/reference/generated/numpy.ufunc.reduceat.html
+        starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+        chunk_years = index[starts]
+
+        gross[chunk_years] += np.add.reduceat(losses, starts)
+        event_recovery = np.minimum(occ_limit, np.maximum(0, losses - occ_deduct))  # (n_layers, n_events in chunk)
+        recovery[:, chunk_years] += np.add.reduceat(event_recovery, starts, axis=1)
+
+    return gross, recovery
+
+
+def get_ceded_amount(recovery, agg_limit, agg_deduct):
+    return np.minimum(agg_limit, np.maximum(0, recovery - agg_deduct))
+
+
+def price_xs(occ_limit, occ_deduct, agg_limit, agg_deduct, links, elts, n_years, chunk_size=EVENT_CHUNK_SIZE):
+    """ Price a set of occurrence excess of loss layers over the ELTs of their model files.
+
+    :param occ_limit: array of shape (n_layers,)
+    :param occ_deduct: array of shape (n_layers,)
+    :param agg_limit: array of shape (n_layers,)
+    :param agg_deduct: array of shape (n_layers,)
+    :param links: boolean array of shape (n_layers, n_models), True when the model file is linked to the layer
+    :param elts: list of (event_years, event_losses) pairs, one per model file
+    :param n_years: list of the numbers of simulated years, one per model file, the event years being between 1 and
+    the number of simulated years
+    :return: dictionary with
+        - 'years': (n_years,) array, the years from 1 to the largest number of simulated years
+        - 'recovery', 'ceded_layer', 'ceded_ratio': (n_layers, n_years) arrays for the layers as a whole, before
+          and after the aggregate terms
+        - 'layer_index', 'model_index': (n_pairs,) arrays giving the linked layer-model file pairs
+        - 'gross', 'ceded', 'net': (n_pairs, n_years) arrays of amounts by linked pair and year
+    """
+    links = np.asarray(links, dtype=bool)
+    occ_limit = np.asarray(occ_limit, dtype=np.float64)
+    occ_deduct = np.asarray(occ_deduct, dtype=np.float64)
+    years = get_year_axis(n_years)
+
+    # Only the linked layer-model file pairs are computed, as in flaskapp.pricing.stoploss
+    layer_index, model_index = np.nonzero(links)
+    gross = np.zeros((len(layer_index), len(years)), dtype=np.float64)
+    pair_recovery = np.zeros_like(gross)
+
+    # Each ELT is read once for all the layers linked to its model file
+    for j, (event_years, event_losses) in enumerate(elts):
+        pairs = np.flatnonzero(model_index == j)
+        if len(pairs) == 0:
+            continue
+        model_gross, model_recovery = aggregate_occurrence_losses(
+            event_years, event_losses, years,
+            occ_limit[layer_index[pairs]], occ_deduct[layer_index[pairs]],
+            chunk_size=chunk_size,
+        )
+        gross[pairs] = model_gross
+        pair_recovery[pairs] = model_recovery
+
+    # Annual recovery of each layer = sum of the recoveries of its model files, before the aggregate terms
+    recovery = np.zeros((len(links), len(years)), dtype=np.float64)
+    np.add.at(recovery, layer_index, pair_recovery)
+    ceded_layer = get_ceded_amount(
+        recovery,
+        np.asarray(agg_limit, dtype=np.float64)[:, np.newaxis],
+        np.asarray(agg_deduct, dtype=np.float64)[:, np.newaxis],
+    )
+
+    ceded_ratio = np.zeros_like(recovery)
+    np.divide(ceded_layer, recovery, out=ceded_ratio, where=recovery != 0)
+
+    ceded = pair_recovery * ceded_ratio[layer_index]
+    net = gross - ceded
+
+    return {
+        'years': years,
+        'recovery': recovery,
+        'ceded_layer': ceded_layer,
+        'ceded_ratio': ceded_ratio,
+        'layer_index': layer_index,
+        'model_index': model_index,
+        'gross': gross,
+        'ceded': ceded,
+        'net': net,
+    }
@@ -0,0 +1,144 @@
+"""
+This module defines the export of the complete YLT of a result file, streamed as CSV, Parquet or Arrow IPC.
+
+The YLT has one row per result layer, model file and simulated year, with the gross, ceded and net amounts. It is
+read batch by batch (see flaskapp.pricing.columnar.iter_resultlayer_ylt) and each batch is written to the response as
+soon as it is read, so that the download starts immediately and the memory does not depend on the size of the YLT:
+- CSV: the rows of each batch are appended to the text
+- Parquet: each batch is a row group of the file, the footer is written at the end
+- Arrow IPC: each batch is a record batch of the stream format
+
+Routes:
+- /export/resultfiles/<resultfile_id>/ylt.<fmt>: Download the YLT of a result file, fmt being csv, parquet or arrow.
+
+Dependencies:
+- numpy
+- pandas
+- pyarrow
+
+"""
+
+from flask import Blueprint, Response, abort, stream_with_context
+from flaskapp.extensions import session
+from flaskapp.models import *
+from flaskapp.pricing.columnar import iter_resultlayer_ylt
+from werkzeug.utils import secure_filename
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import io
+
+export = Blueprint('export', __name__)
+
+EXPORT_BATCH_ROWS = 100000  # Rows read from the database and written to the response at once
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+# Columns of the exported YLT
+SCHEMA = pa.schema([
+    ('layer', pa.string()),
+    ('layer_type', pa.string()),
+    ('model_id', pa.int64()),
+    ('model_name', pa.string()),
+    ('year', pa.int64()),
+    ('gross', pa.int64()),
+    ('ceded', pa.int64()),
+    ('net', pa.int64()),
+])
+
+
+class StreamBuffer(io.RawIOBase):
+    # Write-only file whose content is taken away after each batch, keeping the position for the Parquet footer
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_resultfile_batches(resultfile):
+    # Batches of the YLT of all the layers of the result file, as DataFrames with the columns of SCHEMA
+    model_names = {modelfile.id: modelfile.name for modelfile in resultfile.modelfiles}
+    layers = [(layer, 'stop loss') for layer in sorted(resultfile.layers, key=lambda layer: layer.name)] \
+        + [(layer, 'excess of loss') for layer in sorted(resultfile.xslayers, key=lambda layer: layer.name)]
+
+    for layer, layer_type in layers:
+        for batch in iter_resultlayer_ylt(layer, EXPORT_BATCH_ROWS):
+            n_rows = len(batch['year'])
+            yield pd.DataFrame({
+                'layer': np.full(n_rows, layer.name, dtype=object),
+                'layer_type': np.full(n_rows, layer_type, dtype=object),
+                'model_id': batch['model_id'].astype(np.int64),
+                'model_name': [model_names.get(model_id) for model_id in batch['model_id'].tolist()],
+                'year': batch['year'].astype(np.int64),
+                'gross': batch['gross'].astype(np.int64),
+                'ceded': batch['ceded'].astype(np.int64),
+                'net': batch['net'].astype(np.int64),
+            })
+
+
+def write_csv(batches):
+    yield ','.join(SCHEMA.names) + '\n'
+    for df in batches:
+        yield df.to_csv(header=False, index=False)
+
+
+def write_parquet(batches):
+    buffer = StreamBuffer()
+    # https://arrow.apache.org/docs/python/generated/pyarrow.parquet.ParquetWriter.html
+    with pq.ParquetWriter(buffer, SCHEMA) as writer:
+        for df in batches:
+            writer.write_table(pa.Table.from_pandas(df, schema=SCHEMA, preserve_index=False))
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+def write_arrow(batches):
+    buffer = StreamBuffer()
+    # https://arrow.apache.org/docs/python/ipc.html#writing-and-reading-streams
+    with pa.ipc.new_stream(buffer, SCHEMA) as writer:
+        for df in batches:
+            writer.write_batch(pa.RecordBatch.from_pandas(df, schema=SCHEMA, preserve_index=False))
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+WRITERS = {'csv': write_csv, 'parquet': write_parquet, 'arrow': write_arrow}
+
+
+@export.route('/export/resultfiles/<int:resultfile_id>/ylt.<fmt>')
+def export_resultfile_ylt(resultfile_id, fmt):
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+    resultfile = session.get(ResultFile, resultfile_id)
+    if resultfile is None:
+        abort(404)
+
+    # stream_with_context keeps the application context, and the session, while the response is streamed
+    # https://flask.palletsprojects.com/en/2.2.x/patterns/streaming/
+    filename = secure_filename(f'{resultfile.name} YLT.{fmt}') or f'ylt.{fmt}'
+    return Response(
+        stream_with_context(WRITERS[fmt](iter_resultfile_batches(resultfile))),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
@@ -0,0 +1,33 @@
+"""Drop YLT blob reference counts
+
+Revision ID: c9b9ce8ca1b1
+Revises: d66186894a05
+Create Date: 2026-10-16 23:52:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9b9ce8ca1b1'
+down_revision = 'd66186894a05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The references are the yltblob_id foreign keys, see flaskapp.pricing.columnar.delete_unreferenced_yltblobs
+    with op.batch_alter_table('yltblob', schema=None) as batch_op:
+        batch_op.drop_column('ref_count')
+
+
+def downgrade():
+    with op.batch_alter_table('yltblob', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('ref_count', sa.Integer(), nullable=False, server_default='0'))
+
+    op.execute(
+        'UPDATE yltblob SET ref_count = '
+        '(SELECT COUNT(*) FROM modelfile WHERE modelfile.yltblob_id = yltblob.id) + '
+        '(SELECT COUNT(*) FROM resultmodelfile WHERE resultmodelfile.yltblob_id = yltblob.id)'
+    )